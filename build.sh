@@ -22,6 +22,9 @@ fi
 # Clean up
 /bin/rm ${BUILD_OUT} &> /dev/null
 
+# The catalog index is built from the mirrored property lists, it isn't kept in the repository.
+${LOCAL_PYTHON} support_utils/build_index.py || exit 1
+
 # Build
 eval ${DIST_CMD}
 
@@ -27,23 +27,11 @@ from datetime import datetime
 from pprint import pprint  # NOQA
 
 try:
-    from loopslib import applications
     from loopslib import arguments
     from loopslib import config
-    from loopslib import diskusage
-    from loopslib import deployment
-    from loopslib import dmg
-    from loopslib import misc
-    from loopslib import process_source
 except ModuleNotFoundError:
-    from .loopslib import applications
     from .loopslib import arguments
     from .loopslib import config
-    from .loopslib import diskusage
-    from .loopslib import deployment
-    from .loopslib import dmg
-    from .loopslib import misc
-    from .loopslib import process_source
 
 
 # pylint: disable=invalid-name
@@ -76,6 +64,49 @@ def main():
     _args = arguments.LoopsArguments()
     args = _args.parse_args()
 
+    # Everything else is imported once the arguments have been parsed, so arguments
+    # that exit straight away (such as '--help') don't pay for it.
+    # pylint: disable=redefined-outer-name
+    try:
+        from loopslib import applications
+        from loopslib import curl_requests
+        from loopslib import diskusage
+        from loopslib import deployment
+        from loopslib import dmg
+        from loopslib import http_pool
+        from loopslib import journal
+        from loopslib import manifest
+        from loopslib import mirror_gc
+        from loopslib import mirror_sync
+        from loopslib import misc
+        from loopslib import option_packs
+        from loopslib import plan
+        from loopslib import process_source
+        from loopslib import remote_plist
+        from loopslib import server
+        from loopslib import store
+        from loopslib import verify
+    except ModuleNotFoundError:
+        from .loopslib import applications
+        from .loopslib import curl_requests
+        from .loopslib import diskusage
+        from .loopslib import deployment
+        from .loopslib import dmg
+        from .loopslib import http_pool
+        from .loopslib import journal
+        from .loopslib import manifest
+        from .loopslib import mirror_gc
+        from .loopslib import mirror_sync
+        from .loopslib import misc
+        from .loopslib import option_packs
+        from .loopslib import plan
+        from .loopslib import process_source
+        from .loopslib import remote_plist
+        from .loopslib import server
+        from .loopslib import store
+        from .loopslib import verify
+    # pylint: enable=redefined-outer-name
+
     # Logging
     config_logging(log_level=args.log_level)
 
@@ -94,9 +125,40 @@ def main():
     # Debug log stats
     misc.debug_log_stats()
 
+    # Serving packages doesn't process any feeds.
+    if config.SERVE_PATH:
+        server.serve(root=config.SERVE_PATH, port=config.SERVE_PORT)
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        logging.info('------------------ Log closed on {} ------------------'.format(now))
+        return
+
+    # Garbage collection reads the feeds itself, every supported feed unless '-p/--plists' is given.
+    if config.MIRROR_GC:
+        gc = mirror_gc.MirrorGC(feeds=config.PLISTS_TO_PROCESS)
+
+        try:
+            gc.run()
+        except IOError as _e:
+            _msg = 'Mirror GC: {}, nothing removed.'.format(_e)
+            logging.info(_msg)
+            print(_msg)
+            sys.exit(1)
+
+        logging.info(gc.message)
+
+        if not config.SILENT:
+            print(gc.message)
+
+        http_pool.POOL.close_all()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        logging.info('------------------ Log closed on {} ------------------'.format(now))
+        return
+
     # Continue on if there are apps/plists to process.
     apps_as_source = None
     plists_as_source = None
+    plans_as_source = None
 
     # Some output indicating work is underway
     if not (config.QUIET or config.SILENT):
@@ -107,7 +169,18 @@ def main():
         sparse = dmg.BuildDMG()
         sparse.mount(dmg=config.HTTP_DMG_PATH, read_only=True)  # Force read only so no delete!
 
-    if config.APPS_TO_PROCESS:
+    if config.PLAN_IN:
+        try:
+            deployment_plan = plan.DeploymentPlan(config.PLAN_IN)
+        except plan.PlanError as _e:
+            _msg = 'Deployment plan: {}'.format(_e)
+            logging.info(_msg)
+            print(_msg)
+            sys.exit(1)
+
+        logging.info(deployment_plan.message)
+        plans_as_source = [deployment_plan]
+    elif config.APPS_TO_PROCESS:
         garageband = applications.Application('garageband') if 'garageband' in config.APPS_TO_PROCESS else None
         logicpro = applications.Application('logicpro') if 'logicpro' in config.APPS_TO_PROCESS else None
         mainstage = applications.Application('mainstage') if 'mainstage' in config.APPS_TO_PROCESS else None
@@ -116,17 +189,64 @@ def main():
     elif config.PLISTS_TO_PROCESS:
         plists_as_source = config.PLISTS_TO_PROCESS
 
+    # Listing the option packs doesn't process any packages.
+    if config.LIST_PACKS:
+        if apps_as_source:
+            _sources = [_app for _app in apps_as_source if _app is not None and _app.is_installed]
+        else:
+            _sources = [remote_plist.RemotePlist(obj=_plist) for _plist in plists_as_source]
+
+        option_packs.show_packs([_src.catalog for _src in _sources if _src.catalog])
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        logging.info('------------------ Log closed on {} ------------------'.format(now))
+        return
+
     # Processed apps go into single instance of 'ProcessedApplications'.
     if apps_as_source:
         packages = process_source.ProcessedSource(apps=apps_as_source)
     elif plists_as_source:
         packages = process_source.ProcessedSource(plists=plists_as_source)
+    elif plans_as_source:
+        packages = process_source.ProcessedSource(plans=plans_as_source)
 
     if not config.SILENT:
         print('{}\n'.format(packages.stats_message))
 
+    if config.PLAN_OUT:
+        try:
+            _qty = plan.export(config.PLAN_OUT, packages)
+        except (IOError, OSError) as _e:
+            _msg = 'Unable to write deployment plan {}: {}'.format(config.PLAN_OUT, _e)
+            logging.info(_msg)
+            print(_msg)
+            sys.exit(1)
+
+        _msg = 'Wrote deployment plan {} ({} packages)'.format(config.PLAN_OUT, _qty)
+        logging.info(_msg)
+
+        if not config.SILENT:
+            print(_msg)
+
+    # Packages that fail the check exit with an error once everything else is done.
+    failed = False
+
     # Process packages
-    if packages.all:
+    if packages.all and config.VERIFY:
+        verifier = verify.TreeVerifier(packages.all)
+        failed = bool(verifier.run())
+        logging.info(verifier.message)
+
+        if not config.SILENT:
+            print(verifier.message, file=sys.stderr)
+    elif packages.all and config.MIRROR_SYNC:
+        sync = mirror_sync.MirrorSync(packages.all)
+        failed = bool(sync.run())
+        logging.info(sync.message)
+
+        if not config.SILENT:
+            print(sync.message)
+    elif packages.all and not config.PLAN_ONLY:
         if config.DEPLOY_PKGS or config.FORCED_DEPLOYMENT:
             if not disk.has_space(space_requested=packages.total_size_req):
                 _msg = ('Insufficient space to download and install packages. Free up more space to continue. '
@@ -149,17 +269,38 @@ def main():
         package = deployment.LoopDeployment()
 
         # Do the stuff.
-        _l = len(packages.all)
-        for pkg in packages.all:
-            _i = packages.all.index(pkg) + 1
-            _i = '{i:0{width}d}'.format(width=len(str(_l)), i=_i)
-            _ctr_msg = '{} of {}'.format(_i, _l)
-            package.process(pkg, counter_msg=_ctr_msg)
+        if (config.DEPLOY_PKGS or config.FORCED_DEPLOYMENT) and config.PIPELINE and not config.HTTP_DMG:
+            package.deploy(packages.all)
+        elif config.DEPLOY_PKGS or config.FORCED_DEPLOYMENT:
+            _l = len(packages.all)
+
+            for _i, pkg in enumerate(packages.all, start=1):
+                _ctr_msg = deployment.counter_msg(_i, _l)
+                package.process(pkg, counter_msg=_ctr_msg)
+        else:
+            package.download(packages.all)
 
         # Tidy up any temp items, only if this is not a download!
         if args.deployment or args.force_deployment:
             misc.tidy_up()
 
+    # Close any idle pooled connections.
+    http_pool.POOL.close_all()
+    logging.info(curl_requests.REQUESTS.message)
+
+    if http_pool.HEDGES.hedged:
+        logging.info(http_pool.HEDGES.message)
+
+    if config.STORE_PATH:
+        store.STORE.save()
+        logging.info(store.STORE.message)
+
+    if journal.JOURNAL.skipped:
+        logging.info(journal.JOURNAL.message)
+
+    if manifest.MANIFEST.verified or manifest.MANIFEST.corrupt:
+        logging.info(manifest.MANIFEST.message)
+
     # Unmount HTTP DMG
     if config.HTTP_DMG:
         sparse.eject(dmg=config.DMG_VOLUME_MOUNTPATH)
@@ -171,6 +312,9 @@ def main():
     # The last thing logged.
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     logging.info('------------------ Log closed on {} ------------------'.format(now))
+
+    if failed:
+        sys.exit(1)
 # pylint: enable=too-many-statements
 # pylint: enable=too-many-branches
 # pylint: enable=missing-docstring
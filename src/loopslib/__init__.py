@@ -1,21 +1,45 @@
-"""Initialises package with imports."""
+"""Initialises package with imports. Modules are imported the first time they are used
+(for example 'loopslib.catalog'), so importing one module doesn't import all of them."""
 # pylint: disable=multiple-statements
 import sys; sys.dont_write_bytecode = True  # NOQA
+import importlib
 import logging
 # pylint: enable=multiple-statements
 
-from . import applications
-from . import arguments
-from . import compare
-from . import config
-from . import curl_requests
-from . import deployment
-from . import diskusage
-from . import dmg
-from . import misc
-from . import package
-from . import plist
-from . import supported
-from . import version
+MODULES = ['applications',
+           'arguments',
+           'catalog',
+           'compare',
+           'config',
+           'curl_requests',
+           'deployment',
+           'diskusage',
+           'dmg',
+           'feed_cache',
+           'http_pool',
+           'journal',
+           'manifest',
+           'mirrors',
+           'mirror_gc',
+           'mirror_sync',
+           'misc',
+           'package',
+           'plan',
+           'plist',
+           'receipts',
+           'server',
+           'store',
+           'supported',
+           'verify',
+           'version']
+
+
+def __getattr__(name):
+    """Imports the module 'name' on first use."""
+    if name not in MODULES:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    return importlib.import_module('.{}'.format(name), __name__)
+
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
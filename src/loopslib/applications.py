@@ -3,26 +3,21 @@ import logging
 import os
 import re
 import sys
-import tempfile
 
 from distutils.version import LooseVersion
 from glob import glob
 
 # pylint: disable=relative-import
 try:
-    import bad_wolf
+    import catalog
     import config
-    import curl_requests
-    import option_packs
-    import package
+    import feed_cache
     import plist
     import supported
 except ImportError:
-    from . import bad_wolf
+    from . import catalog
     from . import config
-    from . import curl_requests
-    from . import option_packs
-    from . import package
+    from . import feed_cache
     from . import plist
     from . import supported
 # pylint: enable=relative-import
@@ -109,7 +104,6 @@ class Application(object):
 
                     _url = None
                     _failover_url = None
-                    _tmp_dir = os.path.join(tempfile.gettempdir(), config.BUNDLE_ID)
                     _file = None
                     _app_ver = self._app_info.get('CFBundleShortVersionString', None).replace('.', '')
                     _supported_plists = [_value for _key, _value in supported.SUPPORTED.items() if self._app in _value]
@@ -140,20 +134,12 @@ class Application(object):
                     if _file:
                         _url = '{}/{}/{}'.format(config.AUDIOCONTENT_URL, config.LP10_MS3_CONTENT, _file)
                         _failover_url = '{}/{}/{}'.format(config.AUDIOCONTENT_FAILOVER_URL, config.LP10_MS3_CONTENT, _file)
-                        _tmp_file = os.path.join(_tmp_dir, _file)
-                        _req = curl_requests.CURL(url=_url)
+                        _feed = feed_cache.CACHE.get(_file, [_url, _failover_url])
 
-                        # NOTE 2019-11-04: Seems that using the 'resume' capability in cURL does not
-                        # work here now for some reason, so don't resume.
-                        if _req.status in config.HTTP_OK_STATUS:
-                            _req.get(url=_url, output=_tmp_file, resume=False)
+                        if _feed:
+                            result = _feed
                         else:
-                            _req.get(url=_failover_url, output=_tmp_file, resume=False)
-
-                        if os.path.exists(_tmp_file):
-                            result = _tmp_file
-                        else:
-                            LOG.debug('File {} not found.'.format(_tmp_file))
+                            LOG.debug('File {} not found.'.format(_file))
                             LOG.debug('URL for replacement file: {}'.format(_url))
                             LOG.debug('Failover URL for replacement file: {}'.format(_failover_url))
 
@@ -170,56 +156,45 @@ class Application(object):
 
         return result
 
-    def _get_packages(self):
-        """Returns a set of all packages (as object instances). Also patches any 'issues'
-        that resolve known issues with Apple's audiocontentdownload mirrored files."""
+    def _get_catalog(self):
+        """Returns the parsed catalog of the feed property list. The feed is only read, patched,
+        and turned into package objects the first time, see 'catalog.CatalogCache'."""
         result = None
 
         if self.plist_file_path:
-            _basename = os.path.basename(self.plist_file_path)
-
-            _bad_wolf_fixes = bad_wolf.BAD_WOLF_PKGS.get(_basename, None)
-            _bwd = None
-
-            _root = plist.readPlist(self.plist_file_path)
-
-            if _root:
-                result = set()
-
-                # Apply 'Bad Wolf' pathches
-                for _pkg in _root['Packages']:
-                    _new_pkg = _root['Packages'][_pkg].copy()  # Work on copy
-
-                    # Create a new key called 'PackageName' that
-                    # contains the value '_pkg' for use with content packs.
-                    _new_pkg['PackageName'] = _pkg
+            result = catalog.CACHE.load(self.plist_file_path)
 
-                    if _bad_wolf_fixes:
-                        _bwd = _bad_wolf_fixes.get(_pkg, None)  # A dictionary from '_bad_wolf_fixes'
+            # Now process option packs
+            self.option_packs = result.option_packs
 
-                    # Merge new/existing keys from matching '_bwd'
-                    if _bwd:
-                        _new_pkg.update(_bwd)
+        return result
 
-                    _pkg_obj = package.LoopPackage(**_new_pkg)
+    def _get_packages(self):
+        """Returns a set of all packages (as object instances). Also patches any 'issues'
+        that resolve known issues with Apple's audiocontentdownload mirrored files."""
+        result = None
 
-                    # pylint: disable=no-member
-                    # Only add/process packages that are _not_ 'BadWolfIgnore = True'
-                    if not _pkg_obj.BadWolfIgnore:
-                        result.add(_pkg_obj)
-                    # pylint: enable=no-member
+        _catalog = self._get_catalog()
 
-                # Now process option packs
-                self.option_packs = option_packs.OptionPack(source=_root, release=_basename).option_packs
+        if _catalog:
+            result = _catalog.packages
 
         return result
 
+    @property
+    def catalog(self):
+        """Returns the parsed catalog of the feed property list, or 'None' if there isn't one."""
+        return self._get_catalog()
+
     @property
     def mandatory_pkgs(self):
         """Returns the mandatory packages as objects in a set."""
         result = None
 
-        result = set([_pkg for _pkg in self._get_packages() if _pkg.IsMandatory])
+        _catalog = self._get_catalog()
+
+        if _catalog:
+            result = _catalog.mandatory_pkgs
 
         return result
 
@@ -228,7 +203,10 @@ class Application(object):
         """Returns the optional packages as objects in a set."""
         result = None
 
-        result = set([_pkg for _pkg in self._get_packages() if not _pkg.IsMandatory])
+        _catalog = self._get_catalog()
+
+        if _catalog:
+            result = _catalog.optional_pkgs
 
         return result
 # pylint: enable=too-many-instance-attributes
@@ -15,13 +15,11 @@ from operator import attrgetter
 # pylint: disable=relative-import
 try:
     import arguments_config
-    import compare
     import config
     import misc
     import supported
 except ImportError:
     from . import arguments_config
-    from . import compare
     from . import config
     from . import misc
     from . import supported
@@ -136,7 +134,7 @@ class LoopsArguments(object):
         """Internal method to quickly print out build dmg/download/force download arg requirement."""
         self.parser.print_usage(sys.stderr)
         _msg = ('{}: {}: not allowed without argument -b/--build-dmg or -d/--destination '
-                'or -f/--force-destination'.format(err_msg, arg))
+                'or -f/--force-destination or --verify or --mirror-sync or --mirror-gc or --plan-out'.format(err_msg, arg))
         print(_msg)
         LOG.info(_msg)
         sys.exit(1)
@@ -166,6 +164,25 @@ class LoopsArguments(object):
                 LOG.info(_msg)
                 sys.exit(1)
 
+        # Option packs only hold optional packages.
+        if result.packs:
+            result.packs = [_pack.strip() for _pack in result.packs.split(',') if _pack.strip()]
+
+            if not result.packs:
+                _msg = '{} --packs: expected at least one pack name'.format(_err_msg)
+                print(_msg)
+                LOG.info(_msg)
+                sys.exit(1)
+
+            result.optional = True
+
+        if result.plan_in and (result.packs or result.list_packs):
+            self.parser.print_usage(sys.stderr)
+            _msg = '{} --plan-in: not allowed with argument --packs or --list-packs'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
         # Check that at least on of the three apps is provided for download flag '-a/--apps'
         if result.apps:
             _arg = '-a/--apps'
@@ -184,13 +201,14 @@ class LoopsArguments(object):
                     LOG.info(_msg)
                     sys.exit(1)
 
-            if not (result.mandatory or result.optional):
+            if not (result.mandatory or result.optional or result.list_packs):
                 self._mand_opt_check(err_msg=_err_msg, arg=_arg)
 
             # Even though presumption can be made about downloading to a temporary
             # directory, can't assume that this is actually what is intended,
             # so require specific argument to inform what action is to be taken.
-            if not (result.build_dmg or result.download or result.force_download):
+            if not (result.build_dmg or result.download or result.force_download or result.verify or
+                    result.mirror_sync or result.plan_out or result.list_packs):
                 if not (result.deployment or result.force_deployment):
                     self._dmg_download_force_download_check(err_msg=_err_msg, arg=_arg)
 
@@ -217,7 +235,8 @@ class LoopsArguments(object):
             elif 'allpkgs' not in result.plists:
                 result.plists = [config.SUPPORTED_PLISTS.get(_plist) for _plist in result.plists]
 
-            if not (result.mandatory or result.optional):
+            # Garbage collection keeps every package the feeds refer to.
+            if not (result.mandatory or result.optional or result.mirror_gc or result.list_packs):
                 self._mand_opt_check(err_msg=_err_msg, arg=_arg)
 
             # While it is possible to use the `-a/--apps` argument with the deployment arguments,
@@ -228,9 +247,38 @@ class LoopsArguments(object):
             # Even though presumption can be made about downloading to a temporary
             # directory, can't assume that this is actually what is intended,
             # so require specific argument to inform what action is to be taken.
-            if not (result.build_dmg or result.download or result.force_download):
+            if not (result.build_dmg or result.download or result.force_download or result.verify or
+                    result.mirror_sync or result.mirror_gc or result.plan_out or result.list_packs):
                 self._dmg_download_force_download_check(err_msg=_err_msg, arg=_arg)
 
+        # Handle plan argument exceptions
+        if result.plan_in:
+            _arg = '--plan-in'
+
+            for _other, _value in [('-a/--apps', result.apps), ('--plan-out', result.plan_out)]:
+                if _value:
+                    self.parser.print_usage(sys.stderr)
+                    _msg = '{} {}: not allowed with argument {}'.format(_err_msg, _arg, _other)
+                    print(_msg)
+                    LOG.info(_msg)
+                    sys.exit(1)
+
+            if not os.path.isfile(result.plan_in[0]):
+                _msg = '{} {}: the specified file {} does not exist.'.format(_err_msg, _arg, result.plan_in[0])
+                print(_msg)
+                LOG.info(_msg)
+                sys.exit(1)
+
+            # The plan only holds the packages that were asked for when it was written.
+            if not (result.mandatory or result.optional):
+                result.mandatory = True
+                result.optional = True
+
+            if not (result.build_dmg or result.download or result.force_download or result.verify or
+                    result.mirror_sync):
+                if not (result.deployment or result.force_deployment):
+                    self._dmg_download_force_download_check(err_msg=_err_msg, arg=_arg)
+
         # Test if user is root for deploy/force deploy modes
         if not result.dry_run:
             if result.deployment:
@@ -245,10 +293,17 @@ class LoopsArguments(object):
                 sys.exit(1)
 
         # Handle some checking for more specific circumstances.
-        if (result.download or result.force_download or result.deployment or result.force_deployment):
+        if (result.download or result.force_download or result.deployment or result.force_deployment or
+                result.verify or result.mirror_sync):
             if result.download:
                 _arg = '-d/--destination'
 
+            if result.verify:
+                _arg = '--verify'
+
+            if result.mirror_sync:
+                _arg = '--mirror-sync'
+
             if result.force_download:
                 _arg = '-f/--force-destination'
 
@@ -264,6 +319,81 @@ class LoopsArguments(object):
                 LOG.info(_msg)
                 sys.exit(1)
 
+        if result.pipeline and not (result.deployment or result.force_deployment):
+            self.parser.print_usage(sys.stderr)
+            _msg = '{} --pipeline: not allowed without argument --deployment or --force-deploy'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
+        if result.jobs < 1:
+            _msg = '{} -j/--jobs: must be at least 1'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
+        if result.segments < 1:
+            _msg = '{} --segments: must be at least 1'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
+        if result.stall_time < 1:
+            _msg = '{} --stall-time: must be at least 1'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
+        if result.connect_timeout < 1:
+            _msg = '{} --connect-timeout: must be at least 1'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
+        if result.store_size is not None and not result.store:
+            _msg = '{} --store-size: not allowed without argument --store'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
+        if result.mirror_gc:
+            if result.apps:
+                _msg = '{} --mirror-gc: not allowed with argument -a/--apps'.format(_err_msg)
+                print(_msg)
+                LOG.info(_msg)
+                sys.exit(1)
+
+            if not os.path.isdir(result.mirror_gc[0]):
+                _msg = '{} --mirror-gc: the specified path {} does not exist.'.format(_err_msg, result.mirror_gc[0])
+                print(_msg)
+                LOG.info(_msg)
+                sys.exit(1)
+
+        if result.serve:
+            if not os.path.isdir(result.serve[0]):
+                _msg = '{} --serve: the specified path {} does not exist.'.format(_err_msg, result.serve[0])
+                print(_msg)
+                LOG.info(_msg)
+                sys.exit(1)
+
+            if not 0 < result.serve_port < 65536:
+                _msg = '{} --serve-port: must be between 1 and 65535'.format(_err_msg)
+                print(_msg)
+                LOG.info(_msg)
+                sys.exit(1)
+
+        if result.hedge is not None and result.hedge < 1:
+            _msg = '{} --hedge: must be at least 1'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
+        if result.hedge_rate and result.hedge is None:
+            _msg = '{} --hedge-rate: not allowed without argument --hedge'.format(_err_msg)
+            print(_msg)
+            LOG.info(_msg)
+            sys.exit(1)
+
         if result.cache_server:
             _arg = '--cache-server'
             _cs = result.cache_server[0]
@@ -304,10 +434,19 @@ class LoopsArguments(object):
             supported.show_supported_plists()
 
         if result.compare:
+            # Only needed when comparing, so imported here to keep startup quick.
+            # pylint: disable=relative-import
+            try:
+                import compare
+            except ImportError:
+                from . import compare
+            # pylint: enable=relative-import
+
             compare.differences(file_a=result.compare[0], file_b=result.compare[1])
 
         # Set "globals" here rather than in '__main__.py'
-        if not result.plists:
+        # Serving packages doesn't process any apps or feeds.
+        if not (result.plists or result.serve or result.mirror_gc or result.plan_in):
             config.APPS_TO_PROCESS = result.apps if result.apps else misc.find_installed_apps()
 
         if not result.apps:
@@ -317,6 +456,9 @@ class LoopsArguments(object):
             config.CURL_HTTP1 = False if result.http2 else True
             config.CURL_HTTP_ARG = '--http2'
 
+        # The native HTTP client only speaks HTTP/1.1, so HTTP/2 requires cURL.
+        config.HTTP_BACKEND = 'curl' if (result.curl or result.http2) else 'native'
+
         config.ALLOW_INSECURE_CURL = result.insecure
         config.ALLOW_UNSECURE_PKGS = result.unsecure
         config.APFS_DMG = result.apfs_dmg
@@ -330,13 +472,51 @@ class LoopsArguments(object):
         config.CURL_HTTP1 = False if result.http2 else True
         config.LOCAL_HTTP_SERVER = result.pkg_server[0].rstrip('/') if result.pkg_server else None
         config.MANDATORY = result.mandatory
+        config.OFFLINE = result.offline
+        config.RANK_MIRRORS = result.fastest_mirror
         config.OPTIONAL = result.optional
         config.QUIET = result.quiet
         config.SILENT = result.silent
         config.INST_SLEEP = str(result.sleep) if result.sleep else None
         config.CURL_RETRIES = result.retries
+        config.DOWNLOAD_JOBS = result.jobs
+        config.PIPELINE = result.pipeline
+        config.PIPELINE_BUDGET = result.pipeline_budget * 1024 * 1024
+        config.SEGMENTS = result.segments
+        config.SERVE_PATH = result.serve[0] if result.serve else None
+        config.SERVE_PORT = result.serve_port
+        config.HEDGE_DELAY = result.hedge
+        config.STORE_PATH = result.store[0] if result.store else None
+        config.STORE_SIZE = result.store_size * 1024 * 1024 * 1024 if result.store_size else None
+        config.CONNECT_TIMEOUT = result.connect_timeout
+        config.STALL_SPEED = result.stall_speed * 1024 if result.stall_speed > 0 else None
+        config.STALL_TIME = result.stall_time
+        config.HEDGE_MIN_RATE = result.hedge_rate * 1024 if result.hedge_rate else None
+        config.SEGMENT_THRESHOLD = result.segment_threshold * 1024 * 1024
         config.TARGET = result.install_target[0] if result.install_target else config.TARGET
 
+        # A destination being checked is where its packages are looked for.
+        if result.verify:
+            config.VERIFY = True
+            config.DESTINATION_PATH = result.verify[0]
+
+        if result.mirror_sync:
+            config.MIRROR_SYNC = True
+            config.DESTINATION_PATH = result.mirror_sync[0]
+
+        config.PACKS = result.packs
+        config.LIST_PACKS = result.list_packs
+        config.PLAN_IN = result.plan_in[0] if result.plan_in else None
+        config.PLAN_OUT = result.plan_out[0] if result.plan_out else None
+        config.PLAN_ONLY = bool(result.plan_out) and not (result.build_dmg or result.download or
+                                                          result.force_download or result.deployment or
+                                                          result.force_deployment or result.verify or
+                                                          result.mirror_sync)
+
+        if result.mirror_gc:
+            config.MIRROR_GC = True
+            config.DESTINATION_PATH = result.mirror_gc[0]
+
         # Handle result.download/result.force_download
         if result.download or result.force_download:
             if result.download:
@@ -29,6 +29,18 @@ CL_ARGUMENTS = {
                                 'metavar': 'https://example.org:12345',
                                 'help': 'specify a local Apple caching server',
                                 'required': False}},
+    'connect_timeout': {'args': ['--connect-timeout'],
+                        'kwargs': {'type': int,
+                                   'dest': 'connect_timeout',
+                                   'metavar': '<seconds>',
+                                   'default': 30,
+                                   'help': 'specify the maximum time to wait for a connection - default is 30',
+                                   'required': False}},
+    'curl': {'args': ['--curl'],
+             'kwargs': {'action': 'store_true',
+                        'dest': 'curl',
+                        'help': 'use the cURL binary for requests instead of the native HTTP client',
+                        'required': False}},
     'dry_run': {'args': ['-n', '--dry-run'],
                 'kwargs': {'action': 'store_true',
                            'dest': 'dry_run',
@@ -37,8 +49,30 @@ CL_ARGUMENTS = {
     'http2': {'args': ['--http2'],
               'kwargs': {'action': 'store_true',
                          'dest': 'http2',
-                         'help': 'forces cURL to use http2',
+                         'help': 'forces cURL to use http2 (implies --curl)',
+                         'required': False}},
+    'fastest_mirror': {'args': ['--fastest-mirror'],
+                       'kwargs': {'action': 'store_true',
+                                  'dest': 'fastest_mirror',
+                                  'help': ('measure the package server, caching server, and Apple, and download '
+                                           'from the fastest'),
+                                  'required': False}},
+    'hedge': {'args': ['--hedge'],
+              'kwargs': {'type': int,
+                         'dest': 'hedge',
+                         'metavar': '<seconds>',
+                         'default': None,
+                         'help': ('also request a package from the next source if the first has not sent any '
+                                  'data after the specified number of seconds, keeping whichever finishes first'),
                          'required': False}},
+    'hedge_rate': {'args': ['--hedge-rate'],
+                   'kwargs': {'type': int,
+                              'dest': 'hedge_rate',
+                              'metavar': '<kilobytes>',
+                              'default': None,
+                              'help': ('with --hedge, also hedge if the first source is sending less than the '
+                                       'specified number of kilobytes per second'),
+                              'required': False}},
     'insecure': {'args': ['-i', '--allow-insecure'],
                  'kwargs': {'action': 'store_true',
                             'dest': 'insecure',
@@ -51,6 +85,18 @@ CL_ARGUMENTS = {
                                   'metavar': '<target>',
                                   'help': 'installs packages to the specified target',
                                   'required': False}},
+    'jobs': {'args': ['-j', '--jobs'],
+             'kwargs': {'type': int,
+                        'dest': 'jobs',
+                        'metavar': '<jobs>',
+                        'default': 1,
+                        'help': 'specify the number of packages to download at the same time - default is 1',
+                        'required': False}},
+    'list_packs': {'args': ['--list-packs'],
+                   'kwargs': {'action': 'store_true',
+                              'dest': 'list_packs',
+                              'help': 'lists the option packs of each property list, with their download and install sizes',
+                              'required': False}},
     'log': {'args': ['-l', '--log-level'],
             'kwargs': {'type': str,
                        'dest': 'log_level',
@@ -64,11 +110,37 @@ CL_ARGUMENTS = {
                              'dest': 'mandatory',
                              'help': 'processes the mandatory packages',
                              'required': False}},
+    'offline': {'args': ['--offline'],
+                'kwargs': {'action': 'store_true',
+                           'dest': 'offline',
+                           'help': 'only use feed property lists already in the feed cache, without checking for updates',
+                           'required': False}},
     'optional': {'args': ['-o', '--optional'],
                  'kwargs': {'action': 'store_true',
                             'dest': 'optional',
                             'help': 'processes the optional packages',
                             'required': False}},
+    'packs': {'args': ['--packs'],
+              'kwargs': {'type': str,
+                         'dest': 'packs',
+                         'metavar': '<packs>',
+                         'help': ('only process the optional packages in the specified option packs, a comma '
+                                  'separated list of pack names (or parts of names that match a single pack), '
+                                  'for example "Drummer,OrchestralInstruments" (see --list-packs)'),
+                         'required': False}},
+    'pipeline': {'args': ['--pipeline'],
+                 'kwargs': {'action': 'store_true',
+                            'dest': 'pipeline',
+                            'help': 'download packages ahead of the installer when deploying',
+                            'required': False}},
+    'pipeline_budget': {'args': ['--pipeline-budget'],
+                        'kwargs': {'type': int,
+                                   'dest': 'pipeline_budget',
+                                   'metavar': '<megabytes>',
+                                   'default': 4096,
+                                   'help': ('specify the maximum size of downloaded packages waiting to be '
+                                            'installed when using --pipeline - default is 4096'),
+                                   'required': False}},
     'pkg_server': {'args': ['--pkg-server'],
                    'kwargs': {'type': str,
                               'nargs': 1,
@@ -76,6 +148,30 @@ CL_ARGUMENTS = {
                               'metavar': 'https://example.org/packages_path/',
                               'help': 'specify a local http/https mirror, or hosted dmg file',
                               'required': False}},
+    'plan_out': {'args': ['--plan-out'],
+                 'kwargs': {'type': str,
+                            'nargs': 1,
+                            'dest': 'plan_out',
+                            'metavar': '<file>',
+                            'help': ('write the packages to process, with their URLs, sizes and paths, to a JSON '
+                                     'deployment plan for use with --plan-in'),
+                            'required': False}},
+    'segments': {'args': ['--segments'],
+                 'kwargs': {'type': int,
+                            'dest': 'segments',
+                            'metavar': '<segments>',
+                            'default': 4,
+                            'help': ('specify the number of connections used to download each large package '
+                                     '- default is 4, 1 disables segmented downloads'),
+                            'required': False}},
+    'segment_threshold': {'args': ['--segment-threshold'],
+                          'kwargs': {'type': int,
+                                     'dest': 'segment_threshold',
+                                     'metavar': '<megabytes>',
+                                     'default': 128,
+                                     'help': ('specify the size a package must be to be downloaded over '
+                                              'several connections - default is 128'),
+                                     'required': False}},
     'retries': {'args': ['-r', '--retries'],
                 'kwargs': {'type': str,
                            'dest': 'retries',
@@ -83,6 +179,45 @@ CL_ARGUMENTS = {
                            'default': '5',
                            'help': 'specify the maximum number of times to retry downloading files - default is 5',
                            'required': False}},
+    'store': {'args': ['--store'],
+              'kwargs': {'type': str,
+                         'nargs': 1,
+                         'dest': 'store',
+                         'metavar': '<path>',
+                         'help': ('keep downloaded packages in a store shared by every run, and use packages '
+                                  'from it instead of downloading them again'),
+                         'required': False}},
+    'store_size': {'args': ['--store-size'],
+                   'kwargs': {'type': int,
+                              'dest': 'store_size',
+                              'metavar': '<gigabytes>',
+                              'default': None,
+                              'help': ('with --store, specify the maximum size of the store, the least recently '
+                                       'used packages are removed first'),
+                              'required': False}},
+    'stall_speed': {'args': ['--stall-speed'],
+                    'kwargs': {'type': int,
+                               'dest': 'stall_speed',
+                               'metavar': '<kilobytes>',
+                               'default': 1,
+                               'help': ('specify the speed a download must stay above to not be treated as '
+                                        'stalled and carried on from the next source - default is 1, 0 disables'),
+                               'required': False}},
+    'stall_time': {'args': ['--stall-time'],
+                   'kwargs': {'type': int,
+                              'dest': 'stall_time',
+                              'metavar': '<seconds>',
+                              'default': 30,
+                              'help': ('specify how long a download must be below --stall-speed to be treated '
+                                       'as stalled - default is 30'),
+                              'required': False}},
+    'serve_port': {'args': ['--serve-port'],
+                   'kwargs': {'type': int,
+                              'dest': 'serve_port',
+                              'metavar': '<port>',
+                              'default': 8000,
+                              'help': 'with --serve, specify the port to serve packages on - default is 8000',
+                              'required': False}},
     'sleep': {'args': ['--sleep'],
               'kwargs': {'type': str,
                          'dest': 'sleep',
@@ -146,6 +281,39 @@ CL_EXCL_GRP_ARGS_02 = {
                              'metavar': '<filename>',
                              'help': 'builds a DMG containing downloaded packages',
                              'required': False}},
+    'verify': {'args': ['--verify'],
+               'kwargs': {'type': str,
+                          'nargs': 1,
+                          'dest': 'verify',
+                          'metavar': '<destination>',
+                          'help': ('checks the packages in the specified destination, listing missing or corrupt '
+                                   'packages as JSON lines (use with -s/--silent for only the list)'),
+                          'required': False}},
+    'mirror_sync': {'args': ['--mirror-sync'],
+                    'kwargs': {'type': str,
+                               'nargs': 1,
+                               'dest': 'mirror_sync',
+                               'metavar': '<destination>',
+                               'help': ('download only the packages that are new or have changed since the last '
+                                        'sync to the specified destination'),
+                               'required': False}},
+    'mirror_gc': {'args': ['--mirror-gc'],
+                  'kwargs': {'type': str,
+                             'nargs': 1,
+                             'dest': 'mirror_gc',
+                             'metavar': '<destination>',
+                             'help': ('remove the packages in the specified destination that no supported feed '
+                                      '(or no feed given with -p/--plists) refers to (use with -n/--dry-run to '
+                                      'only list them)'),
+                             'required': False}},
+    'serve': {'args': ['--serve'],
+              'kwargs': {'type': str,
+                         'nargs': 1,
+                         'dest': 'serve',
+                         'metavar': '<path>',
+                         'help': ('serve the packages in the specified destination or store over HTTP, for use '
+                                  'with --pkg-server'),
+                         'required': False}},
     'compare': {'args': ['--compare'],
                 'kwargs': {'type': str,
                            'nargs': 2,
@@ -163,6 +331,14 @@ CL_EXCL_GRP_ARGS_03 = {
                          'metavar': '<plist>',
                          'help': 'specify a property list to process packages for',
                          'required': False}},
+    'plan_in': {'args': ['--plan-in'],
+                'kwargs': {'type': str,
+                           'nargs': 1,
+                           'dest': 'plan_in',
+                           'metavar': '<file>',
+                           'help': ('process the packages in a deployment plan written with --plan-out, instead '
+                                    'of reading the feeds'),
+                           'required': False}},
     'supported_plist': {'args': ['--supported-plists'],
                         'kwargs': {'action': 'store_true',
                                    'dest': 'show_plists',
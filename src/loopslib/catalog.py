@@ -0,0 +1,290 @@
+"""Contains the per run cache of parsed feed property lists, so each feed is read, patched,
+and turned into package objects once, no matter how often its packages are asked for.
+
+Also contains the precompiled index of the mirrored feeds in 'lp10_ms3_content_2016', which is
+built by 'support_utils/build_index.py' (which 'build.sh' runs) or 'support_utils/update.py',
+and shipped alongside this module. Feeds in the index are loaded from it instead of parsing (or
+downloading) the property list. A property list on disk is only loaded from the index if it is
+the feed the index was built from, otherwise it is parsed."""
+import hashlib
+import logging
+import os
+import pickle
+import pkgutil
+import threading
+
+# pylint: disable=relative-import
+try:
+    import bad_wolf
+    import option_packs
+    import package
+    import plist
+except ImportError:
+    from . import bad_wolf
+    from . import option_packs
+    from . import package
+    from . import plist
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+INDEX_FILE = 'catalog_index.pickle'
+INDEX_FORMAT = 3
+
+
+def bad_wolf_digest(release):
+    """Returns a digest of the 'Bad Wolf' patches for a release, used to tell if an index entry
+    was compiled with the patches currently in 'bad_wolf.BAD_WOLF_PKGS'."""
+    _fixes = bad_wolf.BAD_WOLF_PKGS.get(release, None)
+
+    return hashlib.sha1(repr(_fixes).encode('utf-8')).hexdigest()
+
+
+def feed_digest(plist_path):
+    """Returns the SHA-256 of the feed property list at 'plist_path' as a hex string, used to
+    tell if a feed has changed since a deployment plan was made from it."""
+    _hash = hashlib.sha256()
+
+    with open(plist_path, 'rb') as _f:
+        _hash.update(_f.read())
+
+    return _hash.hexdigest()
+
+
+def patched_packages(root, release):
+    """Generator of the package dictionaries in the feed 'root', with any 'Bad Wolf' patches
+    applied. Packages patched with 'BadWolfIgnore' are skipped."""
+    _bad_wolf_fixes = bad_wolf.BAD_WOLF_PKGS.get(release, None)
+    _bwd = None
+
+    for _pkg in root['Packages']:
+        _new_pkg = root['Packages'][_pkg].copy()  # Work on copy
+
+        # Create a new key called 'PackageName' that
+        # contains the value '_pkg' for use with content packs.
+        _new_pkg['PackageName'] = _pkg
+
+        if _bad_wolf_fixes:
+            _bwd = _bad_wolf_fixes.get(_pkg, None)  # A dictionary from '_bad_wolf_fixes'
+
+        # Merge new/existing keys from matching '_bwd'
+        if _bwd:
+            _new_pkg.update(_bwd)
+
+        # Only add/process packages that are _not_ 'BadWolfIgnore = True'
+        if not _new_pkg.get('BadWolfIgnore', None):
+            yield _new_pkg
+
+
+class Catalog(object):
+    """The packages and option packs of a feed property list, with any 'Bad Wolf'
+    patches applied. Feeds in the catalog index are loaded from the index."""
+    def __init__(self, plist_path):
+        self.plist_path = plist_path
+        self.release = os.path.basename(plist_path)
+
+        self.packages = set()
+        self.mandatory_pkgs = set()
+        self.optional_pkgs = set()
+        self.option_packs = None
+        self.digest = None
+
+        _entry = INDEX.get(self.release, plist_path=self.plist_path)
+
+        if _entry:
+            self._load(_entry)
+        else:
+            self._parse()
+
+    def _parse(self):
+        """Reads the property list and builds the package objects and option packs."""
+        _root = plist.readPlist(self.plist_path)
+
+        if _root:
+            self.digest = feed_digest(self.plist_path)
+
+            for _pkg in patched_packages(_root, self.release):
+                self.packages.add(package.LoopPackage(**_pkg))
+
+            self.mandatory_pkgs = set([_pkg for _pkg in self.packages if _pkg.IsMandatory])
+            self.optional_pkgs = self.packages.difference(self.mandatory_pkgs)
+
+            # Now process option packs
+            self.option_packs = option_packs.OptionPack(source=_root, release=self.release).option_packs
+            option_packs.add_sizes(self.option_packs, dict((_pkg.PackageName, (_pkg.DownloadSize or 0,
+                                                                               _pkg.InstalledSize or 0))
+                                                           for _pkg in self.packages))
+
+    def _load(self, entry):
+        """Builds the package objects and option packs from a catalog index entry."""
+        _fields = entry['fields']
+        self.digest = entry.get('sha256', None)
+
+        for _row in entry['packages']:
+            self.packages.add(package.LoopPackage(**dict(zip(_fields, _row))))
+
+        self.mandatory_pkgs = set([_pkg for _pkg in self.packages if _pkg.IsMandatory])
+        self.optional_pkgs = self.packages.difference(self.mandatory_pkgs)
+
+        self.option_packs = [option_packs.Pack(Name=_name, Description=_desc, Packages=set(_pkgs),
+                                               DownloadSize=_download_size, InstalledSize=_installed_size)
+                             for _name, _desc, _pkgs, _download_size, _installed_size in entry['option_packs']]
+
+
+class CatalogIndex(object):
+    """The precompiled catalog index. The index file is only read the first time a feed is
+    looked up in it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._feeds = None
+
+    def _load(self):
+        """Reads the index file, which is read with 'pkgutil' so it can be found inside
+        the zipapp too."""
+        result = dict()
+
+        try:
+            _index = pickle.loads(pkgutil.get_data(__name__, INDEX_FILE))
+        except Exception as _e:
+            LOG.debug('Unable to read catalog index: {}'.format(_e))
+            return result
+
+        if _index.get('format', None) == INDEX_FORMAT:
+            result = _index.get('feeds', dict())
+        else:
+            LOG.debug('Unsupported catalog index format: {}'.format(_index.get('format', None)))
+
+        LOG.debug('Catalog index contains {} feeds'.format(len(result)))
+
+        return result
+
+    def get(self, release, plist_path=None):
+        """Returns the index entry for the feed 'release' (for example 'logicpro1100.plist'),
+        or 'None' if the feed is not in the index or the entry is out of date. If 'plist_path'
+        is a property list on disk (such as the copy in an application bundle), the entry is
+        only returned if it was built from the same feed."""
+        result = None
+
+        with self._lock:
+            if self._feeds is None:
+                self._feeds = self._load()
+
+            result = self._feeds.get(release, None)
+
+        if result and result['bad_wolf'] != bad_wolf_digest(release):
+            LOG.debug('Catalog index entry for {} is out of date, ignoring'.format(release))
+            result = None
+
+        if result and plist_path and os.path.isfile(plist_path):
+            # The size is checked first, so most feeds that differ aren't hashed.
+            if (os.path.getsize(plist_path) != result['size'] or
+                    feed_digest(plist_path) != result['sha256']):
+                LOG.debug('{} differs from the catalog index entry for {}, ignoring'.format(plist_path, release))
+                result = None
+
+        return result
+
+    def __contains__(self, release):
+        return self.get(release) is not None
+
+
+def compile_index(plist_paths, output):
+    """Compiles the feed property lists in 'plist_paths' into the catalog index 'output'.
+    Packages are stored as rows of values, sharing one list of field names per feed. Option
+    packs are stored with their download and installed sizes, so listing them is instant."""
+    _feeds = dict()
+    _valid_kwargs = package.LoopPackage.VALID_KWARGS
+
+    for _path in sorted(plist_paths):
+        _release = os.path.basename(_path)
+        _root = plist.readPlist(_path)
+
+        if not _root:
+            LOG.debug('Unable to read {}, not indexed'.format(_path))
+            continue
+
+        _pkgs = [dict((_k, _v) for _k, _v in _pkg.items() if _k in _valid_kwargs)
+                 for _pkg in patched_packages(_root, _release)]
+
+        # Sizes are stored as integers, so a malformed size doesn't stop the feed loading.
+        for _pkg in _pkgs:
+            for _key in ['DownloadSize', 'InstalledSize']:
+                if _pkg.get(_key, None) is not None:
+                    _pkg[_key] = package.feed_size(_pkg[_key])
+
+        _fields = sorted(set(_k for _pkg in _pkgs for _k in _pkg))
+        _packs = option_packs.OptionPack(source=_root, release=_release).option_packs
+        option_packs.add_sizes(_packs, dict((_pkg['PackageName'], (_pkg.get('DownloadSize', None) or 0,
+                                                                   _pkg.get('InstalledSize', None) or 0))
+                                            for _pkg in _pkgs))
+
+        # pylint: disable=no-member
+        _feeds[_release] = {'bad_wolf': bad_wolf_digest(_release),
+                            'sha256': feed_digest(_path),
+                            'size': os.path.getsize(_path),
+                            'fields': tuple(_fields),
+                            'packages': [tuple(_pkg.get(_k, _valid_kwargs[_k]) for _k in _fields) for _pkg in _pkgs],
+                            'option_packs': [(_pack.Name, _pack.Description, sorted(_pack.Packages),
+                                              _pack.DownloadSize, _pack.InstalledSize) for _pack in _packs]}
+        # pylint: enable=no-member
+
+    with open(output, 'wb') as _f:
+        pickle.dump({'format': INDEX_FORMAT, 'feeds': _feeds}, _f, protocol=2)
+
+    return sorted(_feeds)
+
+
+class CatalogCache(object):
+    """Cache of 'Catalog' instances keyed by property list path and modification time."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalogs = dict()
+
+        # Statistics, used in debug logging.
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, plist_path):
+        """Returns the 'Catalog' for 'plist_path', parsing it only if it has not been
+        parsed already or has changed since."""
+        result = None
+        _path = os.path.realpath(plist_path)
+        _key = (_path, os.path.getmtime(_path))
+
+        with self._lock:
+            result = self._catalogs.get(_key)
+
+            if result:
+                self.hits += 1
+                _state = 'hit'
+            else:
+                self.misses += 1
+                _state = 'miss'
+
+                result = Catalog(plist_path=plist_path)
+                self._catalogs[_key] = result
+
+        LOG.debug('Catalog cache {} for {} ({} hits, {} misses)'.format(_state, plist_path, self.hits, self.misses))
+
+        return result
+
+    def load_indexed(self, release):
+        """Returns the 'Catalog' for the feed 'release' from the catalog index, without needing
+        the property list, or 'None' if the feed is not in the index."""
+        result = None
+
+        if release in INDEX:
+            with self._lock:
+                _key = ('index', release)
+                result = self._catalogs.get(_key)
+
+                if not result:
+                    result = Catalog(plist_path=release)
+                    self._catalogs[_key] = result
+
+        return result
+
+
+# Module level index and cache shared by all sources in a run.
+INDEX = CatalogIndex()
+CACHE = CatalogCache()
@@ -2,17 +2,16 @@
 import logging
 import os
 import sys
-import tempfile
 
 # pylint: disable=relative-import
 try:
     import config
-    import curl_requests
+    import feed_cache
     import misc
     import plist
 except ImportError:
     from . import config
-    from . import curl_requests
+    from . import feed_cache
     from . import misc
     from . import plist
 # pylint: enable=relative-import
@@ -20,6 +19,17 @@ except ImportError:
 LOG = logging.getLogger(__name__)
 
 
+def changes(old, new):
+    """Returns the package names in the set 'new' that aren't in the set 'old' (new), the
+    names in 'old' that aren't in 'new' (removed), and the names in both (common)."""
+    result = None
+
+    # Get the new/removed files by using 'set_b.difference(set_a)'
+    result = (new.difference(old), old.difference(new), new.intersection(old))
+
+    return result
+
+
 # pylint: disable=too-many-locals
 # pylint: disable=too-many-branches
 # pylint: disable=too-many-statements
@@ -52,41 +62,20 @@ def differences(file_a, file_b, detailed_info=False):
     # Sort the two files so if the order of 'file_a' 'file_b' is
     # 'garageband1021.plist' 'garageband1011.plist' it becomes
     # 'garageband1011.plist' 'garageband1021.plist'
-    _tmp_dir = os.path.join(tempfile.gettempdir(), config.BUNDLE_ID)
-
+    # Files that don't exist locally are read from the feed cache.
     if not os.path.exists(file_a):
         _fa_fallback = os.path.join(config.AUDIOCONTENT_FAILOVER_URL, 'lp10_ms3_content_2016', base_a)
-        _fa_url = misc.plist_url_path(base_a)
-        file_a = os.path.join(_tmp_dir, base_a)
-
-        _req = curl_requests.CURL(url=_fa_url)
-
-        if _req.status in config.HTTP_OK_STATUS:
-            _req.get(url=_fa_url, output=file_a)
-        else:
-            _req.get(url=_fa_fallback, output=file_a)
-
-        file_a_plist = plist.readPlist(plist_path=file_a)['Packages']
-        misc.clean_up(file_a)
-    elif os.path.exists(file_a):
-        file_a_plist = plist.readPlist(plist_path=file_a)['Packages']
+        file_a = feed_cache.CACHE.get(base_a, [misc.plist_url_path(base_a), _fa_fallback])
 
     if not os.path.exists(file_b):
         _fb_fallback = os.path.join(config.AUDIOCONTENT_FAILOVER_URL, 'lp10_ms3_content_2016', base_b)
-        _fb_url = misc.plist_url_path(base_b)
-        file_b = os.path.join(_tmp_dir, base_b)
+        file_b = feed_cache.CACHE.get(base_b, [misc.plist_url_path(base_b), _fb_fallback])
 
-        _req = curl_requests.CURL(url=_fb_url)
-
-        if _req.status in config.HTTP_OK_STATUS:
-            _req.get(url=_fb_url, output=file_b)
-        else:
-            _req.get(url=_fb_fallback, output=file_b)
+    if not (file_a and file_b):
+        sys.exit(1)
 
-        file_b_plist = plist.readPlist(plist_path=file_b)['Packages']
-        misc.clean_up(file_b)
-    elif os.path.exists(file_b):
-        file_a_plist = plist.readPlist(plist_path=file_a)['Packages']
+    file_a_plist = plist.readPlist(plist_path=file_a)['Packages']
+    file_b_plist = plist.readPlist(plist_path=file_b)['Packages']
 
     # Build a set of package names.
     file_a_packages = set([os.path.basename(file_a_plist[_pkg]['DownloadName'])
@@ -94,10 +83,7 @@ def differences(file_a, file_b, detailed_info=False):
     file_b_packages = set([os.path.basename(file_b_plist[_pkg]['DownloadName'])
                            for _pkg in file_b_plist])
 
-    # Get the new/removed files by using 'set_b.difference(set_a)'
-    new_files = file_b_packages.difference(file_a_packages)
-    rem_files = file_a_packages.difference(file_b_packages)
-    cmn_files = file_b_packages.intersection(file_a_packages)
+    new_files, rem_files, cmn_files = changes(old=file_a_packages, new=file_b_packages)
 
     if not detailed_info:
         if new_files:
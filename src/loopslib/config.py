@@ -2,7 +2,6 @@
 These must not be modified or behaviour could break."""
 import logging
 
-from distutils.version import StrictVersion
 from os import path
 
 # pylint: disable=relative-import
@@ -58,13 +57,49 @@ CURL_HTTP1 = True
 CURL_HTTP_ARG = '--http1.1'
 CURL_RETRIES = '5'
 
+# HTTP backend for requests. 'native' uses pooled keep-alive connections,
+# 'curl' uses the '/usr/bin/curl' binary for every request.
+HTTP_BACKEND = 'native'
+
+# Socket timeout (seconds) for the native HTTP backend.
+HTTP_TIMEOUT = 60
+
+# Seconds to wait for a connection to a server to be made.
+CONNECT_TIMEOUT = 30
+
+# Transfers receiving less than 'STALL_SPEED' bytes per second for 'STALL_TIME' seconds
+# are aborted (like cURL's '--speed-limit' and '--speed-time'), and the package download
+# carries on from the next source. 'None' disables stall detection.
+STALL_SPEED = 1024
+STALL_TIME = 30
+
+# Hedged requests (native backend only). If a package source hasn't sent any bytes after
+# 'HEDGE_DELAY' seconds, or is sending less than 'HEDGE_MIN_RATE' bytes per second, the
+# package is also requested from the next source, and the first to finish is kept.
+# 'None' disables hedging.
+HEDGE_DELAY = None
+HEDGE_MIN_RATE = None
+
 # Debug on/off
 DEBUG = False
 
+# Number of packages to download at the same time.
+DOWNLOAD_JOBS = 1
+
 # Deployment of packages
 DEPLOY_PKGS = False
 FORCED_DEPLOYMENT = False
 
+# Pipelined deployment downloads ahead of the installer, keeping at most
+# 'PIPELINE_BUDGET' bytes of downloaded packages waiting to be installed.
+PIPELINE = False
+PIPELINE_BUDGET = 1024 * 1024 * 1024 * 4
+
+# Packages of at least 'SEGMENT_THRESHOLD' bytes are downloaded as 'SEGMENTS' byte
+# ranges over separate connections when the server supports ranges (native backend only).
+SEGMENTS = 4
+SEGMENT_THRESHOLD = 1024 * 1024 * 128
+
 # Destination path (a default value is provided)
 # NOTE: '/tmp' is used because in some circumstances, the
 # destination needs to be human friendly, and the
@@ -74,6 +109,26 @@ DEFAULT_DEST = '/tmp/appleloops'
 DESTINATION_PATH = None
 FORCE_DOWNLOAD = False
 
+# Check the packages in 'DESTINATION_PATH' instead of downloading them.
+VERIFY = False
+
+# Only download the packages that are new or changed since the last sync to 'DESTINATION_PATH'.
+MIRROR_SYNC = False
+
+# Remove the packages in 'DESTINATION_PATH' that no feed refers to.
+MIRROR_GC = False
+
+# Serve the packages in 'SERVE_PATH' over HTTP on 'SERVE_PORT' instead of downloading them.
+SERVE_PATH = None
+SERVE_PORT = 8000
+
+# Read the packages to process from the deployment plan 'PLAN_IN' instead of the feeds, and/or
+# write them to the deployment plan 'PLAN_OUT'. 'PLAN_ONLY' is set when writing the plan is
+# all there is to do.
+PLAN_IN = None
+PLAN_OUT = None
+PLAN_ONLY = False
+
 # DMG File stuff
 APFS_DMG = False
 DMG_DEPLOY_FILE = None
@@ -95,31 +150,52 @@ HTTP_OK_STATUS = [200, 301, 302, 303, 307, 308]
 # Best practice is to use the relevant argument to mirror the folder paths from Apple.
 LOCAL_HTTP_SERVER = None
 
+# Persistent cache of downloaded feed property lists.
+# 'CACHE_PATH' and 'FEED_CACHE_PATH' are resolved on first use, see 'LAZY'.
+
 # Log level
 LOGGER_NAME = 'appleloops'
 LOG_FILE = 'appleloops.log'
 LOG_LEVEL = 'INFO'
 
 # If the user is root, change the log path so not to blat on user log folder.
-if misc.is_root():
-    LOG_PATH = '/var/log'
-else:
-    LOG_PATH = path.expanduser(path.expandvars('~/Library/Logs'))
-
-LOG_FILE_PATH = path.join(LOG_PATH, LOG_FILE)
+# 'LOG_PATH' and 'LOG_FILE_PATH' are resolved on first use, see 'LAZY'.
 
 # Default 'path' is '2016'. Use '.replace()' when '2013' is required.
 LP10_MS3_CONTENT = 'lp10_ms3_content_2016'
 
+# Shared store of downloaded packages, used by every run. 'None' disables the store.
+# When the store is larger than 'STORE_SIZE' bytes, the least recently used packages are
+# removed. 'None' is no limit.
+STORE_PATH = None
+STORE_SIZE = None
+
 # Used to determine if processing mandatory packages
 MANDATORY = False
 
 # Used for overall name of app based on '__name__'
 NAME = None
 
+# Download from the fastest source (package server, caching server, or Apple) instead of
+# always preferring the package server and caching server. Measurements of each source are
+# kept in 'MIRROR_HISTORY_PATH', which is resolved on first use, see 'LAZY'.
+RANK_MIRRORS = False
+
+# Only use feed property lists that are already in the feed cache.
+OFFLINE = False
+
 # Used to determine if processing optional packages
 OPTIONAL = False
 
+# Only process the optional packages in the option packs whose names contain any of 'PACKS'.
+PACKS = None
+
+# List the option packs of each property list instead of processing packages.
+LIST_PACKS = False
+
+# Folder containing the installed package receipts ('<pkgid>.plist').
+RECEIPTS_PATH = '/var/db/receipts'
+
 # Property Lists to use for processing if provided.
 PLISTS_TO_PROCESS = None
 
@@ -149,12 +225,8 @@ INST_SLEEP = None
 # All supported plists
 SUPPORTED_PLISTS = supported.SUPPORTED.copy()
 
-# Capture OS Version
-OS_VER = StrictVersion(version.os_vers())
-OS_BUILD = version.os_vers(arg='buildVersion')
-
-# Post Catalina, the disk containers and volumes change a bit
-CATALINA = OS_VER > StrictVersion('10.14.9')
+# OS Version ('OS_VER', 'OS_BUILD') and post Catalina ('CATALINA', the disk containers
+# and volumes change a bit) are resolved on first use, see 'LAZY'.
 
 # Target (this is for the 'installer' command.)
 # Using a different target for Catalina doesn't appear necessary.
@@ -163,19 +235,62 @@ TARGET = '/'
 # User Agent string to use for all requests to Apple.
 USERAGENT = 'appleloops/{}'.format(version.VERSION)
 
-# Latest package 'feed' files.
-GB_LATEST_PLIST = ['{}/{}/{}'.format(AUDIOCONTENT_URL, LP10_MS3_CONTENT, x)
-                   for x in sorted(supported.SUPPORTED.values(), reverse=True)
-                   if x.startswith('garageband')][0]
-LP_LATEST_PLIST = ['{}/{}/{}'.format(AUDIOCONTENT_URL, LP10_MS3_CONTENT, x)
-                   for x in sorted(supported.SUPPORTED.values(), reverse=True)
-                   if x.startswith('logicpro')][0]
-MS_LATEST_PLIST = ['{}/{}/{}'.format(AUDIOCONTENT_URL, LP10_MS3_CONTENT, x)
-                   for x in sorted(supported.SUPPORTED.values(), reverse=True)
-                   if x.startswith('mainstage')][0]
-
-ALL_LATEST_PLISTS = [path.basename(GB_LATEST_PLIST).replace('.plist', ''),
-                     path.basename(LP_LATEST_PLIST).replace('.plist', ''),
-                     path.basename(MS_LATEST_PLIST).replace('.plist', '')]
+# Latest package 'feed' files ('GB_LATEST_PLIST', 'LP_LATEST_PLIST', 'MS_LATEST_PLIST',
+# 'ALL_LATEST_PLISTS') are resolved on first use, see 'LAZY'.
 
 ALL_LATEST_APPS = [_key for _key, _val in APPS.items()]
+
+
+# Values that are expensive to work out (running 'sw_vers', checking the user, sorting the
+# supported feeds) are only resolved the first time they are used, so commands that don't
+# need them (such as '--help') start quickly. Each value is kept once resolved, and can
+# still be set like any other value.
+def _is_root_path(root_path, user_path):
+    """Returns 'root_path' if running as root, otherwise 'user_path' in the users home."""
+    return root_path if misc.is_root() else path.expanduser(path.expandvars(user_path))
+
+
+def _os_ver(ver=None):
+    """Returns 'ver' (default is the OS version) as a 'StrictVersion'."""
+    from distutils.version import StrictVersion  # pylint: disable=import-outside-toplevel
+
+    return StrictVersion(ver if ver else version.os_vers())
+
+
+def _latest_plist(app):
+    """Returns the URL of the latest supported feed for 'app'."""
+    return ['{}/{}/{}'.format(AUDIOCONTENT_URL, LP10_MS3_CONTENT, x)
+            for x in sorted(supported.SUPPORTED.values(), reverse=True)
+            if x.startswith(app)][0]
+
+
+LAZY = {'OS_VER': _os_ver,
+        'OS_BUILD': lambda: version.os_vers(arg='buildVersion'),
+        'CATALINA': lambda: _value('OS_VER') > _os_ver('10.14.9'),
+        'LOG_PATH': lambda: _is_root_path('/var/log', '~/Library/Logs'),
+        'LOG_FILE_PATH': lambda: path.join(_value('LOG_PATH'), LOG_FILE),
+        'CACHE_PATH': lambda: path.join(_is_root_path('/Library/Caches', '~/Library/Caches'), BUNDLE_ID),
+        'FEED_CACHE_PATH': lambda: path.join(_value('CACHE_PATH'), 'feeds'),
+        'MIRROR_HISTORY_PATH': lambda: path.join(_value('CACHE_PATH'), 'mirrors.json'),
+        'GB_LATEST_PLIST': lambda: _latest_plist('garageband'),
+        'LP_LATEST_PLIST': lambda: _latest_plist('logicpro'),
+        'MS_LATEST_PLIST': lambda: _latest_plist('mainstage'),
+        'ALL_LATEST_PLISTS': lambda: [path.basename(_value(_plist)).replace('.plist', '')
+                                      for _plist in ['GB_LATEST_PLIST', 'LP_LATEST_PLIST', 'MS_LATEST_PLIST']]}
+
+
+def _value(name):
+    """Returns the value of 'name', resolving it if it is in 'LAZY' and not yet resolved.
+    Lazy values used by other lazy values must be looked up with this."""
+    return globals()[name] if name in globals() else __getattr__(name)
+
+
+def __getattr__(name):
+    """Resolves the values in 'LAZY' on first use."""
+    if name not in LAZY:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    result = LAZY[name]()
+    globals()[name] = result
+
+    return result
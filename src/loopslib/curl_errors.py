@@ -2,13 +2,19 @@
 # Sourced from https://curl.haxx.se/libcurl/c/libcurl-errors.html
 
 CURL_ERRORS = {
+    1: 'Unsupported protocol',
     6: 'Could not resolve host',
     7: 'Failed to connect to host',
     9: 'Remote Access Denied',
     16: 'Problem with HTTP2 framing layer',
     18: 'File transfer shorter than expected',
+    22: 'HTTP page not retrieved',
     23: 'An error occurred writing to file',
+    28: 'Operation timeout',
+    33: 'HTTP range error',
+    35: 'SSL/TLS handshake failed',
     36: 'Download not resumed because offset was out of file boundary',
+    42: 'Operation aborted by callback',
     47: 'Too many redirects',
     52: 'Nothing returned by the server',
     53: 'Specified crypto engine not found',
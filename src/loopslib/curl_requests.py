@@ -1,29 +1,59 @@
-"""Contains the class for using CURL."""
+"""Contains the class for using CURL. Requests are made with the native HTTP backend
+('http_pool') unless 'config.HTTP_BACKEND' is 'curl'."""
 import logging
 import os
 import subprocess
 import sys
+import threading
 
 
 # pylint: disable=relative-import
 try:
     import config
     import curl_errors
+    import http_pool
     import misc
 except ImportError:
     from . import config
     from . import curl_errors
+    from . import http_pool
     from . import misc
 # pylint: enable=relative-import
 
 LOG = logging.getLogger(__name__)
 
 
+class RequestCounter(object):
+    """Counts the HTTP requests made, and the header probes avoided by re-using an earlier
+    probe or by reading the status, size and encoding from the GET response itself."""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.made = 0
+        self.saved = 0
+
+    def add(self, made=0, saved=0):
+        """Updates the counts."""
+        with self._lock:
+            self.made += made
+            self.saved += saved
+
+    @property
+    def message(self):
+        """Returns a summary of the counts."""
+        return 'HTTP requests: {} made, {} saved'.format(self.made, self.saved)
+
+
+# Module level counter shared by all requests in a run.
+REQUESTS = RequestCounter()
+
+
 class CURL(object):
     """Class for using CURL."""
-    def __init__(self, url=None, silent_override=False):
+    def __init__(self, url=None, silent_override=False, no_progress=False):
         self._url = url
         self._silent_override = silent_override
+        self._no_progress = no_progress  # Messages still print, but no progress bar.
         self._curl_path = '/usr/bin/curl'
 
         self.headers = None
@@ -34,16 +64,25 @@ class CURL(object):
             self.headers = self._get_headers(obj=self._url)
             self.status = self._get_status()
 
+    @staticmethod
+    def _limit_args(transfer=True):
+        """Returns the cURL arguments for the connection timeout and, for transfers, to abort
+        a transfer that has stalled (see 'config.STALL_SPEED')."""
+        result = ['--connect-timeout', str(config.CONNECT_TIMEOUT)]
+
+        if transfer and config.STALL_SPEED and config.STALL_TIME:
+            result.extend(['--speed-limit', str(config.STALL_SPEED), '--speed-time', str(config.STALL_TIME)])
+
+        return result
+
     def _get_headers(self, obj):
         """Gets the headers of the provided URL, and returns the result as a dictionary.
         Does not follow redirects."""
         result = None
-        redirect_statuses = ['301 Moved Permanently',
-                             '302 Found',
-                             '302 Moved Temporarily',
-                             '303 See Other',
-                             '307 Temporary Redirect',
-                             '308 Permanent Redirect']
+        REQUESTS.add(made=1)
+
+        if config.HTTP_BACKEND == 'native':
+            return self._get_native_headers(obj=obj)
 
         cmd = [self._curl_path,
                '--retry', config.CURL_RETRIES,  # Retry failed downloads n times (default 5), will wait 1sec then on each retry double the wait time.
@@ -62,38 +101,15 @@ class CURL(object):
         if config.ALLOW_INSECURE_CURL:
             cmd.extend(['--insecure'])
 
+        cmd.extend(self._limit_args(transfer=False))
+
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         p_result, p_error = process.communicate()
 
         # pylint: disable=too-many-nested-blocks
         if process.returncode == 0:
             if isinstance(p_result, bytes):
-                result = dict()
-                # There's a trailing `\n` in the output, so tidy it up.
-                p_result = p_result.decode().strip()
-
-                # This handles if there is a redirect
-                if '\r\n\r' in p_result and any([status.lower() in p_result.lower() for status in redirect_statuses]):
-                    p_result = p_result.split('\r\n\r')
-                    p_result = p_result[-1]  # The redirect should be the last item in the output.
-
-                # Now tidy up
-                p_result = p_result.strip().splitlines()
-
-                for line in p_result:
-                    if (line.startswith('HTTP/1.1 ') or line.startswith('HTTP/2 ')) and ':' not in line:
-                        result['Status'] = line
-
-                        # Set the status code as a seperate value so we can minimise curl usage.
-                    else:
-                        if ':' in line:
-                            key = line.split(': ')[0]
-                            value = ''.join(line.split(': ')[1:])
-
-                            if 'content-length' in key.lower():
-                                value = int(value)
-
-                            result[key] = value
+                result = self._parse_headers(p_result)
                 LOG.debug('{}: {}'.format(' '.join(cmd), result))
         elif process.returncode in [_key for _key, _value in curl_errors.CURL_ERRORS.items()]:
             _err_msg = curl_errors.CURL_ERRORS.get(process.returncode, None)
@@ -114,6 +130,114 @@ class CURL(object):
 
         return result
 
+    # pylint: disable=no-self-use
+    def _parse_headers(self, output):
+        """Parses the headers written by cURL ('-I' or '-D -') into a dictionary. Only the
+        headers of the last response are kept if redirects were followed."""
+        result = dict()
+        redirect_statuses = ['301 Moved Permanently',
+                             '302 Found',
+                             '302 Moved Temporarily',
+                             '303 See Other',
+                             '307 Temporary Redirect',
+                             '308 Permanent Redirect']
+
+        # There's a trailing `\n` in the output, so tidy it up.
+        output = output.decode().strip()
+
+        # This handles if there is a redirect
+        if '\r\n\r' in output and any([status.lower() in output.lower() for status in redirect_statuses]):
+            output = output.split('\r\n\r')
+            output = output[-1]  # The redirect should be the last item in the output.
+
+        # Now tidy up
+        output = output.strip().splitlines()
+
+        for line in output:
+            if (line.startswith('HTTP/1.1 ') or line.startswith('HTTP/2 ')) and ':' not in line:
+                result['Status'] = line
+
+                # Set the status code as a seperate value so we can minimise curl usage.
+            else:
+                if ':' in line:
+                    key = line.split(': ')[0]
+                    value = ''.join(line.split(': ')[1:])
+
+                    if 'content-length' in key.lower():
+                        value = int(value)
+
+                    result[key] = value
+
+        return result
+    # pylint: enable=no-self-use
+
+    def _get_native_headers(self, obj):
+        """Gets the headers of the provided URL with the native HTTP backend, and returns
+        the result as a dictionary in the same form as the cURL backend."""
+        result = None
+
+        try:
+            result = http_pool.head(obj)
+            LOG.debug('HEAD {}: {}'.format(obj, result))
+        except http_pool.TransferError as _e:
+            # Set the 'self.curl_error' attribute to the equivalent cURL error.
+            self.curl_error = {'cURL_Error': _e.code,
+                               'Error_Msg': _e.msg}
+
+            LOG.debug('HEAD {}: {} - {}'.format(obj,
+                                                self.curl_error.get('cURL_Error'),
+                                                self.curl_error.get('Error_Msg')))
+
+        return result
+
+    def _transfer(self, cmd, output):
+        """Transfers the URL with the cURL binary. Returns the number of bytes written."""
+        result = 0
+        _before = os.path.getsize(output) if output and os.path.exists(output) else 0
+
+        REQUESTS.add(made=1)
+        subprocess.check_call(cmd)
+
+        if output and os.path.exists(output):
+            result = max(os.path.getsize(output) - _before, 0)
+
+        return result
+
+    # pylint: disable=too-many-arguments
+    def _native_transfer(self, url, output, resume, msg, progress, min_length, quiet, hedge_url=None,
+                         hedge_min_length=None, digest=None):
+        """Transfers the URL with the native HTTP backend. Whether the file is downloaded,
+        resumed, or skipped is decided from the GET response, then announced. If 'hedge_url'
+        is provided and hedging is enabled, a slow transfer is hedged with a request to it.
+        Bytes written are hashed by 'digest' (a 'http_pool.StreamDigest') as they arrive.
+        Returns the number of bytes written."""
+        def _announce(action):
+            _msg = msg
+
+            if action in ['resume', 'skip']:
+                _msg = _msg.replace('Re-downloading', 'Downloading')
+                _msg = _msg.replace('Downloading', 'Resuming' if action == 'resume' else 'Skipping existing file')
+
+            LOG.info(_msg)
+
+            if not quiet:
+                print(_msg)
+
+        REQUESTS.add(made=1)
+
+        # Compressed content can't be resumed, so only ask for it on fresh transfers.
+        _kwargs = {'url': url, 'output': output, 'resume': resume, 'compressed': not resume, 'progress': progress,
+                   'min_length': min_length, 'announce': _announce, 'segments': config.SEGMENTS,
+                   'segment_threshold': config.SEGMENT_THRESHOLD, 'digest': digest}
+
+        if hedge_url and config.HEDGE_DELAY:
+            return http_pool.fetch_hedged(hedge_url=hedge_url, delay=config.HEDGE_DELAY,
+                                          min_rate=config.HEDGE_MIN_RATE, hedge_min_length=hedge_min_length,
+                                          **_kwargs)
+
+        return http_pool.fetch(**_kwargs)
+    # pylint: enable=too-many-arguments
+
     def _get_status(self):
         """Returns the HTTP status code as its own attribute."""
         result = None
@@ -133,14 +257,35 @@ class CURL(object):
 
         return result
 
-    def get(self, url, output=None, counter_msg=None, resume=True):
-        """Retrieves the specified URL. Saves it to path specified in 'output' if present."""
+    # pylint: disable=too-many-arguments
+    def get(self, url, output=None, counter_msg=None, resume=True, headers=None, min_length=None, hedge_url=None,
+            hedge_min_length=None, digest=None):
+        """Retrieves the specified URL. Saves it to path specified in 'output' if present.
+        Returns the number of bytes transferred.
+        If 'headers' is provided (from an earlier probe of the same URL) the cURL backend does not
+        probe the URL again. The native backend never probes, the decision to skip, resume, or
+        download is made from the GET response, which is abandoned before anything is written if
+        the server reports fewer than 'min_length' bytes. With the native backend, a slow
+        transfer can be hedged with a request to 'hedge_url' (see 'config.HEDGE_DELAY'), and the
+        bytes written are hashed by 'digest' (a 'http_pool.StreamDigest') as they arrive."""
         # NOTE: Must ignore 'dry run' state for any '.plist' file downloads.
-        _headers = self._get_headers(obj=url)
+        result = 0
+        _native = config.HTTP_BACKEND == 'native'
 
         # Check if we're fetching a property list file
         _fetching_plist = url.endswith('.plist')
 
+        if _native:
+            _headers = dict()
+
+            if not config.DRY_RUN or _fetching_plist:
+                REQUESTS.add(saved=1)
+        elif headers is not None:
+            _headers = headers
+            REQUESTS.add(saved=1)
+        else:
+            _headers = self._get_headers(obj=url)
+
         # Now the command.
         cmd = [self._curl_path,
                '--retry', config.CURL_RETRIES,  # Retry failed downloads n times (default 5), will wait 1sec then on each retry double the wait time.
@@ -172,15 +317,23 @@ class CURL(object):
         if config.ALLOW_INSECURE_CURL:
             cmd.extend(['--insecure'])
 
-        if not (config.QUIET or config.SILENT or self._silent_override or _fetching_plist):
+        cmd.extend(self._limit_args())
+
+        _progress = not (config.QUIET or config.SILENT or self._silent_override or self._no_progress or
+                         _fetching_plist)
+
+        if _progress:
             cmd.extend(['--progress-bar'])
-        elif (config.QUIET or config.SILENT or self._silent_override or _fetching_plist):
+        else:
             cmd.extend(['--silent'])
 
         if output:
             cmd.extend(['--create-dirs', '-o', output])
 
-        LOG.debug('CURL get: {}'.format(' '.join(cmd)))
+        if config.HTTP_BACKEND == 'native':
+            LOG.debug('GET {} -> {}'.format(url, output))
+        else:
+            LOG.debug('CURL get: {}'.format(' '.join(cmd)))
 
         if not config.DRY_RUN or _fetching_plist:
             if counter_msg:
@@ -192,13 +345,19 @@ class CURL(object):
                 _msg = _msg.replace('Downloading', 'Re-downloading')
 
             try:
-                if not os.path.exists(output):
+                if _native:
+                    _quiet = config.SILENT or self._silent_override or _fetching_plist
+                    result = self._native_transfer(url=url, output=output, resume=resume, msg=_msg,
+                                                   progress=_progress, min_length=min_length, quiet=_quiet,
+                                                   hedge_url=hedge_url, hedge_min_length=hedge_min_length,
+                                                   digest=digest)
+                elif not os.path.exists(output):
                     LOG.info(_msg)
 
                     if not (config.SILENT or self._silent_override or _fetching_plist):
                         print(_msg)
 
-                    subprocess.check_call(cmd)
+                    result = self._transfer(cmd=cmd, output=output)
                 elif os.path.exists(output):
                     _local_len = os.path.getsize(output)
                     _content_len = None
@@ -223,13 +382,80 @@ class CURL(object):
                         if not (config.SILENT or self._silent_override or _fetching_plist):
                             print(_msg)
 
-                        subprocess.check_call(cmd)
+                        result = self._transfer(cmd=cmd, output=output)
             except subprocess.CalledProcessError as _e:
                 LOG.debug('{}: {}'.format(' '.join(cmd), _e))
                 raise _e
+            except http_pool.TransferError as _e:
+                LOG.debug('GET {}: {}'.format(url, _e))
+                raise _e
         elif config.DRY_RUN:
             if not config.SILENT:
                 _msg = 'Download {} - {}'.format(counter_msg, url)
 
                 print(_msg)
                 LOG.info(_msg)
+
+        return result
+    # pylint: enable=too-many-arguments
+
+    def get_if_modified(self, url, output, etag=None, last_modified=None):
+        """Retrieves the specified URL to 'output' with a conditional GET, using the 'etag'
+        and 'last_modified' validators of an earlier copy.
+        Returns 'None' if the server reports the URL is not modified, otherwise the headers
+        of the response. Raises 'http_pool.TransferError' on failure."""
+        result = None
+        REQUESTS.add(made=1)
+
+        if config.HTTP_BACKEND == 'native':
+            LOG.debug('Conditional GET {} -> {}'.format(url, output))
+            return http_pool.fetch_if_modified(url=url, output=output, etag=etag, last_modified=last_modified)
+
+        cmd = [self._curl_path,
+               '--retry', config.CURL_RETRIES,
+               '--retry-max-time', '10',
+               config.CURL_HTTP_ARG,
+               '--user-agent',
+               config.USERAGENT,
+               '--silent',
+               '--compressed',
+               '-L',
+               '-D', '-',  # Headers to stdout, the body goes to 'output'.
+               '--create-dirs',
+               '-o', output]
+
+        if etag:
+            cmd.extend(['-H', 'If-None-Match: {}'.format(etag)])
+
+        if last_modified:
+            cmd.extend(['-H', 'If-Modified-Since: {}'.format(last_modified)])
+
+        if config.PROXY:
+            cmd.extend(['--proxy', config.PROXY])
+
+        if config.ALLOW_INSECURE_CURL:
+            cmd.extend(['--insecure'])
+
+        cmd.extend(self._limit_args())
+
+        cmd.extend([url])
+
+        LOG.debug('CURL conditional get: {}'.format(' '.join(cmd)))
+
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p_result, _ = process.communicate()
+
+        if process.returncode != 0:
+            raise http_pool.TransferError(process.returncode)
+
+        result = self._parse_headers(p_result)
+        self.headers = result
+        self.status = self._get_status()
+
+        if self.status == 304:
+            return None
+
+        if self.status != 200:
+            raise http_pool.TransferError(22, 'The requested URL returned error: {}'.format(self.status))
+
+        return result
@@ -1,28 +1,47 @@
 """Deployement."""
 import logging
 import os
+import queue
 import subprocess  # NOQA
+import threading
+import time
 
-from distutils.version import StrictVersion
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import sleep
 
 # pylint: disable=relative-import
 try:
     import config
     import curl_requests
+    import http_pool
+    import journal
+    import manifest
+    import mirrors
     import misc
     import package
-    import version
+    import store
 except ImportError:
     from . import config
     from . import curl_requests
+    from . import http_pool
+    from . import journal
+    from . import manifest
+    from . import mirrors
     from . import misc
     from . import package
-    from . import version
+    from . import store
 # pylint: enable=relative-import
 
 LOG = logging.getLogger(__name__)
-OS_VER = version.os_vers()
+
+
+def counter_msg(index, total):
+    """Returns the 'N of M' counter message, with 'N' padded to the width of 'M'."""
+    result = None
+
+    result = '{i:0{width}d} of {t}'.format(width=len(str(total)), i=index, t=total)
+
+    return result
 
 
 class LoopDeployment(object):
@@ -34,36 +53,112 @@ class LoopDeployment(object):
 
         self._install_size = 0
 
+        # Statistics are updated from download worker threads.
+        self._lock = threading.Lock()
+
+        # Progress bars are disabled when downloading concurrently as they would interleave.
+        self._no_progress = False
+
     def _upd_download_size(self, size):
         """Updates the 'download_size' attribute by the specified size."""
         if isinstance(size, int):
-            self._download_size += size
+            with self._lock:
+                self._download_size += size
 
     def _upd_downloaded_size(self, size):
         """Updates the 'downloaded_size' attribute by the specified size."""
         if isinstance(size, int):
-            self._downloaded_size += size
+            with self._lock:
+                self._downloaded_size += size
 
     def _upd_install_size(self, size):
         """Updates the 'install_size' attribute by the specified size."""
         if isinstance(size, int):
-            self._install_size += size
+            with self._lock:
+                self._install_size += size
+
+    def _download(self, pkg, counter_msg):
+        """Downloads a package, unless the download journal records it as complete. Packages
+        in the package store (see 'config.STORE_PATH') are taken from it, otherwise they are
+        downloaded from their sources, and added to the store afterwards.
+        Packages are checked against the package manifest (see 'manifest.PackageManifest')
+        before they are recorded as complete. A package that fails is downloaded again from
+        the beginning from Apple, and if it fails again it is removed so it is never
+        installed."""
+        if not isinstance(pkg, package.LoopPackage):
+            return self._fetch(pkg=pkg, counter_msg=counter_msg)
+
+        if journal.JOURNAL.complete(pkg) and manifest.MANIFEST.current(pkg):
+            _msg = 'Skipping existing file {} - {}'.format(counter_msg, pkg.DownloadURL)
+            LOG.info(_msg)
+
+            if not config.SILENT:
+                print(_msg)
+
+            return None
+
+        # A package found to be corrupt would be skipped or resumed, so start it again.
+        if journal.JOURNAL.corrupt(pkg):
+            misc.clean_up(file_path=pkg.DownloadPath)
+
+        if store.STORE.restore(pkg, counter_msg=counter_msg):
+            if not manifest.MANIFEST.verify(pkg):
+                journal.JOURNAL.record(pkg)
+                return None
+
+            misc.clean_up(file_path=pkg.DownloadPath)
+            store.STORE.remove(pkg)
+
+        for _attempt in range(2):
+            _digest = http_pool.StreamDigest()
+
+            try:
+                result = self._fetch(pkg=pkg, counter_msg=counter_msg, digest=_digest, origin=bool(_attempt))
+            except Exception:
+                journal.JOURNAL.record(pkg, failed=True)
+                raise
+
+            _error = manifest.MANIFEST.verify(pkg, digest=_digest)
+
+            if not _error:
+                break
+
+            # Removing the file means it is downloaded again from the first byte, rather than
+            # resumed or skipped. The source may be the problem, so it comes from Apple.
+            misc.clean_up(file_path=pkg.DownloadPath)
+            _msg = 'Corrupt file {} - {} ({})'.format(counter_msg, os.path.basename(pkg.DownloadPath), _error)
+            LOG.info(_msg)
+
+            if not config.SILENT:
+                print(_msg)
+        else:
+            journal.JOURNAL.record(pkg, failed=True)
+            raise manifest.CorruptPackageError(_msg)
+
+        journal.JOURNAL.record(pkg)
+        store.STORE.add(pkg)
+
+        return result
 
     # pylint: disable=no-self-use
     # pylint: disable=inconsistent-return-statements
-    def _download(self, pkg, counter_msg):
-        """Downloads a package from the specified URL."""
+    def _fetch(self, pkg, counter_msg, digest=None, origin=False):
+        """Downloads a package from the specified URL, or only from Apple if 'origin' is 'True'.
+        With the native backend, the bytes written are hashed by 'digest' (a
+        'http_pool.StreamDigest') as they arrive."""
         if isinstance(pkg, package.LoopPackage):
-            _url = pkg.DownloadURL
+            _urls = [pkg.DownloadURL] if origin else self._sources(pkg)
+            _url = _urls[0]
             _cache_race = False  # Presume all caching server packages are completely downloaded
             _debug_msg = 'Fell back {} to {}'.format(_url, pkg.DownloadURL)
 
-            curl = curl_requests.CURL()
+            curl = curl_requests.CURL(no_progress=self._no_progress)
 
-            if pkg.LocalDownloadURL:
-                _url = pkg.LocalDownloadURL
-            elif pkg.CacheDownloadURL:
-                _url = pkg.CacheDownloadURL
+            # The native backend reads the status and size from the GET response itself,
+            # so the preferred source is tried directly, without a probe.
+            if config.HTTP_BACKEND == 'native':
+                self._native_download(curl=curl, pkg=pkg, urls=_urls, counter_msg=counter_msg, digest=digest)
+                return
 
             # Get the status of the URL to see if it exists
             req = curl_requests.CURL(url=_url)
@@ -88,7 +183,19 @@ class LoopDeployment(object):
 
             if req.status:
                 if req.status in config.HTTP_OK_STATUS:
-                    curl.get(url=_url, output=pkg.DownloadPath, counter_msg=counter_msg)
+                    # Re-use the probe made above rather than probing the same URL again.
+                    try:
+                        self._upd_downloaded_size(curl.get(url=_url, output=pkg.DownloadPath,
+                                                           counter_msg=counter_msg, headers=req.headers))
+                    except subprocess.CalledProcessError as _e:
+                        # A stalled (or failed) transfer from a cache or pkg server carries on
+                        # from Apple, resuming from whatever was already written.
+                        if _url == pkg.DownloadURL:
+                            raise
+
+                        LOG.debug('{} ({})'.format(_debug_msg, _e))
+                        self._upd_downloaded_size(curl.get(url=pkg.DownloadURL, output=pkg.DownloadPath,
+                                                           counter_msg=counter_msg))
                 elif req.status not in config.HTTP_OK_STATUS:
                     # Fallback only if the url is either a cache or pkg server
                     if _url in [pkg.LocalDownloadURL, pkg.CacheDownloadURL] or _cache_race:
@@ -96,7 +203,8 @@ class LoopDeployment(object):
 
                         _url = pkg.DownloadURL
 
-                        curl.get(url=_url, output=pkg.DownloadPath, counter_msg=counter_msg)
+                        self._upd_downloaded_size(curl.get(url=_url, output=pkg.DownloadPath,
+                                                           counter_msg=counter_msg))
             elif not req.status or req.curl_error:
                 # Fallback only if the url is either a cache or pkg server
                 if _url in [pkg.LocalDownloadURL, pkg.CacheDownloadURL] or _cache_race:
@@ -104,12 +212,74 @@ class LoopDeployment(object):
 
                     _url = pkg.DownloadURL
 
-                    curl.get(url=_url, output=pkg.DownloadPath, counter_msg=counter_msg)
+                    self._upd_downloaded_size(curl.get(url=_url, output=pkg.DownloadPath, counter_msg=counter_msg))
         else:
             LOG.debug('{} is {}'.format(pkg, pkg.__class__))
             return NotImplemented
     # pylint: enable=inconsistent-return-statements
 
+    def _sources(self, pkg):
+        """Returns the URLs a package can be downloaded from, in the order they are tried.
+        The package server and caching server are preferred over Apple, unless sources are
+        ranked by speed ('config.RANK_MIRRORS')."""
+        result = [_url for _url in [pkg.LocalDownloadURL, pkg.CacheDownloadURL, pkg.DownloadURL] if _url]
+
+        if config.RANK_MIRRORS:
+            result = mirrors.RANKING.order(result)
+
+        return result
+
+    def _min_length(self, pkg, url):
+        """Returns the size a caching server must report for a package before it is downloaded
+        from it, or 'None' if 'url' isn't on the caching server."""
+        result = None
+
+        # Check if a caching server package is less than the expected size,
+        # if this is true, then it's likely the caching server hasn't completely
+        # downloaded the file yet, and will cause problems, so fall back.
+        if url == pkg.CacheDownloadURL:
+            result = pkg.RealDownloadSize if config.REAL_DOWNLOAD_SIZE else pkg.DownloadSize
+
+        return result
+
+    def _native_download(self, curl, pkg, urls, counter_msg, digest=None):
+        """Downloads a package with the native backend. A failed request, or a caching server
+        reporting a file smaller than expected, falls back to the next source in 'urls',
+        resuming from whatever was already written. This takes one request per package
+        instead of three. When hedging, a slow source is hedged with the next source, and
+        if both fail the download falls back to the source after that."""
+        # Saves the probe that would have been made before the download.
+        curl_requests.REQUESTS.add(saved=1)
+        _index = 0
+
+        while _index < len(urls):
+            _url = urls[_index]
+            _hedge_url = urls[_index + 1] if config.HEDGE_DELAY and _index + 1 < len(urls) else None
+            _next = _index + (2 if _hedge_url else 1)
+
+            try:
+                self._upd_downloaded_size(curl.get(url=_url, output=pkg.DownloadPath, counter_msg=counter_msg,
+                                                   min_length=self._min_length(pkg, _url), hedge_url=_hedge_url,
+                                                   hedge_min_length=self._min_length(pkg, _hedge_url),
+                                                   digest=digest))
+                break
+            except http_pool.TransferError as _e:
+                # No more sources to fall back to.
+                if _next >= len(urls):
+                    raise
+
+                LOG.debug('Fell back {} to {} ({})'.format(_url, urls[_next], _e))
+                _index = _next
+
+    def _download_worker(self, pkg, counter_msg):
+        """Downloads a single package in a worker thread. Exceptions are logged so one
+        failed package does not stop the remaining downloads."""
+        try:
+            self._upd_download_size(pkg.DownloadSize)
+            self._download(pkg=pkg, counter_msg=counter_msg)
+        except Exception as e:
+            LOG.info('Exception downloading: {}'.format(e))
+
     def _installer(self, cmd):
         """'installer' command execution."""
         result = None
@@ -177,24 +347,134 @@ class LoopDeployment(object):
             try:
                 self._download(pkg=pkg, counter_msg=counter_msg)
             except Exception as e:
-                LOG.info('Exception downloading: {}'.format(e.strip()))
-                pass
+                LOG.info('Exception downloading: {}'.format(e))
 
         if config.DEPLOY_PKGS or config.FORCED_DEPLOYMENT:
-            try:
-                self._install(pkg=pkg, counter_msg=counter_msg)
-            except Exception as e:
-                LOG.info('Exception installing: {}'.format(e.strip()))
-                pass
-
-            # Installer can hang on the 'Preparing for install'
-            # in macOS 11.0.1, so delay the install for a few seconds
-            # to allow things to settle.
-            # if StrictVersion(OS_VER) > StrictVersion('10.15.99') or config.INST_SLEEP:
-            if not config.DRY_RUN and config.INST_SLEEP:
-                sleep(int(config.INST_SLEEP))
-
-            if not config.DRY_RUN:
-                # Don't try and delete from DMG.
-                if not config.HTTP_DMG:
-                    misc.clean_up(file_path=pkg.DownloadPath)
+            self._install_and_clean_up(pkg=pkg, counter_msg=counter_msg)
+
+    def _install_and_clean_up(self, pkg, counter_msg):
+        """Installs a package, then removes the downloaded package file."""
+        try:
+            self._install(pkg=pkg, counter_msg=counter_msg)
+        except Exception as e:
+            LOG.info('Exception installing: {}'.format(e))
+            pass
+
+        # Installer can hang on the 'Preparing for install'
+        # in macOS 11.0.1, so delay the install for a few seconds
+        # to allow things to settle.
+        # if config.OS_VER > StrictVersion('10.15.99') or config.INST_SLEEP:
+        if not config.DRY_RUN and config.INST_SLEEP:
+            sleep(int(config.INST_SLEEP))
+
+        if not config.DRY_RUN:
+            # Don't try and delete from DMG.
+            if not config.HTTP_DMG:
+                misc.clean_up(file_path=pkg.DownloadPath)
+
+    def download(self, pkgs, jobs=None):
+        """Downloads all packages in 'pkgs' through a pool of 'jobs' (default is
+        'config.DOWNLOAD_JOBS') worker threads, then reports the aggregate throughput."""
+        _qty = len(pkgs)
+        _jobs = max(1, min(jobs if jobs else config.DOWNLOAD_JOBS, _qty))
+        _started = time.time()
+
+        self._downloaded_size = 0
+        self._no_progress = _jobs > 1
+
+        LOG.debug('Downloading {} packages with {} worker(s)'.format(_qty, _jobs))
+
+        with ThreadPoolExecutor(max_workers=_jobs) as executor:
+            _futures = [executor.submit(self._download_worker, pkg=_pkg, counter_msg=counter_msg(_i, _qty))
+                        for _i, _pkg in enumerate(pkgs, start=1)]
+
+            for _future in as_completed(_futures):
+                _future.result()
+
+        if not config.DRY_RUN:
+            self._report_throughput(elapsed=time.time() - _started)
+
+    def _report_throughput(self, elapsed):
+        """Logs and prints the total bytes downloaded, the time taken, and the throughput."""
+        _rate = int(self._downloaded_size / elapsed) if elapsed > 0 else 0
+        _msg = 'Downloaded {} in {:.1f} seconds ({}/s)'.format(misc.bytes2hr(byte=self._downloaded_size),
+                                                              elapsed,
+                                                              misc.bytes2hr(byte=_rate))
+
+        LOG.info(_msg)
+        LOG.debug('Feed download size of queued packages: {}'.format(misc.bytes2hr(byte=self._download_size)))
+
+        if not (config.QUIET or config.SILENT):
+            print(_msg)
+
+    def deploy(self, pkgs):
+        """Pipelined deployment. Downloads run ahead of the installer into a queue that is
+        bounded by 'config.PIPELINE_BUDGET' bytes of downloaded, not yet installed packages,
+        while packages are installed one at a time, in order, as they become available."""
+        _qty = len(pkgs)
+        _jobs = max(1, min(config.DOWNLOAD_JOBS, _qty))
+        _budget = ByteBudget(limit=config.PIPELINE_BUDGET)
+        _ready = queue.Queue()
+        _started = time.time()
+
+        # Installer output would interleave with download progress bars.
+        self._downloaded_size = 0
+        self._no_progress = True
+
+        LOG.debug('Pipelined deployment of {} packages with {} download worker(s) and a {} budget'.format(
+            _qty, _jobs, misc.bytes2hr(byte=config.PIPELINE_BUDGET)))
+
+        with ThreadPoolExecutor(max_workers=_jobs) as executor:
+            # Budget is claimed in package order, so the next package to install has always
+            # either been submitted or is the next to be, which avoids a deadlock.
+            def _dispatch():
+                for _i, _pkg in enumerate(pkgs, start=1):
+                    _msg = counter_msg(_i, _qty)
+                    _budget.acquire(_pkg.DownloadSize)
+                    _ready.put((_pkg, _msg, executor.submit(self._download_worker, pkg=_pkg, counter_msg=_msg)))
+
+                _ready.put(None)
+
+            _dispatcher = threading.Thread(target=_dispatch, name='pipeline-dispatch')
+            _dispatcher.daemon = True
+            _dispatcher.start()
+
+            while True:
+                _item = _ready.get()
+
+                if _item is None:
+                    break
+
+                _pkg, _msg, _future = _item
+                _future.result()
+
+                self._install_and_clean_up(pkg=_pkg, counter_msg=_msg)
+                _budget.release(_pkg.DownloadSize)
+
+            _dispatcher.join()
+
+        if not config.DRY_RUN:
+            self._report_throughput(elapsed=time.time() - _started)
+
+
+class ByteBudget(object):
+    """Limits the bytes of downloaded packages waiting to be installed. A package larger
+    than the whole budget is still admitted when nothing else is waiting."""
+    def __init__(self, limit):
+        self._limit = limit
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        """Blocks until 'size' bytes fit in the budget."""
+        with self._cond:
+            while self._in_use and self._in_use + size > self._limit:
+                self._cond.wait()
+
+            self._in_use += size
+
+    def release(self, size):
+        """Returns 'size' bytes to the budget."""
+        with self._cond:
+            self._in_use -= size
+            self._cond.notify_all()
@@ -0,0 +1,148 @@
+"""Contains the persistent cache of downloaded feed property lists. Cached feeds are
+revalidated with a conditional GET ('If-None-Match'/'If-Modified-Since'), so a feed that
+hasn't changed costs a single 'HTTP 304' instead of downloading it again. In offline mode
+feeds are only read from the cache."""
+import json
+import logging
+import os
+
+# pylint: disable=relative-import
+try:
+    import config
+    import curl_requests
+    import http_pool
+    import mirrors
+    import misc
+except ImportError:
+    from . import config
+    from . import curl_requests
+    from . import http_pool
+    from . import mirrors
+    from . import misc
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+
+class FeedCache(object):
+    """Cache of feed property lists in 'config.FEED_CACHE_PATH' (or 'cache_path'). Each feed
+    is stored with a '<feed>.json' file holding the URL and validators it was fetched with."""
+    def __init__(self, cache_path=None):
+        self._cache_path = cache_path
+
+        # Statistics, used in debug logging.
+        self.downloaded = 0
+        self.not_modified = 0
+        self.offline = 0
+
+    @property
+    def cache_path(self):
+        """Returns the cache folder in use."""
+        return self._cache_path if self._cache_path else config.FEED_CACHE_PATH
+
+    def _read_meta(self, meta_path):
+        """Returns the URL and validators a cached feed was fetched with."""
+        result = dict()
+
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, 'r') as _f:
+                    result = json.load(_f)
+            except (IOError, OSError, ValueError) as _e:
+                LOG.debug('Unable to read {}: {}'.format(meta_path, _e))
+
+        return result
+
+    def _write_meta(self, meta_path, meta):
+        """Saves the URL and validators a cached feed was fetched with."""
+        try:
+            with open(meta_path, 'w') as _f:
+                json.dump(meta, _f)
+        except (IOError, OSError) as _e:
+            LOG.debug('Unable to write {}: {}'.format(meta_path, _e))
+
+    def _revalidate(self, feed_path, meta_path, url):
+        """Revalidates or downloads the feed from 'url'. Returns 'True' if the cached copy is
+        current afterwards. The feed is downloaded next to the cached copy and moved over it
+        once complete, so an interrupted download never replaces a good copy."""
+        result = False
+        _meta = self._read_meta(meta_path)
+        _cached = os.path.exists(feed_path) and _meta.get('url', None) == url
+        _tmp_file = '{}.download'.format(feed_path)
+
+        # Validators only apply to the URL they came from.
+        _etag = _meta.get('etag', None) if _cached else None
+        _last_modified = _meta.get('last_modified', None) if _cached else None
+
+        _req = curl_requests.CURL()
+
+        try:
+            _headers = _req.get_if_modified(url=url, output=_tmp_file, etag=_etag, last_modified=_last_modified)
+        except http_pool.TransferError as _e:
+            LOG.debug('Unable to fetch {}: {}'.format(url, _e))
+            misc.clean_up(file_path=_tmp_file)
+
+            return result
+
+        if _headers is None:
+            self.not_modified += 1
+            LOG.debug('{} not modified since it was cached'.format(url))
+        else:
+            _headers = dict((_k.lower(), _v) for _k, _v in _headers.items())
+
+            os.rename(_tmp_file, feed_path)
+            self._write_meta(meta_path, {'url': url,
+                                         'etag': _headers.get('etag', None),
+                                         'last_modified': _headers.get('last-modified', None)})
+
+            self.downloaded += 1
+            LOG.debug('Cached {} from {}'.format(feed_path, url))
+
+        misc.clean_up(file_path=_tmp_file)
+        result = True
+
+        return result
+
+    def get(self, feed, urls):
+        """Returns the path to the cached copy of the feed property list 'feed', revalidating
+        it against each of 'urls' in order (fastest first if 'config.RANK_MIRRORS') until one
+        succeeds. If all fail, or in offline mode, any cached copy is used. Returns 'None' if
+        there is no copy of the feed."""
+        result = None
+        _feed_path = os.path.join(self.cache_path, feed)
+        _meta_path = '{}.json'.format(_feed_path)
+
+        if not os.path.exists(self.cache_path):
+            try:
+                os.makedirs(self.cache_path)
+            except OSError as _e:
+                LOG.debug('Unable to create {}: {}'.format(self.cache_path, _e))
+
+        if config.OFFLINE:
+            self.offline += 1
+        else:
+            if config.RANK_MIRRORS:
+                urls = mirrors.RANKING.order(urls)
+
+            for _url in urls:
+                if self._revalidate(_feed_path, _meta_path, _url):
+                    break
+
+        if os.path.exists(_feed_path):
+            result = _feed_path
+        else:
+            _msg = 'Unable to get {}{}'.format(feed, ', it has not been cached' if config.OFFLINE else '')
+            LOG.info(_msg)
+
+            if not config.SILENT:
+                print(_msg)
+
+        LOG.debug('Feed cache: {} downloaded, {} not modified, {} offline'.format(self.downloaded,
+                                                                                self.not_modified,
+                                                                                self.offline))
+
+        return result
+
+
+# Module level cache shared by all sources in a run.
+CACHE = FeedCache()
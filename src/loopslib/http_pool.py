@@ -0,0 +1,1267 @@
+"""Contains the native HTTP transport. Connections are kept alive and pooled per host
+so that header probes and downloads to the same server (Apple, a caching server, or
+a local mirror) re-use a single TCP/TLS connection instead of forking '/usr/bin/curl'."""
+import base64
+import hashlib
+import json
+import logging
+import os
+import queue
+import socket
+import ssl
+import sys
+import threading
+import time
+import zlib
+
+import http.client as http_client
+
+from urllib.parse import urljoin, urlparse
+
+# pylint: disable=relative-import
+try:
+    import config
+    import curl_errors
+except ImportError:
+    from . import config
+    from . import curl_errors
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+# Size of each read from the socket when writing to disk.
+CHUNK_SIZE = 1024 * 256
+
+# Same maximum as cURL's default '--max-redirs'.
+MAX_REDIRECTS = 50
+
+# Idle connections kept per host.
+MAX_IDLE_PER_HOST = 8
+
+# HTTP status codes that cURL's '--retry' treats as transient.
+RETRY_STATUSES = [408, 429, 500, 502, 503, 504]
+
+# Same ceiling as '--retry-max-time 10' in the cURL backend.
+RETRY_MAX_TIME = 10
+
+REDIRECT_STATUSES = [301, 302, 303, 307, 308]
+
+
+class TransferError(Exception):
+    """Raised when a request or transfer fails. 'code' is the equivalent cURL exit code
+    so errors can be handled the same way regardless of the backend in use."""
+    def __init__(self, code, msg=None):
+        self.code = code
+        self.msg = msg if msg else curl_errors.CURL_ERRORS.get(code, 'Unknown error')
+
+        super(TransferError, self).__init__('{} ({})'.format(self.msg, self.code))
+
+
+class Response(object):
+    """A response from a pooled connection. The connection is returned to the pool
+    when the body has been read completely and the server allows keep-alive."""
+    def __init__(self, pool, key, conn, resp, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+
+        self.url = url
+        self.status = resp.status
+        self.reason = resp.reason
+        self.version = 'HTTP/1.0' if resp.version == 10 else 'HTTP/1.1'
+
+    def header(self, name, default=None):
+        """Returns the value of a header (case insensitive)."""
+        return self._resp.getheader(name, default)
+
+    @property
+    def headers(self):
+        """Returns the headers as a dictionary in the same form the cURL backend builds,
+        with the status line in 'Status' and the 'Content-Length' value as an int."""
+        result = dict()
+        result['Status'] = '{} {} {}'.format(self.version, self.status, self.reason)
+
+        for key, value in self._resp.getheaders():
+            if 'content-length' in key.lower():
+                try:
+                    value = int(value)
+                except ValueError:
+                    pass
+
+            result[key] = value
+
+        return result
+
+    def read(self, amt=None):
+        """Reads from the response body."""
+        return self._resp.read(amt)
+
+    def read1(self, amt):
+        """Reads up to 'amt' bytes from the response body, returning as soon as any bytes
+        are available rather than waiting for all 'amt' of them."""
+        return self._resp.read1(amt)
+
+    def release(self):
+        """Drains the response and returns the connection to the pool."""
+        if self._conn is None:
+            return
+
+        try:
+            # Small bodies (redirects, errors) are drained so the connection can be reused.
+            self._resp.read()
+        except (http_client.HTTPException, socket.error):
+            self.close()
+            return
+
+        if self._resp.will_close:
+            self.close()
+        else:
+            self._pool.release(self._key, self._conn)
+            self._conn = None
+
+    def abort(self):
+        """Shuts the connection down from another thread, so a read blocked waiting for a
+        stalled server returns straight away. The reading thread still closes it."""
+        _conn = self._conn
+
+        if _conn is not None and _conn.sock is not None:
+            try:
+                _conn.sock.shutdown(socket.SHUT_RDWR)
+            except (socket.error, OSError):
+                pass
+
+    def close(self):
+        """Closes the connection without returning it to the pool."""
+        if self._conn is not None:
+            self._pool.discard(self._conn)
+            self._conn = None
+
+
+class ConnectionPool(object):
+    """Pool of keep-alive HTTP/HTTPS connections, keyed by scheme, host and port."""
+    def __init__(self, max_idle=MAX_IDLE_PER_HOST):
+        self._idle = dict()
+        self._lock = threading.Lock()
+        self._max_idle = max_idle
+        self._ssl_context = None
+
+        # Statistics, used in debug logging.
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+    def _get_ssl_context(self):
+        """Returns the SSL context, honouring 'config.ALLOW_INSECURE_CURL'."""
+        if self._ssl_context is None:
+            _ctx = ssl.create_default_context()
+
+            if config.ALLOW_INSECURE_CURL:
+                _ctx.check_hostname = False
+                _ctx.verify_mode = ssl.CERT_NONE
+
+            self._ssl_context = _ctx
+
+        return self._ssl_context
+
+    # pylint: disable=no-self-use
+    def _get_proxy(self):
+        """Returns a tuple of the proxy host, port, and any 'Proxy-Authorization' header
+        from 'config.PROXY'. Accepts the same '[scheme://][user:pass@]host[:port]' form cURL does."""
+        result = None
+
+        if config.PROXY:
+            _proxy = config.PROXY
+
+            if '://' not in _proxy:
+                _proxy = 'http://{}'.format(_proxy)
+
+            _url = urlparse(_proxy)
+            _auth = None
+
+            if _url.username:
+                _creds = '{}:{}'.format(_url.username, _url.password or '')
+                _auth = 'Basic {}'.format(base64.b64encode(_creds.encode('utf-8')).decode('ascii'))
+
+            result = (_url.hostname, _url.port or 1080, _auth)
+
+        return result
+    # pylint: enable=no-self-use
+
+    def _new_connection(self, scheme, host, port):
+        """Creates a new connection, tunnelling through the proxy if one is configured."""
+        result = None
+        _proxy = self._get_proxy()
+        _timeout = config.CONNECT_TIMEOUT
+
+        if scheme == 'https':
+            if _proxy:
+                result = http_client.HTTPSConnection(_proxy[0], _proxy[1], timeout=_timeout,
+                                                     context=self._get_ssl_context())
+                _tunnel_headers = {'Proxy-Authorization': _proxy[2]} if _proxy[2] else None
+                result.set_tunnel(host, port, headers=_tunnel_headers)
+            else:
+                result = http_client.HTTPSConnection(host, port, timeout=_timeout,
+                                                     context=self._get_ssl_context())
+        else:
+            if _proxy:
+                result = http_client.HTTPConnection(_proxy[0], _proxy[1], timeout=_timeout)
+            else:
+                result = http_client.HTTPConnection(host, port, timeout=_timeout)
+
+        self.connections_opened += 1
+
+        return result
+
+    def acquire(self, key):
+        """Returns an idle connection for 'key' if there is one, otherwise a new connection.
+        The second value returned indicates if the connection was reused."""
+        with self._lock:
+            _idle = self._idle.get(key)
+
+            if _idle:
+                self.connections_reused += 1
+                return (_idle.pop(), True)
+
+        return (self._new_connection(*key), False)
+
+    def release(self, key, conn):
+        """Returns a connection to the pool."""
+        with self._lock:
+            _idle = self._idle.setdefault(key, list())
+
+            if len(_idle) < self._max_idle:
+                _idle.append(conn)
+                conn = None
+
+        if conn is not None:
+            self.discard(conn)
+
+    # pylint: disable=no-self-use
+    def discard(self, conn):
+        """Closes a connection."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+    # pylint: enable=no-self-use
+
+    def close_all(self):
+        """Closes all idle connections."""
+        with self._lock:
+            for _conns in self._idle.values():
+                for _conn in _conns:
+                    self.discard(_conn)
+
+            self._idle = dict()
+
+        LOG.debug('Connection pool: {} opened, {} reused'.format(self.connections_opened,
+                                                                 self.connections_reused))
+
+    def _send(self, method, url, headers):
+        """Sends a single request without following redirects. A reused connection that
+        the server has since closed is retried once on a fresh connection."""
+        _url = urlparse(url)
+        _scheme = _url.scheme.lower()
+
+        if _scheme not in ['http', 'https']:
+            raise TransferError(1, 'Unsupported protocol: {}'.format(_scheme))
+
+        _port = _url.port or (443 if _scheme == 'https' else 80)
+        _key = (_scheme, _url.hostname, _port)
+        _path = _url.path or '/'
+
+        if _url.query:
+            _path = '{}?{}'.format(_path, _url.query)
+
+        _headers = {'User-Agent': config.USERAGENT,
+                    'Accept': '*/*'}
+        _proxy = self._get_proxy()
+
+        # Plain HTTP through a proxy requires the absolute URL as the request target.
+        if _proxy and _scheme == 'http':
+            _path = url
+
+            if _proxy[2]:
+                _headers['Proxy-Authorization'] = _proxy[2]
+
+        if headers:
+            _headers.update(headers)
+
+        while True:
+            conn, reused = self.acquire(_key)
+
+            try:
+                # Connections are made with 'config.CONNECT_TIMEOUT', then used with 'config.HTTP_TIMEOUT'.
+                if conn.sock is None:
+                    conn.connect()
+                    conn.sock.settimeout(config.HTTP_TIMEOUT)
+
+                conn.request(method, _path, headers=_headers)
+                resp = conn.getresponse()
+            except (http_client.RemoteDisconnected, http_client.BadStatusLine,
+                    ConnectionResetError, BrokenPipeError) as _e:
+                self.discard(conn)
+
+                if reused:
+                    continue
+
+                raise TransferError(52, '{}: {}'.format(curl_errors.CURL_ERRORS.get(52), _e))
+            except socket.gaierror as _e:
+                self.discard(conn)
+                raise TransferError(6, '{}: {}'.format(curl_errors.CURL_ERRORS.get(6), _e))
+            except socket.timeout:
+                self.discard(conn)
+                raise TransferError(28)
+            except ssl.SSLCertVerificationError as _e:
+                self.discard(conn)
+                raise TransferError(60, '{}: {}'.format(curl_errors.CURL_ERRORS.get(60), _e))
+            except ssl.SSLError as _e:
+                self.discard(conn)
+                raise TransferError(35, '{}: {}'.format(curl_errors.CURL_ERRORS.get(35), _e))
+            except (socket.error, http_client.HTTPException) as _e:
+                self.discard(conn)
+                raise TransferError(7, '{}: {}'.format(curl_errors.CURL_ERRORS.get(7), _e))
+
+            return Response(pool=self, key=_key, conn=conn, resp=resp, url=url)
+
+    def request(self, method, url, headers=None, retries=None):
+        """Sends a request, following redirects (like 'curl -L') and retrying transient
+        failures 'retries' times (default is 'config.CURL_RETRIES'), waiting 1 second and
+        doubling the wait on each retry, for no more than 'RETRY_MAX_TIME' seconds."""
+        result = None
+
+        if retries is None:
+            retries = config.CURL_RETRIES
+
+        _retries = int(retries) if retries else 0
+        _started = time.time()
+        _attempt = 0
+        _wait = 1
+
+        while True:
+            try:
+                result = self._follow(method, url, headers)
+
+                if result.status not in RETRY_STATUSES:
+                    break
+
+                _err = TransferError(22, 'HTTP {}'.format(result.status))
+            except TransferError as _e:
+                _err = _e
+
+            _attempt += 1
+            _elapsed = time.time() - _started
+
+            if _attempt > _retries or _elapsed + _wait > RETRY_MAX_TIME:
+                # Hand back the final response if the server answered at all.
+                if result is not None:
+                    break
+
+                raise _err
+
+            if result is not None:
+                result.release()
+                result = None
+
+            LOG.debug('{} {}: {} - retrying in {} seconds'.format(method, url, _err, _wait))
+            time.sleep(_wait)
+            _wait *= 2
+
+        return result
+
+    def _follow(self, method, url, headers):
+        """Follows redirects for a request."""
+        result = None
+        _redirects = 0
+
+        while True:
+            result = self._send(method, url, headers)
+
+            if result.status in REDIRECT_STATUSES:
+                _location = result.header('Location')
+
+                if _location:
+                    _redirects += 1
+
+                    if _redirects > MAX_REDIRECTS:
+                        result.close()
+                        raise TransferError(47)
+
+                    result.release()
+                    url = urljoin(url, _location)
+
+                    # Like cURL, a 303 (and a 301/302 to a POST) switches to GET.
+                    if result.status == 303 and method != 'HEAD':
+                        method = 'GET'
+
+                    continue
+
+            break
+
+        return result
+
+
+# Module level pool shared by all requests in a run.
+POOL = ConnectionPool()
+
+
+def head(url):
+    """Returns the headers of the final response for 'url' after following redirects.
+    Raises 'TransferError' on failure."""
+    result = None
+
+    resp = POOL.request('HEAD', url)
+    result = resp.headers
+    resp.release()
+
+    return result
+
+
+class _ProgressBar(object):
+    """Minimal progress bar, in the style of cURL's '--progress-bar'."""
+    def __init__(self, total):
+        self._total = total
+        self._last = 0
+        self._width = 72
+
+    def update(self, done, final=False):
+        """Redraws the bar, at most a few times per second."""
+        _now = time.time()
+
+        if not final and _now - self._last < 0.25:
+            return
+
+        self._last = _now
+
+        if self._total:
+            _pct = min(done / float(self._total), 1.0)
+            _bar = '#' * int(self._width * _pct)
+            sys.stdout.write('\r{:<{width}} {:5.1f}%'.format(_bar, _pct * 100, width=self._width))
+        else:
+            sys.stdout.write('\r{} bytes'.format(done))
+
+        if final:
+            sys.stdout.write('\n')
+
+        sys.stdout.flush()
+
+
+class TransferMonitor(object):
+    """Counts the bytes received by a transfer so another thread can watch its progress,
+    and lets that thread cancel the transfer. Once cancelled, the transfer raises
+    'TransferError' (with cURL's 'aborted by callback' code) as soon as it gets a response,
+    receives any bytes, or opens a file.
+    Files are opened with 'open', which holds 'files_lock', so the thread that cancelled the
+    transfer can replace or remove them while holding 'files_lock', knowing the transfer
+    won't open them again."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._responses = list()
+
+        self.files_lock = threading.Lock()
+        self.started = time.time()
+        self.received = 0
+        self.error = None
+
+        # Start of the current window used to measure the speed of the transfer.
+        self._window_started = self.started
+        self._window_received = 0
+
+    def attach(self, resp):
+        """Attaches a response of the transfer, so it is aborted if the transfer is cancelled.
+        If it already has been, the response is closed and 'TransferError' is raised."""
+        with self._lock:
+            self._responses.append(resp)
+
+        if self.cancelled:
+            resp.close()
+            raise self.error
+
+    def open(self, path, mode):
+        """Opens a file for the transfer. Raises 'TransferError' if it has been cancelled."""
+        with self.files_lock:
+            if self.cancelled:
+                raise self.error
+
+            return open(path, mode)
+
+    def add(self, amt):
+        """Records 'amt' bytes received."""
+        if self.cancelled:
+            raise self.error
+
+        with self._lock:
+            self.received += amt
+
+    def cancel(self, error=None):
+        """Cancels the transfer, aborting any response it is waiting on. The transfer fails
+        with 'error' (a 'TransferError'), by default cURL's 'aborted by callback' error."""
+        if self.cancelled:
+            return
+
+        self.error = error if error else TransferError(42)
+        self._cancelled.set()
+
+        with self._lock:
+            for _resp in self._responses:
+                _resp.abort()
+
+    @property
+    def cancelled(self):
+        """Returns 'True' if the transfer has been cancelled."""
+        return self._cancelled.is_set()
+
+    @property
+    def rate(self):
+        """Returns the average bytes per second received since the transfer started."""
+        return self.received / max(time.time() - self.started, 0.001)
+
+    def stalled(self, speed, period):
+        """Returns 'True' if less than 'speed' bytes per second were received over the last
+        'period' seconds. Each call after a full period starts a new period."""
+        _now = time.time()
+
+        with self._lock:
+            _elapsed = _now - self._window_started
+
+            if _elapsed < period:
+                return False
+
+            _rate = (self.received - self._window_received) / _elapsed
+            self._window_started = _now
+            self._window_received = self.received
+
+        return _rate < speed
+
+
+class StallWatchdog(object):
+    """Cancels transfers that receive less than 'config.STALL_SPEED' bytes per second for
+    'config.STALL_TIME' seconds, like cURL's '--speed-limit' and '--speed-time'. All
+    transfers are watched by one thread, started when the first transfer is added."""
+    def __init__(self, interval=1):
+        self._lock = threading.Lock()
+        self._monitors = set()
+        self._thread = None
+        self._interval = interval
+
+    def add(self, monitor):
+        """Watches the transfer with the 'TransferMonitor' 'monitor'."""
+        if not (config.STALL_SPEED and config.STALL_TIME):
+            return
+
+        with self._lock:
+            self._monitors.add(monitor)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def remove(self, monitor):
+        """Stops watching a transfer."""
+        with self._lock:
+            self._monitors.discard(monitor)
+
+    def _watch(self):
+        """Checks the speed of each transfer every 'interval' seconds."""
+        while True:
+            time.sleep(self._interval)
+
+            with self._lock:
+                _monitors = list(self._monitors)
+
+            for _monitor in _monitors:
+                if _monitor.stalled(config.STALL_SPEED, config.STALL_TIME):
+                    _msg = 'Operation too slow. Less than {} bytes/sec transferred the last {} seconds'
+                    _monitor.cancel(TransferError(28, _msg.format(config.STALL_SPEED, config.STALL_TIME)))
+
+
+# Module level watchdog shared by all transfers in a run.
+WATCHDOG = StallWatchdog()
+
+
+def _open(path, mode, monitor=None):
+    """Opens a file for a transfer, with 'monitor.open' if it has a 'TransferMonitor'."""
+    return monitor.open(path, mode) if monitor else open(path, mode)
+
+
+def content_total(resp):
+    """Returns the full size of the resource from a response, using the 'Content-Range'
+    total for partial responses. Returns 'None' if the size is not known."""
+    result = None
+
+    if resp.status == 206:
+        _range = resp.header('Content-Range') or ''
+
+        if '/' in _range and not _range.endswith('/*'):
+            result = int(_range.split('/')[-1])
+    else:
+        _length = resp.header('Content-Length')
+
+        if _length:
+            result = int(_length)
+
+    return result
+
+
+class StreamDigest(object):
+    """SHA-256 digest of a downloaded file, computed from the bytes as they are written so
+    the file doesn't have to be read again once it is complete. Bytes are hashed in file
+    order, so bytes written ahead of the digest (the ranges of a segmented download after
+    the first) are skipped, and read back from the file by 'catch_up'."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hash = hashlib.sha256()
+
+        self.offset = 0  # Bytes of the file hashed so far.
+        self.read_back = 0  # Bytes read back from the file, used in debug logging.
+
+    def reset(self):
+        """Starts the digest again, for a file that is being rewritten from the beginning."""
+        with self._lock:
+            self._hash = hashlib.sha256()
+            self.offset = 0
+
+    def update(self, offset, data):
+        """Hashes 'data', written at 'offset' in the file, if it is the next byte to hash."""
+        with self._lock:
+            if offset == self.offset:
+                self._hash.update(data)
+                self.offset += len(data)
+
+    def adopt(self, other):
+        """Carries on from the digest 'other' (another 'StreamDigest')."""
+        with other._lock:  # pylint: disable=protected-access
+            _hash = other._hash.copy()  # pylint: disable=protected-access
+            _offset = other.offset
+
+        with self._lock:
+            self._hash = _hash
+            self.offset = _offset
+
+    def catch_up(self, path, end=None):
+        """Hashes the bytes of the file at 'path' that haven't been hashed yet, up to 'end'
+        (by default the end of the file). A file shorter than the bytes already hashed has
+        been replaced, so it is hashed from the beginning."""
+        _size = os.path.getsize(path) if os.path.exists(path) else 0
+        end = _size if end is None else min(end, _size)
+
+        with self._lock:
+            if _size < self.offset:
+                self._hash = hashlib.sha256()
+                self.offset = 0
+
+            if self.offset >= end:
+                return
+
+            with open(path, 'rb') as _f:
+                _f.seek(self.offset)
+
+                while self.offset < end:
+                    _chunk = _f.read(min(CHUNK_SIZE, end - self.offset))
+
+                    if not _chunk:
+                        break
+
+                    self._hash.update(_chunk)
+                    self.offset += len(_chunk)
+                    self.read_back += len(_chunk)
+
+    def hexdigest(self):
+        """Returns the digest of the bytes hashed so far as a hex string."""
+        with self._lock:
+            return self._hash.hexdigest()
+
+
+def _read_chunk(resp, amt=CHUNK_SIZE):
+    """Reads up to 'amt' bytes of the body of 'resp', returning whatever has arrived so slow
+    transfers are measured as they go. Raises 'TransferError' on failure."""
+    try:
+        return resp.read1(amt)
+    except socket.timeout:
+        raise TransferError(28)
+    except (http_client.HTTPException, socket.error) as _e:
+        raise TransferError(18, '{}: {}'.format(curl_errors.CURL_ERRORS.get(18), _e))
+
+
+def _write_body(resp, output, mode, done, total, progress, monitor=None, digest=None):
+    """Writes the body of 'resp' to 'output', decoding it if it is gzipped. 'done' is the
+    number of bytes of the resource already on disk. Bytes received are reported to
+    'monitor' (a 'TransferMonitor'), and bytes written are hashed by 'digest' (a
+    'StreamDigest'). Returns the number of bytes written."""
+    result = 0
+    _decoder = None
+
+    if digest and mode == 'wb':
+        digest.reset()
+
+    if (resp.header('Content-Encoding') or '').lower() == 'gzip':
+        _decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    _bar = _ProgressBar(total=total) if progress else None
+
+    with _open(output, mode, monitor) as _f:
+        _pos = _f.tell()
+
+        while True:
+            _chunk = _read_chunk(resp)
+
+            if not _chunk:
+                break
+
+            if monitor:
+                monitor.add(len(_chunk))
+
+            done += len(_chunk)
+
+            if _decoder:
+                _chunk = _decoder.decompress(_chunk)
+
+            _f.write(_chunk)
+
+            if digest:
+                digest.update(_pos + result, _chunk)
+
+            result += len(_chunk)
+
+            if _bar:
+                _bar.update(done)
+
+        if _decoder:
+            _chunk = _decoder.flush()
+            _f.write(_chunk)
+
+            if digest:
+                digest.update(_pos + result, _chunk)
+
+            result += len(_chunk)
+
+    if _bar:
+        _bar.update(done, final=True)
+
+    if total and done < total:
+        raise TransferError(18)
+
+    return result
+
+
+class SegmentedFetch(object):
+    """Downloads a file as several byte ranges over separate connections at the same time.
+    The file is allocated at its full size before any range is fetched and each range is
+    written in place, so nothing is reassembled afterwards.
+    Progress is saved to '<output>.segments' and the file is removed once all ranges are
+    complete. While it exists, the download resumes each range where it stopped rather
+    than from the end of the (already full size) file.
+    Bytes are hashed by 'digest' (a 'StreamDigest') as the first range is written, the other
+    ranges are read back once they are complete."""
+    def __init__(self, url, output, total, segments=1, validator=None, ranges=None, monitor=None, digest=None):
+        self._url = url
+        self._monitor = monitor
+        self._digest = digest
+        self._output = output
+        self._state_path = self.state_path(output)
+        self._lock = threading.Lock()
+        self._errors = list()
+        self._saved = 0
+        self._bar = None
+
+        self.total = total
+        self.validator = validator  # 'ETag' or 'Last-Modified', sent as 'If-Range'
+        self.written = 0
+
+        if ranges:
+            self.ranges = [list(_range) for _range in ranges]
+        else:
+            _size = -(-total // segments)  # Rounded up
+
+            # Each range is '[next byte to fetch, end of range]', the end is exclusive.
+            self.ranges = [[_start, min(_start + _size, total)] for _start in range(0, total, _size)]
+
+    @staticmethod
+    def state_path(output):
+        """Returns the path the progress of a segmented download of 'output' is saved to."""
+        return '{}.segments'.format(output)
+
+    @classmethod
+    def resumable(cls, url, output, monitor=None, digest=None):
+        """Returns a 'SegmentedFetch' for an unfinished segmented download of 'output',
+        or 'None' if there isn't one."""
+        result = None
+        _state_path = cls.state_path(output)
+
+        if os.path.exists(_state_path):
+            try:
+                with open(_state_path, 'r') as _f:
+                    _state = json.load(_f)
+
+                # The validator is only good for the source it came from. Carrying on from
+                # another source relies on the file being the same size instead.
+                _validator = _state['validator'] if _state.get('url', None) == url else None
+
+                if os.path.getsize(output) == _state['total']:
+                    result = cls(url=url, output=output, total=_state['total'], validator=_validator,
+                                 ranges=_state['ranges'], monitor=monitor, digest=digest)
+            except (IOError, OSError, ValueError, KeyError) as _e:
+                LOG.debug('Unable to resume segmented download of {}: {}'.format(output, _e))
+
+        return result
+
+    def discard(self):
+        """Removes the partial file and its saved progress."""
+        for _path in [self._state_path, self._output]:
+            if os.path.exists(_path):
+                os.remove(_path)
+
+    @property
+    def done(self):
+        """Returns the number of bytes of the file fetched so far."""
+        return self.total - sum(_end - _next for _next, _end in self.ranges)
+
+    def _save(self, force=False):
+        """Saves the progress of each range, at most once a second unless 'force' is 'True'.
+        Must be called with the lock held (or before any range is fetched)."""
+        _now = time.time()
+
+        if not force and _now - self._saved < 1:
+            return
+
+        self._saved = _now
+
+        with _open(self._state_path, 'w', self._monitor) as _f:
+            json.dump({'url': self._url, 'total': self.total, 'validator': self.validator, 'ranges': self.ranges}, _f)
+
+    def _open(self, index):
+        """Requests the rest of range 'index'. The range must come back as asked for, and
+        only from the same version of the file, otherwise 'TransferError' is raised."""
+        _next, _end = self.ranges[index]
+        _headers = {'Range': 'bytes={}-{}'.format(_next, _end - 1)}
+
+        if self.validator:
+            _headers['If-Range'] = self.validator
+
+        resp = POOL.request('GET', self._url, headers=_headers)
+        _range = resp.header('Content-Range') or ''
+
+        if self._monitor:
+            self._monitor.attach(resp)
+
+        if resp.status != 206 or not _range.startswith('bytes {}-'.format(_next)) or content_total(resp) != self.total:
+            resp.close()
+            raise TransferError(33, '{}: HTTP {} for bytes {}-{}'.format(curl_errors.CURL_ERRORS.get(33),
+                                                                          resp.status, _next, _end - 1))
+
+        return resp
+
+    def _fetch(self, index, resp=None):
+        """Fetches the rest of range 'index' into place. 'resp' is a response that already
+        starts at the range, but may carry on past the end of it."""
+        _reusable = resp is None
+
+        try:
+            if resp is None:
+                resp = self._open(index)
+
+            with _open(self._output, 'r+b', self._monitor) as _f:
+                _f.seek(self.ranges[index][0])
+
+                while self.ranges[index][0] < self.ranges[index][1]:
+                    _chunk = _read_chunk(resp, min(CHUNK_SIZE, self.ranges[index][1] - self.ranges[index][0]))
+
+                    if not _chunk:
+                        raise TransferError(18)
+
+                    if self._monitor:
+                        self._monitor.add(len(_chunk))
+
+                    _f.write(_chunk)
+
+                    if self._digest:
+                        self._digest.update(self.ranges[index][0], _chunk)
+
+                    with self._lock:
+                        self.ranges[index][0] += len(_chunk)
+                        self.written += len(_chunk)
+                        self._save()
+
+                        if self._bar:
+                            self._bar.update(self.done)
+
+            # A response that runs on past the range can't be drained and reused.
+            if _reusable:
+                resp.release()
+            else:
+                resp.close()
+        except Exception as _e:
+            if resp is not None:
+                resp.close()
+
+            LOG.debug('GET {} bytes {}-{}: {}'.format(self._url, self.ranges[index][0], self.ranges[index][1] - 1, _e))
+
+            with self._lock:
+                self._errors.append(_e)
+
+    def run(self, resp=None, progress=False):
+        """Fetches all unfinished ranges at the same time. 'resp' is a response for the file
+        from the first byte onwards, which is used for the first range.
+        Returns the number of bytes written. If any range fails, its 'TransferError' is
+        raised once the other ranges finish, and the download can be resumed."""
+        if not os.path.exists(self._state_path):
+            # Save the progress before allocating the file, otherwise an interrupted
+            # download would look like a complete file.
+            self._save(force=True)
+
+            with _open(self._output, 'wb', self._monitor) as _f:
+                _f.truncate(self.total)
+
+            if self._digest:
+                self._digest.reset()
+
+        self._bar = _ProgressBar(total=self.total) if progress else None
+        _threads = list()
+
+        for _index, (_next, _end) in enumerate(self.ranges):
+            if _next < _end:
+                _thread = threading.Thread(target=self._fetch, args=(_index, resp if _index == 0 else None))
+                _thread.daemon = True
+                _thread.start()
+                _threads.append(_thread)
+
+        for _thread in _threads:
+            _thread.join()
+
+        with self._lock:
+            self._save(force=True)
+
+        if self._bar:
+            self._bar.update(self.done, final=True)
+
+        if self._errors:
+            raise self._errors[0]
+
+        os.remove(self._state_path)
+        LOG.debug('GET {}: {} bytes in {} ranges'.format(self._url, self.total, len(self.ranges)))
+
+        if self._digest:
+            self._digest.catch_up(self._output)
+
+        return self.written
+
+
+# pylint: disable=too-many-arguments
+def fetch(url, output, resume=True, compressed=False, progress=False, min_length=None, announce=None,
+          segments=1, segment_threshold=None, monitor=None, digest=None):
+    """Downloads 'url' to 'output', creating any missing directories. When 'resume' is
+    'True' and 'output' exists, only the remaining bytes are requested (like 'curl -C -').
+    The status, size and encoding are all taken from the GET response, so no separate
+    header probe is required:
+      - 'min_length' raises 'TransferError' before anything is written if the server
+        reports a smaller file (for example, a caching server still filling its cache).
+      - 'announce' is called with 'download', 'resume' or 'skip' once the response
+        status is known and before any bytes are written.
+    When 'segments' is more than 1 and the server supports ranges, a file of at least
+    'segment_threshold' bytes is fetched as 'segments' ranges at the same time (see
+    'SegmentedFetch'), and an unfinished segmented download is resumed range by range.
+    Bytes received are reported to 'monitor' (a 'TransferMonitor'), which can cancel it,
+    and a transfer slower than 'config.STALL_SPEED' is cancelled by the 'WATCHDOG'.
+    Bytes written are hashed by 'digest' (a 'StreamDigest') as they arrive. Bytes already
+    on disk when a download is resumed are read from the file, before the rest is fetched.
+    Returns the number of bytes written. Raises 'TransferError' on failure."""
+    if monitor is None:
+        monitor = TransferMonitor()
+
+    WATCHDOG.add(monitor)
+
+    try:
+        return _fetch(url=url, output=output, resume=resume, compressed=compressed, progress=progress,
+                      min_length=min_length, announce=announce, segments=segments,
+                      segment_threshold=segment_threshold, monitor=monitor, digest=digest)
+    except TransferError:
+        # Fail with the reason the transfer was cancelled, rather than the broken connection.
+        if monitor.cancelled:
+            raise monitor.error
+
+        raise
+    finally:
+        WATCHDOG.remove(monitor)
+# pylint: enable=too-many-arguments
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-statements
+def _fetch(url, output, resume, compressed, progress, min_length, announce, segments, segment_threshold,
+           monitor, digest):
+    """Downloads 'url' to 'output', see 'fetch'."""
+    result = 0
+    _headers = dict()
+    _offset = 0
+
+    _dir = os.path.dirname(output)
+
+    if _dir and not os.path.exists(_dir):
+        os.makedirs(_dir, exist_ok=True)  # Concurrent downloads may race to create it.
+
+    _segmented = SegmentedFetch.resumable(url, output, monitor=monitor, digest=digest) if resume else None
+
+    if _segmented:
+        if announce:
+            announce('resume')
+
+        try:
+            return _segmented.run(progress=progress)
+        except TransferError as _e:
+            # The file has changed (or the server stopped honouring ranges), start again.
+            if _e.code != 33:
+                raise
+
+            LOG.debug('GET {}: {}, restarting download'.format(url, _e))
+            _segmented.discard()
+    elif os.path.exists(SegmentedFetch.state_path(output)):
+        os.remove(SegmentedFetch.state_path(output))
+
+    if resume and os.path.exists(output):
+        _offset = os.path.getsize(output)
+
+        if _offset:
+            _headers['Range'] = 'bytes={}-'.format(_offset)
+
+    # An open ended range from the first byte tells if the server supports ranges
+    # without a separate request.
+    if segments > 1 and not _offset:
+        _headers['Range'] = 'bytes=0-'
+
+    if compressed:
+        _headers['Accept-Encoding'] = 'gzip'
+
+    resp = POOL.request('GET', url, headers=_headers)
+
+    if monitor:
+        monitor.attach(resp)
+
+    try:
+        # Requested range starts at (or after) the end of the file, nothing to fetch.
+        if resp.status == 416 and _offset:
+            LOG.debug('GET {}: range not satisfiable, {} is complete'.format(url, output))
+            resp.release()
+
+            if announce:
+                announce('skip')
+
+            return result
+
+        if resp.status not in [200, 206]:
+            raise TransferError(22, 'The requested URL returned error: {}'.format(resp.status))
+
+        _total = content_total(resp)
+
+        if min_length and _total is not None and _total < min_length:
+            raise TransferError(18, '{}: {} bytes available, {} expected'.format(curl_errors.CURL_ERRORS.get(18),
+                                                                               _total, min_length))
+
+        # Server ignored the range request but the local file is already the full size.
+        if resp.status == 200 and _offset and _total == _offset:
+            resp.close()
+
+            if announce:
+                announce('skip')
+
+            return result
+
+        if announce:
+            announce('resume' if (resp.status == 206 and _offset) else 'download')
+
+        if (resp.status == 206 and not _offset and _total and _total >= (segment_threshold or 0)
+                and segments > 1 and not resp.header('Content-Encoding')):
+            _validator = resp.header('ETag') or resp.header('Last-Modified')
+
+            # Weak validators can't be used with 'If-Range'.
+            if _validator and _validator.startswith('W/'):
+                _validator = resp.header('Last-Modified')
+
+            _segmented = SegmentedFetch(url=url, output=output, total=_total, segments=segments,
+                                        validator=_validator, monitor=monitor, digest=digest)
+
+            return _segmented.run(resp=resp, progress=progress)
+
+        # Server ignored the range request, so start again from the beginning.
+        _mode = 'ab' if (resp.status == 206 and _offset) else 'wb'
+        _done = _offset if resp.status == 206 else 0
+
+        # Bytes already on disk are hashed before the rest are appended.
+        if digest and _mode == 'ab':
+            digest.catch_up(output, _offset)
+
+        result = _write_body(resp=resp, output=output, mode=_mode, done=_done, total=_total, progress=progress,
+                             monitor=monitor, digest=digest)
+        resp.release()
+    except Exception:
+        resp.close()
+        raise
+
+    return result
+# pylint: enable=too-many-statements
+# pylint: enable=too-many-locals
+# pylint: enable=too-many-branches
+# pylint: enable=too-many-arguments
+
+
+class HedgeCounter(object):
+    """Counts the hedged requests started, how many finished before the request they were
+    hedging, and the bytes received by the requests that lost and were cancelled."""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.hedged = 0
+        self.won = 0
+        self.wasted = 0
+
+    def add(self, hedged=0, won=0, wasted=0):
+        """Updates the counts."""
+        with self._lock:
+            self.hedged += hedged
+            self.won += won
+            self.wasted += wasted
+
+    @property
+    def message(self):
+        """Returns a summary of the counts."""
+        return 'Hedged requests: {} started, {} won, {} bytes wasted'.format(self.hedged, self.won, self.wasted)
+
+
+# Module level counter shared by all requests in a run.
+HEDGES = HedgeCounter()
+
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-locals
+def fetch_hedged(url, hedge_url, output, delay, min_rate=None, hedge_min_length=None, digest=None, **kwargs):
+    """Downloads 'url' to 'output' with 'fetch', hedging against a slow source. If no bytes
+    have been received after 'delay' seconds, or they are arriving at less than 'min_rate'
+    bytes per second, the file is also requested from 'hedge_url' (into '<output>.hedge')
+    and whichever request finishes first is kept. The other request is cancelled.
+    'kwargs' are passed to 'fetch' for 'url'. The hedge request starts from the first byte,
+    is abandoned if the server reports fewer than 'hedge_min_length' bytes, and has no
+    progress bar. 'digest' (a 'StreamDigest') ends up with the digest of whichever
+    request was kept.
+    Returns the number of bytes written. If both requests fail, the 'TransferError' from
+    'url' is raised."""
+    result = 0
+    _monitor = TransferMonitor()
+    _hedge_monitor = TransferMonitor()
+    _hedge_digest = StreamDigest() if digest else None
+    _hedge_output = '{}.hedge'.format(output)
+    _hedged = False
+    _finished = dict()  # The result and error of each request, keyed by its URL.
+    _results = queue.Queue()
+
+    def _run(fetch_url, **fetch_kwargs):
+        try:
+            _results.put((fetch_url, (fetch(url=fetch_url, **fetch_kwargs), None)))
+        except Exception as _e:
+            _results.put((fetch_url, (None, _e)))
+
+    def _start(fetch_url, **fetch_kwargs):
+        # Daemon threads, so a request stuck on a stalled server doesn't hold up exiting.
+        _thread = threading.Thread(target=_run, args=(fetch_url,), kwargs=fetch_kwargs)
+        _thread.daemon = True
+        _thread.start()
+
+    _start(url, output=output, monitor=_monitor, digest=digest, **kwargs)
+
+    try:
+        try:
+            _key, _outcome = _results.get(timeout=delay)
+            _finished[_key] = _outcome
+        except queue.Empty:
+            if not _monitor.received or (min_rate and _monitor.rate < min_rate):
+                LOG.debug('GET {}: {} bytes after {} seconds, hedging with {}'.format(url, _monitor.received,
+                                                                                    delay, hedge_url))
+                HEDGES.add(hedged=1)
+                _hedged = True
+                _start(hedge_url, output=_hedge_output, resume=False, min_length=hedge_min_length,
+                       monitor=_hedge_monitor, digest=_hedge_digest)
+
+        # Wait for the first request to succeed, or for all of them to fail.
+        while len(_finished) < (2 if _hedged else 1) and not any(_e is None for _, _e in _finished.values()):
+            _key, _outcome = _results.get()
+            _finished[_key] = _outcome
+    except BaseException:
+        _monitor.cancel()
+        _hedge_monitor.cancel()
+        raise
+
+    _winner = next((_key for _key in [url, hedge_url] if _key in _finished and _finished[_key][1] is None), None)
+
+    if _hedged:
+        # The request that lost is cancelled rather than waited for, it may be stuck
+        # waiting for a stalled server.
+        _loser_monitor = _monitor if _winner == hedge_url else _hedge_monitor
+        _loser_monitor.cancel()
+
+        with _loser_monitor.files_lock:
+            if _winner == hedge_url:
+                # The request that lost may have been a segmented download.
+                if os.path.exists(SegmentedFetch.state_path(output)):
+                    os.remove(SegmentedFetch.state_path(output))
+
+                os.rename(_hedge_output, output)
+
+                if digest:
+                    digest.adopt(_hedge_digest)
+                LOG.debug('GET {}: hedged request to {} finished first'.format(url, hedge_url))
+            elif os.path.exists(_hedge_output):
+                os.remove(_hedge_output)
+
+        HEDGES.add(won=1 if _winner == hedge_url else 0, wasted=_loser_monitor.received)
+
+    if not _winner:
+        raise _finished[url][1]
+
+    result = _finished[_winner][0]
+
+    return result
+# pylint: enable=too-many-locals
+# pylint: enable=too-many-arguments
+
+
+def fetch_if_modified(url, output, etag=None, last_modified=None):
+    """Downloads 'url' to 'output' unless the server reports it has not changed since the
+    copy with the 'etag' or 'last_modified' validators was fetched.
+    Returns 'None' if not modified (HTTP 304), otherwise the response headers (in the same
+    form as 'head'). Raises 'TransferError' on failure."""
+    result = None
+    _headers = {'Accept-Encoding': 'gzip'}
+
+    if etag:
+        _headers['If-None-Match'] = etag
+
+    if last_modified:
+        _headers['If-Modified-Since'] = last_modified
+
+    _dir = os.path.dirname(output)
+
+    if _dir and not os.path.exists(_dir):
+        os.makedirs(_dir, exist_ok=True)
+
+    resp = POOL.request('GET', url, headers=_headers)
+
+    try:
+        if resp.status == 304:
+            LOG.debug('GET {}: not modified'.format(url))
+            resp.release()
+
+            return result
+
+        if resp.status != 200:
+            raise TransferError(22, 'The requested URL returned error: {}'.format(resp.status))
+
+        result = resp.headers
+        _write_body(resp=resp, output=output, mode='wb', done=0, total=content_total(resp), progress=False)
+        resp.release()
+    except Exception:
+        resp.close()
+        raise
+
+    return result
@@ -0,0 +1,214 @@
+"""Contains the download journal, a record of the state of each package in a destination
+kept in the destination itself. A run that was interrupted knows which packages it finished
+from the journal alone, so only the packages that are partial, failed, or missing are
+requested again.
+
+The journal is a file of JSON lines that is only ever appended to, so a crash can at worst
+leave an unfinished last line, which is ignored. It is rewritten with only the latest state
+of each package when it is read and has grown to more than twice that."""
+import json
+import logging
+import os
+import threading
+import time
+
+# pylint: disable=relative-import
+try:
+    import config
+except ImportError:
+    from . import config
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+JOURNAL_FILE = '.appleloops_journal'
+
+COMPLETE = 'complete'
+PARTIAL = 'partial'
+FAILED = 'failed'
+CORRUPT = 'corrupt'
+
+
+class DownloadJournal(object):
+    """Journal of the packages downloaded to a destination. The destination is the same
+    folder packages are downloaded to (see 'package.LoopPackage.DownloadPath'), unless
+    'dest_path' is given."""
+    def __init__(self, dest_path=None):
+        self._dest_path = dest_path
+        self._lock = threading.Lock()
+        self._entries = None
+        self._journal_path = None
+
+        # Statistics, used in debug logging.
+        self.skipped = 0
+
+    @property
+    def dest_path(self):
+        """Returns the destination the journal is for."""
+        result = self._dest_path
+
+        if not result:
+            if config.DMG_FILE or config.HTTP_DMG:
+                result = config.DMG_VOLUME_MOUNTPATH
+            else:
+                result = config.DESTINATION_PATH if config.DESTINATION_PATH else config.DEFAULT_DEST
+
+        return result
+
+    @property
+    def enabled(self):
+        """Returns 'True' if packages are being downloaded."""
+        return not config.DRY_RUN
+
+    def _load(self):
+        """Reads the journal, keeping the latest entry of each package."""
+        result = dict()
+        _lines = 0
+
+        if os.path.exists(self._journal_path):
+            try:
+                with open(self._journal_path, 'r') as _f:
+                    for _line in _f:
+                        _lines += 1
+
+                        try:
+                            _entry = json.loads(_line)
+                            result[_entry['path']] = _entry
+                        except (ValueError, KeyError):
+                            LOG.debug('Ignoring unreadable journal line {} in {}'.format(_lines, self._journal_path))
+            except (IOError, OSError) as _e:
+                LOG.debug('Unable to read {}: {}'.format(self._journal_path, _e))
+
+        LOG.debug('Journal {} contains {} packages'.format(self._journal_path, len(result)))
+
+        if _lines > len(result) * 2:
+            self._compact(result)
+
+        return result
+
+    def _compact(self, entries):
+        """Rewrites the journal with only 'entries'."""
+        _tmp = '{}.tmp'.format(self._journal_path)
+
+        try:
+            with open(_tmp, 'w') as _f:
+                for _entry in entries.values():
+                    _f.write('{}\n'.format(json.dumps(_entry, sort_keys=True)))
+
+            os.rename(_tmp, self._journal_path)
+        except (IOError, OSError) as _e:
+            LOG.debug('Unable to compact {}: {}'.format(self._journal_path, _e))
+
+    def _ready(self):
+        """Reads the journal for the current destination, if it hasn't been read already.
+        Must be called with the lock held."""
+        _journal_path = os.path.join(self.dest_path, JOURNAL_FILE)
+
+        if self._entries is None or self._journal_path != _journal_path:
+            self._journal_path = _journal_path
+            self._entries = self._load()
+
+    def _key(self, pkg):
+        """Returns the path of a package relative to the destination."""
+        return os.path.relpath(pkg.DownloadPath, self.dest_path)
+
+    def complete(self, pkg):
+        """Returns 'True' if the journal records the package as completely downloaded, and
+        the file is still the size and age it was when it completed. A forced download
+        ('config.FORCE_DOWNLOAD') downloads every package again, so nothing is complete."""
+        result = False
+
+        if not self.enabled or not pkg.DownloadPath or config.FORCE_DOWNLOAD:
+            return result
+
+        with self._lock:
+            self._ready()
+            _entry = self._entries.get(self._key(pkg), None)
+
+        if _entry and _entry['state'] == COMPLETE:
+            try:
+                _stat = os.stat(pkg.DownloadPath)
+                result = _stat.st_size == _entry['size'] and _stat.st_mtime == _entry['mtime']
+            except OSError:
+                pass
+
+        if result:
+            self.skipped += 1
+
+        return result
+
+    def corrupt(self, pkg):
+        """Returns 'True' if the journal records the package as corrupt (see 'verify')."""
+        result = False
+
+        if not self.enabled or not pkg.DownloadPath:
+            return result
+
+        with self._lock:
+            self._ready()
+            _entry = self._entries.get(self._key(pkg), None)
+
+        result = bool(_entry) and _entry['state'] == CORRUPT
+
+        return result
+
+    def record(self, pkg, failed=False, corrupt=False):
+        """Records the state of a package after a download attempt. The package is complete
+        if it is the size the feed gives, partial if only some of it is on disk, otherwise
+        failed. A download that raised an error ('failed') is never complete. A package
+        found to be 'corrupt' is removed and downloaded again by the next run."""
+        if not self.enabled or not pkg.DownloadPath:
+            return
+
+        _size = int(pkg.DownloadSize) if pkg.DownloadSize else None
+        _written = 0
+        _mtime = None
+
+        try:
+            _stat = os.stat(pkg.DownloadPath)
+            _written = _stat.st_size
+            _mtime = _stat.st_mtime
+        except OSError:
+            pass
+
+        if corrupt:
+            _state = CORRUPT
+        elif not failed and _size and _written == _size:
+            _state = COMPLETE
+        elif _written:
+            _state = PARTIAL
+        else:
+            _state = FAILED
+
+        _entry = {'path': self._key(pkg),
+                  'state': _state,
+                  'size': _size,
+                  'written': _written,
+                  'mtime': _mtime,
+                  'time': time.time()}
+
+        with self._lock:
+            self._ready()
+            self._entries[_entry['path']] = _entry
+
+            try:
+                if not os.path.exists(self.dest_path):
+                    os.makedirs(self.dest_path)
+
+                with open(self._journal_path, 'a') as _f:
+                    _f.write('{}\n'.format(json.dumps(_entry, sort_keys=True)))
+                    _f.flush()
+                    os.fsync(_f.fileno())
+            except (IOError, OSError) as _e:
+                LOG.debug('Unable to write {}: {}'.format(self._journal_path, _e))
+
+        LOG.debug('Journal: {} is {} ({} of {} bytes)'.format(_entry['path'], _state, _written, _size))
+
+    @property
+    def message(self):
+        """Returns a summary of the packages skipped."""
+        return 'Download journal: {} complete packages skipped without a request'.format(self.skipped)
+
+
+# Module level journal shared by all downloads in a run.
+JOURNAL = DownloadJournal()
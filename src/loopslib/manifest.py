@@ -0,0 +1,300 @@
+"""Contains the package manifest, the SHA-256 digest of each package downloaded to a destination,
+kept in the destination itself as a 'SHA256SUMS' file (the format 'shasum -a 256 -c' reads).
+Downloaded packages are checked against the size in the feed and, when the package server
+publishes a manifest of its own, against the digest in it. A destination served as a package
+server publishes its manifest with it.
+
+Packages are hashed as they are downloaded (see 'http_pool.StreamDigest'), so checking them
+doesn't take another pass over the file. The manifest is only ever appended to, and it is
+rewritten with only the latest digest of each package when it is read and has grown to more
+than that."""
+import logging
+import os
+import threading
+
+# pylint: disable=relative-import
+try:
+    import config
+    import http_pool
+    import misc
+except ImportError:
+    from . import config
+    from . import http_pool
+    from . import misc
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'SHA256SUMS'
+
+
+class CorruptPackageError(Exception):
+    """Raised when a package still fails its checks after it has been downloaded again."""
+
+
+def parse(text):
+    """Returns the digest of each path in the manifest 'text'. Later lines for the same path
+    replace earlier ones, and lines that aren't '<digest>  <path>' are ignored."""
+    result = dict()
+
+    for _line in text.splitlines():
+        _parts = _line.strip().split(None, 1)
+
+        if len(_parts) == 2 and len(_parts[0]) == 64:
+            # 'shasum' marks paths of files hashed in binary mode with '*'.
+            result[_parts[1].lstrip('*')] = _parts[0].lower()
+
+    return result
+
+
+class PackageManifest(object):
+    """Manifest of the packages downloaded to a destination. The destination is the same
+    folder packages are downloaded to (see 'package.LoopPackage.DownloadPath'), unless
+    'dest_path' is given. The package server's manifest is read from 'mirror_url', by default
+    'SHA256SUMS' at the root of 'config.LOCAL_HTTP_SERVER'."""
+    def __init__(self, dest_path=None, mirror_url=None):
+        self._dest_path = dest_path
+        self._mirror_url = mirror_url
+        self._lock = threading.Lock()
+        self._digests = None
+        self._manifest_path = None
+        self._mirror = None
+
+        # Statistics, used in debug logging.
+        self.verified = 0
+        self.corrupt = 0
+        self.read_back = 0
+
+    @property
+    def dest_path(self):
+        """Returns the destination the manifest is for."""
+        result = self._dest_path
+
+        if not result:
+            if config.DMG_FILE or config.HTTP_DMG:
+                result = config.DMG_VOLUME_MOUNTPATH
+            else:
+                result = config.DESTINATION_PATH if config.DESTINATION_PATH else config.DEFAULT_DEST
+
+        return result
+
+    @property
+    def mirror_url(self):
+        """Returns the URL of the package server's manifest, or 'None' if there is no server."""
+        result = self._mirror_url
+
+        if not result and config.LOCAL_HTTP_SERVER and not config.HTTP_DMG:
+            result = '{}/{}'.format(config.LOCAL_HTTP_SERVER, MANIFEST_FILE)
+
+        return result
+
+    @property
+    def enabled(self):
+        """Returns 'True' if packages are being downloaded."""
+        return not config.DRY_RUN
+
+    def _load(self):
+        """Reads the manifest."""
+        result = dict()
+        _lines = 0
+
+        if os.path.exists(self._manifest_path):
+            try:
+                with open(self._manifest_path, 'r') as _f:
+                    _text = _f.read()
+
+                _lines = len(_text.splitlines())
+                result = parse(_text)
+            except (IOError, OSError) as _e:
+                LOG.debug('Unable to read {}: {}'.format(self._manifest_path, _e))
+
+        LOG.debug('Manifest {} contains {} packages'.format(self._manifest_path, len(result)))
+
+        if _lines > len(result):
+            self._compact(result)
+
+        return result
+
+    def _load_mirror(self):
+        """Fetches the package server's manifest. A server that doesn't publish one (or can't
+        be reached) has an empty manifest, so nothing is checked against it."""
+        result = dict()
+
+        if not self.mirror_url:
+            return result
+
+        try:
+            resp = http_pool.POOL.request('GET', self.mirror_url)
+
+            if resp.status == 200:
+                result = parse(resp.read().decode('utf-8', 'replace'))
+                resp.release()
+            else:
+                resp.close()
+        except (http_pool.TransferError, http_pool.http_client.HTTPException, OSError) as _e:
+            LOG.debug('Unable to fetch {}: {}'.format(self.mirror_url, _e))
+
+        LOG.debug('Package server manifest {} contains {} packages'.format(self.mirror_url, len(result)))
+
+        return result
+
+    def _compact(self, digests):
+        """Rewrites the manifest with only 'digests'."""
+        _tmp = '{}.tmp'.format(self._manifest_path)
+
+        try:
+            with open(_tmp, 'w') as _f:
+                for _path in sorted(digests):
+                    _f.write('{}  {}\n'.format(digests[_path], _path))
+
+            os.rename(_tmp, self._manifest_path)
+        except (IOError, OSError) as _e:
+            LOG.debug('Unable to compact {}: {}'.format(self._manifest_path, _e))
+
+    def _ready(self):
+        """Reads the manifest for the current destination and the package server's manifest,
+        if they haven't been read already. Must be called with the lock held."""
+        _manifest_path = os.path.join(self.dest_path, MANIFEST_FILE)
+
+        if self._digests is None or self._manifest_path != _manifest_path:
+            self._manifest_path = _manifest_path
+            self._digests = self._load()
+
+        if self._mirror is None:
+            self._mirror = self._load_mirror()
+
+    def _key(self, pkg):
+        """Returns the path of a package relative to the destination, which is also its path
+        relative to the root of the package server."""
+        return os.path.relpath(pkg.DownloadPath, self.dest_path)
+
+    def current(self, pkg):
+        """Returns 'False' if the digest recorded for the package differs from the one the
+        package server publishes, so a package the download journal records as complete is
+        checked again rather than skipped."""
+        result = True
+
+        if not self.enabled or not pkg.DownloadPath:
+            return result
+
+        with self._lock:
+            self._ready()
+            _key = self._key(pkg)
+            _digest = self._digests.get(_key, None)
+            _expected = self._mirror.get(_key, None)
+
+        if _digest and _expected and _digest != _expected:
+            result = False
+
+        return result
+
+    def expected(self, pkg):
+        """Returns the digest a package should have, the one the package server publishes if
+        there is one, otherwise the one recorded when it was downloaded. Returns 'None' if
+        neither manifest has the package."""
+        with self._lock:
+            self._ready()
+            _key = self._key(pkg)
+            result = self._mirror.get(_key, self._digests.get(_key, None))
+
+        return result
+
+    def add(self, pkg, digest):
+        """Records 'digest' (a hex string) as the digest of a package."""
+        if not self.enabled or not pkg.DownloadPath:
+            return
+
+        with self._lock:
+            self._ready()
+            self._add(self._key(pkg), digest)
+
+    def prune(self, keep):
+        """Removes the packages that aren't in 'keep' (paths relative to the destination) from
+        the manifest. Returns the number removed."""
+        with self._lock:
+            # Only the local manifest is needed, so the package server's isn't fetched.
+            self._manifest_path = os.path.join(self.dest_path, MANIFEST_FILE)
+            self._digests = self._load()
+            _kept = dict((_key, _digest) for _key, _digest in self._digests.items() if _key in keep)
+            result = len(self._digests) - len(_kept)
+
+            if result:
+                self._digests = _kept
+                self._compact(_kept)
+
+        LOG.debug('Removed {} packages from {}'.format(result, self._manifest_path))
+
+        return result
+
+    def verify(self, pkg, digest=None):
+        """Checks a downloaded package is the size the feed gives and, if the package server
+        publishes a digest for it, has that digest. 'digest' is the 'http_pool.StreamDigest'
+        it was downloaded with, any bytes it didn't hash are read from the file. Packages that
+        pass are added to the manifest.
+        Returns 'None' if the package passes, otherwise the reason it failed."""
+        result = None
+
+        if not self.enabled or not pkg.DownloadPath:
+            return result
+
+        if digest is None:
+            digest = http_pool.StreamDigest()
+
+        _path = pkg.DownloadPath
+        _size = pkg.RealDownloadSize if config.REAL_DOWNLOAD_SIZE else pkg.DownloadSize
+        _local_size = os.path.getsize(_path) if os.path.exists(_path) else None
+
+        if _local_size is None:
+            result = 'file not found'
+        elif _size and _local_size != int(_size):
+            result = '{} bytes, {} expected'.format(_local_size, int(_size))
+        else:
+            digest.catch_up(_path)
+            _digest = digest.hexdigest()
+
+            with self._lock:
+                self._ready()
+                _key = self._key(pkg)
+                _expected = self._mirror.get(_key, None)
+                self.read_back += digest.read_back
+
+                if _expected and _digest != _expected:
+                    result = 'SHA-256 {}, {} expected'.format(_digest, _expected)
+                else:
+                    self._add(_key, _digest)
+
+        with self._lock:
+            if result:
+                self.corrupt += 1
+            else:
+                self.verified += 1
+
+        LOG.debug('Verified {}: {}'.format(_path, result if result else 'OK'))
+
+        return result
+
+    def _add(self, key, digest):
+        """Records the digest of a package. Must be called with the lock held."""
+        if self._digests.get(key, None) == digest:
+            return
+
+        self._digests[key] = digest
+
+        try:
+            if not os.path.exists(self.dest_path):
+                os.makedirs(self.dest_path)
+
+            with open(self._manifest_path, 'a') as _f:
+                _f.write('{}  {}\n'.format(digest, key))
+        except (IOError, OSError) as _e:
+            LOG.debug('Unable to write {}: {}'.format(self._manifest_path, _e))
+
+    @property
+    def message(self):
+        """Returns a summary of the packages checked."""
+        return 'Package manifest: {} verified, {} corrupt, {} read back'.format(self.verified, self.corrupt,
+                                                                             misc.bytes2hr(byte=self.read_back))
+
+
+# Module level manifest shared by all downloads in a run.
+MANIFEST = PackageManifest()
@@ -0,0 +1,139 @@
+"""Contains the garbage collection of a package server mirror. Packages in the mirror that no
+feed in a set of feeds refers to (by default every supported feed) are removed, along with any
+unfinished download of them. The packages the feeds refer to are read from the catalog index
+(see 'catalog.CatalogIndex') where possible, so only feeds missing from it are downloaded,
+and include packages in 'lp10_ms3_content_2013' and packages renamed by 'Bad Wolf' patches."""
+import logging
+import os
+
+# pylint: disable=relative-import
+try:
+    import config
+    import manifest
+    import misc
+    import remote_plist
+    import supported
+except ImportError:
+    from . import config
+    from . import manifest
+    from . import misc
+    from . import remote_plist
+    from . import supported
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+# Unfinished downloads of a package, left by segmented and hedged downloads.
+PARTIAL_SUFFIXES = ['.segments', '.hedge']
+
+
+def package_path(path):
+    """Returns the path of the package 'path' is (or is an unfinished download of)."""
+    result = path
+
+    for _suffix in PARTIAL_SUFFIXES:
+        if result.endswith('.pkg{}'.format(_suffix)):
+            result = result[:-len(_suffix)]
+
+    return result
+
+
+class MirrorGC(object):
+    """Garbage collection of 'dest_path' (by default the destination packages are downloaded
+    to) against the feeds 'feeds' (by default every supported feed)."""
+    def __init__(self, dest_path=None, feeds=None):
+        self._dest_path = dest_path if dest_path else (config.DESTINATION_PATH or config.DEFAULT_DEST)
+        self._feeds = feeds if feeds else sorted(supported.SUPPORTED.values())
+
+        # Statistics, used in the summary.
+        self.referenced = 0
+        self.unreferenced = 0
+        self.reclaimable = 0
+        self.removed = 0
+
+    def references(self):
+        """Returns the paths (relative to the mirror) of every package the feeds refer to."""
+        result = set()
+
+        for _feed in self._feeds:
+            try:
+                _source = remote_plist.RemotePlist(obj=_feed)
+            except Exception as _e:
+                LOG.debug('Unable to load {}: {}'.format(_feed, _e))
+                raise IOError('Unable to read {}'.format(_feed))
+
+            if not _source.mandatory_pkgs and not _source.optional_pkgs:
+                # Removing packages a feed might refer to isn't safe.
+                raise IOError('Unable to read {}'.format(_feed))
+
+            for _pkg in set(_source.mandatory_pkgs).union(_source.optional_pkgs):
+                result.add(os.path.relpath(_pkg.DownloadPath, self._dest_path))
+
+        LOG.debug('{} feeds refer to {} packages'.format(len(self._feeds), len(result)))
+
+        return result
+
+    def _scan(self, path=None):
+        """Returns the size of each package (or unfinished download of one) in the mirror,
+        keyed by its path relative to the mirror. Hidden files and folders are skipped."""
+        result = dict()
+        path = path if path else self._dest_path
+
+        try:
+            _entries = list(os.scandir(path))
+        except OSError as _e:
+            LOG.debug('Unable to read {}: {}'.format(path, _e))
+            return result
+
+        for _entry in _entries:
+            if _entry.name.startswith('.'):
+                continue
+
+            if _entry.is_dir(follow_symlinks=False):
+                result.update(self._scan(_entry.path))
+            elif _entry.is_file(follow_symlinks=False):
+                if package_path(_entry.name).endswith('.pkg'):
+                    result[os.path.relpath(_entry.path, self._dest_path)] = _entry.stat(follow_symlinks=False).st_size
+
+        return result
+
+    def run(self):
+        """Removes (or, in a dry run, lists) the files in the mirror no feed refers to.
+        Returns the number of bytes removed (or that would be)."""
+        _references = self.references()
+        _files = self._scan()
+
+        for _path, _size in sorted(_files.items()):
+            if package_path(_path) in _references:
+                self.referenced += 1
+                continue
+
+            self.unreferenced += 1
+            self.reclaimable += _size
+            _file = os.path.join(self._dest_path, _path)
+
+            if config.DRY_RUN:
+                _msg = 'Unreferenced {} ({})'.format(_file, misc.bytes2hr(byte=_size))
+            else:
+                misc.clean_up(file_path=_file)
+                self.removed += 0 if os.path.exists(_file) else 1
+                _msg = 'Removed {} ({})'.format(_file, misc.bytes2hr(byte=_size))
+
+            LOG.info(_msg)
+
+            if not (config.SILENT or config.QUIET):
+                print(_msg)
+
+        # The package server publishes the manifest, so it only lists packages it has.
+        if self.removed:
+            manifest.PackageManifest(dest_path=self._dest_path).prune(keep=_references)
+
+        return self.reclaimable
+
+    @property
+    def message(self):
+        """Returns a summary of the garbage collection."""
+        return 'Mirror GC: {} packages referenced by {} feeds, {} unreferenced files, {} {}'.format(
+            self.referenced, len(self._feeds), self.unreferenced, misc.bytes2hr(byte=self.reclaimable),
+            'reclaimable' if config.DRY_RUN else 'reclaimed'
+        )
@@ -0,0 +1,168 @@
+"""Contains the incremental sync of a package server mirror. The packages in the feeds are
+compared with the packages the last sync fetched, which are recorded in '.appleloops_sync' in
+the mirror, and only packages that are new, have changed (a different size or version) or are
+missing from the mirror are downloaded. A sync where nothing has changed makes no requests
+beyond revalidating the feeds."""
+import json
+import logging
+import os
+import time
+
+# pylint: disable=relative-import
+try:
+    import compare
+    import config
+    import deployment
+    import misc
+except ImportError:
+    from . import compare
+    from . import config
+    from . import deployment
+    from . import misc
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+SYNC_FILE = '.appleloops_sync'
+
+# Packages downloaded at the same time, unless '-j/--jobs' asks for more than one.
+SYNC_JOBS = 4
+
+
+class MirrorSync(object):
+    """Sync of the packages 'pkgs' to 'dest_path' (by default the destination packages are
+    downloaded to)."""
+    def __init__(self, pkgs, dest_path=None):
+        self._pkgs = pkgs
+        self._dest_path = dest_path if dest_path else (config.DESTINATION_PATH or config.DEFAULT_DEST)
+        self._sync_path = os.path.join(self._dest_path, SYNC_FILE)
+
+        # Statistics, used in the summary.
+        self.added = 0
+        self.changed = 0
+        self.missing = 0
+        self.removed = 0
+        self.unchanged = 0
+        self.failed = 0
+
+    def _key(self, pkg):
+        """Returns the path of a package relative to the mirror."""
+        return os.path.relpath(pkg.DownloadPath, self._dest_path)
+
+    # pylint: disable=no-self-use
+    def _fingerprint(self, pkg):
+        """Returns the details of a package that change when Apple replaces it."""
+        return {'size': int(pkg.DownloadSize) if pkg.DownloadSize else None,
+                'version': '{}'.format(pkg.PackageVersion)}
+    # pylint: enable=no-self-use
+
+    # pylint: disable=no-self-use
+    def _present(self, pkg):
+        """Returns 'True' if a package is in the mirror at the size the feed gives."""
+        result = False
+
+        if os.path.exists(pkg.DownloadPath):
+            result = not pkg.DownloadSize or os.path.getsize(pkg.DownloadPath) == int(pkg.DownloadSize)
+
+        return result
+    # pylint: enable=no-self-use
+
+    def _load(self):
+        """Returns the packages recorded by the last sync."""
+        result = dict()
+
+        if os.path.exists(self._sync_path):
+            try:
+                with open(self._sync_path, 'r') as _f:
+                    result = json.load(_f)['packages']
+            except (IOError, OSError, ValueError, KeyError) as _e:
+                LOG.debug('Unable to read {}: {}'.format(self._sync_path, _e))
+
+        return result
+
+    def _save(self, packages):
+        """Records the packages synced. The file is written under a temporary name and renamed,
+        so an interrupted sync leaves the last record in place."""
+        _tmp = '{}.tmp'.format(self._sync_path)
+
+        try:
+            with open(_tmp, 'w') as _f:
+                json.dump({'synced': time.time(), 'packages': packages}, _f, indent=2, sort_keys=True)
+
+            os.rename(_tmp, self._sync_path)
+        except (IOError, OSError) as _e:
+            LOG.debug('Unable to write {}: {}'.format(self._sync_path, _e))
+
+    def plan(self, synced):
+        """Returns the packages to download, given the packages recorded by the last sync
+        ('synced'). Changed packages are removed from the mirror, so they aren't resumed
+        or skipped."""
+        result = list()
+        _current = dict((self._key(_pkg), _pkg) for _pkg in self._pkgs)
+        _new, _removed, _common = compare.changes(old=set(synced), new=set(_current))
+
+        self.added = len(_new)
+        self.removed = len(_removed)
+
+        for _key, _pkg in sorted(_current.items()):
+            if _key in _new:
+                # A mirror that was downloaded to before it was synced already has most of them.
+                if not self._present(_pkg):
+                    result.append(_pkg)
+            elif synced[_key] != self._fingerprint(_pkg):
+                self.changed += 1
+
+                if not config.DRY_RUN:
+                    misc.clean_up(file_path=_pkg.DownloadPath)
+
+                result.append(_pkg)
+            elif not os.path.exists(_pkg.DownloadPath):
+                self.missing += 1
+                result.append(_pkg)
+            else:
+                self.unchanged += 1
+
+        LOG.debug('Mirror sync of {}: {} packages, {} to download, {} in common with the last sync'.format(
+            self._dest_path, len(_current), len(result), len(_common)))
+
+        return result
+
+    def run(self):
+        """Downloads the packages that are new, changed, or missing, and records the packages
+        that are in the mirror at the size the feed gives. Returns the packages that failed."""
+        result = list()
+        _synced = self._load()
+        _pkgs = self.plan(_synced)
+
+        if _pkgs:
+            _jobs = config.DOWNLOAD_JOBS if config.DOWNLOAD_JOBS > 1 else SYNC_JOBS
+            deployment.LoopDeployment().download(_pkgs, jobs=_jobs)
+
+        if config.DRY_RUN:
+            return result
+
+        _record = dict()
+        _fetched = set(self._key(_pkg) for _pkg in _pkgs)
+
+        for _pkg in self._pkgs:
+            _key = self._key(_pkg)
+
+            if _key in _fetched and not self._present(_pkg):
+                result.append(_pkg)
+                continue
+
+            _record[_key] = self._fingerprint(_pkg)
+
+        self.failed = len(result)
+
+        if _pkgs or set(_record) != set(_synced):
+            self._save(_record)
+
+        return result
+
+    @property
+    def message(self):
+        """Returns a summary of the sync."""
+        return ('Mirror sync: {} new, {} changed, {} missing, {} unchanged, {} no longer in the feeds, '
+                '{} failed'.format(self.added, self.changed, self.missing, self.unchanged, self.removed,
+                                   self.failed))
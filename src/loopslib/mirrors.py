@@ -0,0 +1,210 @@
+"""Contains the ranking of download sources (the package server, caching server and Apple for
+packages, Apple and the failover for feeds). The first time a source is used in a run it is
+probed with a small ranged request, and sources are ranked by how long they would take to
+fetch a typical package. Measurements are kept in a history file, so a source measured
+recently is ranked without probing it again."""
+import json
+import logging
+import os
+import threading
+import time
+
+from urllib.parse import urlparse
+
+# pylint: disable=relative-import
+try:
+    import config
+    import http_pool
+except ImportError:
+    from . import config
+    from . import http_pool
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+# Bytes requested when probing a source.
+PROBE_BYTES = 1024 * 256
+
+# Size used to weigh the latency of a source against its throughput.
+TYPICAL_SIZE = 1024 * 1024 * 50
+
+# Measurements of healthy sources younger than this (seconds) are used without probing.
+HISTORY_TTL = 3600
+
+# Weight of a new measurement against the previous one.
+SMOOTHING = 0.5
+
+
+def source_key(url):
+    """Returns the source of 'url' ('scheme://host[:port]'), which measurements are kept by."""
+    _url = urlparse(url)
+
+    return '{}://{}'.format(_url.scheme.lower(), _url.netloc.lower())
+
+
+def score(entry):
+    """Returns the estimated time (seconds) to fetch a typical package from a source with the
+    measurements 'entry'. Sources that failed or haven't been measured score infinity."""
+    result = float('inf')
+
+    if entry and entry.get('healthy', False):
+        result = entry['latency'] + TYPICAL_SIZE / max(entry['throughput'], 1.0)
+
+    return result
+
+
+class MirrorRanking(object):
+    """Ranks download sources, with measurements kept in 'config.MIRROR_HISTORY_PATH'
+    (or 'history_path')."""
+    def __init__(self, history_path=None):
+        self._history_path = history_path
+        self._lock = threading.Lock()
+        self._history = None
+        self._measured = set()  # Sources measured (or taken from the history) this run.
+
+        # Statistics, used in debug logging.
+        self.probes = 0
+        self.warm = 0
+
+    @property
+    def history_path(self):
+        """Returns the history file in use."""
+        return self._history_path if self._history_path else config.MIRROR_HISTORY_PATH
+
+    def _load(self):
+        """Reads the history file."""
+        result = dict()
+
+        if os.path.exists(self.history_path):
+            try:
+                with open(self.history_path, 'r') as _f:
+                    result = json.load(_f)
+            except (IOError, OSError, ValueError) as _e:
+                LOG.debug('Unable to read {}: {}'.format(self.history_path, _e))
+
+        return result
+
+    def _save(self):
+        """Saves the history file."""
+        _dir = os.path.dirname(self.history_path)
+
+        try:
+            if _dir and not os.path.exists(_dir):
+                os.makedirs(_dir)
+
+            with open(self.history_path, 'w') as _f:
+                json.dump(self._history, _f, indent=2, sort_keys=True)
+        except (IOError, OSError) as _e:
+            LOG.debug('Unable to write {}: {}'.format(self.history_path, _e))
+
+    # pylint: disable=no-self-use
+    def _probe(self, url):
+        """Fetches the first 'PROBE_BYTES' of 'url'. Returns a tuple of the latency (seconds
+        to the response headers) and throughput (bytes per second of the body), or 'None'
+        if the source failed."""
+        result = None
+        _started = time.time()
+
+        try:
+            # A source that needs retrying is not one to prefer, so don't retry.
+            resp = http_pool.POOL.request('GET', url, headers={'Range': 'bytes=0-{}'.format(PROBE_BYTES - 1)},
+                                          retries=0)
+        except http_pool.TransferError as _e:
+            LOG.debug('Probe of {} failed: {}'.format(url, _e))
+            return result
+
+        _latency = time.time() - _started
+        _received = 0
+
+        try:
+            if resp.status not in [200, 206]:
+                raise http_pool.TransferError(22, 'The requested URL returned error: {}'.format(resp.status))
+
+            while _received < PROBE_BYTES:
+                _chunk = resp.read(min(http_pool.CHUNK_SIZE, PROBE_BYTES - _received))
+
+                if not _chunk:
+                    break
+
+                _received += len(_chunk)
+        except Exception as _e:
+            LOG.debug('Probe of {} failed: {}'.format(url, _e))
+            resp.close()
+            return result
+
+        _elapsed = max(time.time() - _started - _latency, 0.001)
+
+        # A server that ignored the range is still sending the rest of the file.
+        if resp.status == 206:
+            resp.release()
+        else:
+            resp.close()
+
+        result = (_latency, _received / _elapsed)
+
+        return result
+    # pylint: enable=no-self-use
+
+    def _measure(self, url):
+        """Measures the source of 'url' if it hasn't been measured this run, and has no
+        recent measurement in the history. Must be called with the lock held."""
+        _key = source_key(url)
+        _now = time.time()
+
+        if _key in self._measured:
+            return
+
+        self._measured.add(_key)
+        _entry = self._history.get(_key, None)
+
+        if _entry and _entry.get('healthy', False) and _now - _entry.get('updated', 0) < HISTORY_TTL:
+            self.warm += 1
+            return
+
+        _result = self._probe(url)
+        self.probes += 1
+
+        if _result:
+            _latency, _throughput = _result
+
+            if _entry and _entry.get('healthy', False):
+                _latency = SMOOTHING * _latency + (1 - SMOOTHING) * _entry['latency']
+                _throughput = SMOOTHING * _throughput + (1 - SMOOTHING) * _entry['throughput']
+
+            self._history[_key] = {'healthy': True,
+                                   'latency': _latency,
+                                   'throughput': _throughput,
+                                   'updated': _now}
+        else:
+            self._history[_key] = {'healthy': False, 'updated': _now}
+
+        LOG.debug('Measured {}: {}'.format(_key, self._history[_key]))
+        self._save()
+
+    def order(self, urls):
+        """Returns 'urls' ordered fastest source first. Sources that failed their probe are
+        kept (as a last resort) after the healthy ones, and sources that rank the same keep
+        the order they were given in."""
+        result = [_url for _url in urls if _url]
+
+        if len(result) < 2:
+            return result
+
+        with self._lock:
+            if self._history is None:
+                self._history = self._load()
+
+            for _url in result:
+                self._measure(_url)
+
+            result = sorted(result, key=lambda _url: score(self._history.get(source_key(_url))))
+
+        LOG.debug('Ranked sources: {} ({} probes, {} from history)'.format(', '.join(source_key(_url)
+                                                                                   for _url in result),
+                                                                         self.probes, self.warm))
+
+        return result
+
+
+# Module level ranking shared by all downloads in a run.
+RANKING = MirrorRanking()
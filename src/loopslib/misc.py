@@ -4,16 +4,13 @@ import os
 import shutil
 import sys
 
-from distutils.version import StrictVersion
 from time import sleep
 
 # pylint: disable=relative-import
 try:
-    import arguments
     import config
     import version
 except ImportError:
-    from . import arguments
     from . import config
     from . import version
 # pylint: enable=relative-import
@@ -65,6 +62,14 @@ def find_installed_apps():
 
     # If there are no installed apps, need to print out appropriate usage.
     if not result:
+        # 'arguments' imports this module, so import it only when it is needed.
+        # pylint: disable=relative-import
+        try:
+            import arguments
+        except ImportError:
+            from . import arguments
+        # pylint: enable=relative-import
+
         arguments.LoopsArguments().parser.print_usage(sys.stderr)
         msg = ('{}: error: unable to find GarageBand, Logic Pro X, or MainStage,'
                ' please use the \'-a/--app\' or \'-p/--plist\' flag'.format(config.NAME))
@@ -1,6 +1,13 @@
 """Used to determine which optional packages belong to which 'pack' per release."""
 # pylint: disable=too-many-locals
 
+# pylint: disable=relative-import
+try:
+    import misc
+except ImportError:
+    from . import misc
+# pylint: enable=relative-import
+
 
 class OptionPack(object):
     """Attributes for the 'collection packs' of packages in an Application."""
@@ -29,82 +36,105 @@ class OptionPack(object):
         # Public attr.
         self.option_packs = self._process_packs()
 
-    # pylint: disable=too-many-nested-blocks
-    # pylint: disable=too-many-branches
+    # pylint: disable=no-self-use
+    def _description(self, item):
+        """Returns the description in the '_LOCALIZABLE_' values of a pack, if it has one."""
+        result = None
+
+        for _locale in item.get('_LOCALIZABLE_', None) or list():
+            if 'Description' in _locale:
+                result = _locale['Description'].strip()
+                break
+
+        return result
+    # pylint: enable=no-self-use
+
     def _process_packs(self):
         """Processes the option packs."""
         # NOTE: Things get a little 'complicated' because Logic Pro X and MainStage
         # have 'subcontent' packs that make up _some_ of their bigger content packs.
-        # So these are treated as 'packs' in their own right.
+        # So these are treated as 'packs' in their own right, and the bigger pack is
+        # all of its 'subcontent' packs.
+        # Packs with no optional packages are left out, and packs with the same name
+        # are merged.
         result = list()
+        _packs = dict()
+
+        def _add(name, description, packages):
+            _pkgs = {_pkg for _pkg in packages if _pkg in self._optional_packages}
+
+            if not _pkgs:
+                return
 
-        if self._content:
-            _rp = None
+            if name in _packs:
+                _packs[name].Packages.update(_pkgs)
+            else:
+                _packs[name] = Pack(Name=name, Description=description, Packages=_pkgs)
+                result.append(_packs[name])
+
+        for _opt_pack in self._content or list():
+            _name = _opt_pack.get('Name', None)  # Option Pack 'name'.
+            _packages = set(_opt_pack.get('Packages', None) or list())  # Pkgs in the opt. pack.
+            _sub_content = _opt_pack.get('SubContent', None) or list()  # Some are broken up into sub opt. packs.
 
-            for _opt_pack in self._content:
-                _description = None
-                _locale = None
+            for _sp in _sub_content:
+                _sp_pkgs = _sp.get('Packages', None) or list()
+                _packages.update(_sp_pkgs)
 
-                _name = _opt_pack.get('Name', None)  # Option Pack 'name'.
-                _packages = _opt_pack.get('Packages', None)  # Pkgs in the opt. pack.
-                _sub_content = _opt_pack.get('SubContent', None)  # Some are broken up into sub opt. packs.
+                _add(_sp.get('Name', None), self._description(_sp), _sp_pkgs)
 
-                if _sub_content:
-                    _pack = dict()
+            _add(_name, self._description(_opt_pack), _packages)
 
-                    for _sp in _sub_content:
-                        _sp_desc = None
-                        _sp_name = _sp.get('Name', None)
-                        _sp_pkgs = _sp.get('Packages', None)
-                        _sp_locl = _sp.get('_LOCALIZABLE_', None)
-                        _packages = set()
+        return result
 
-                        if _sp_pkgs:
-                            _packages = {_pkg for _pkg in _sp_pkgs if _pkg in self._optional_packages}
 
-                        if _sp_locl:
-                            for _i in _sp_locl:
-                                for _k, _v in _i.items():
-                                    if _k == 'Description':
-                                        _sp_desc = _v.strip()
-                                        break
+def add_sizes(packs, sizes):
+    """Sets the download and installed size of each pack in 'packs', from 'sizes', the
+    '(DownloadSize, InstalledSize)' of each package keyed by its 'PackageName'. Packages
+    that aren't in 'sizes' (such as packages a 'Bad Wolf' patch ignores) aren't counted."""
+    for _pack in packs:
+        _sizes = [sizes[_pkg] for _pkg in _pack.Packages if _pkg in sizes]
 
-                        if _packages:
-                            _pack['Name'] = _sp_name
-                            _pack['Description'] = _sp_desc
-                            _pack['Packages'] = _packages
+        _pack.DownloadSize = sum(_size[0] for _size in _sizes)
+        _pack.InstalledSize = sum(_size[1] for _size in _sizes)
 
-                            _rp = Pack(**_pack)
 
-                    if _rp:
-                        result.append(_rp)
-                elif not _sub_content and _packages:
-                    _pack = dict()
-                    _locale = _opt_pack.get('_LOCALIZABLE_', None)
+def select(packs, names):
+    """Returns the packs in 'packs' named by 'names' (ignoring case), the names that no pack
+    matches, and the names of the packs each ambiguous name matches. A name that isn't the
+    full name of a pack only selects the pack whose name contains it if there is just one."""
+    result = list()
+    _unmatched = list()
+    _ambiguous = dict()
 
-                    if _packages:
-                        _pkgs = {_pkg for _pkg in _packages if _pkg in self._optional_packages}
+    for _name in names:
+        _matches = [_pack for _pack in packs if _name.lower() == (_pack.Name or '').lower()]
 
-                    if _locale:
-                        for _item in _locale:
-                            for _k, _v in _item.items():
-                                if _k == 'Description':
-                                    _description = _v.strip()
-                                    break
+        if not _matches:
+            _matches = [_pack for _pack in packs if _name.lower() in (_pack.Name or '').lower()]
 
-                    if _pkgs:
-                        _pack['Description'] = _description
-                        _pack['Name'] = _name
-                        _pack['Packages'] = _pkgs
+            if len(_matches) > 1:
+                _ambiguous[_name] = sorted(_pack.Name for _pack in _matches)
+                continue
 
-                        _rp = Pack(**_pack)
+        if not _matches:
+            _unmatched.append(_name)
 
-                    if _rp:
-                        result.append(_rp)
+        result.extend(_pack for _pack in _matches if _pack not in result)
 
-        return result
-    # pylint: enable=too-many-branches
-    # pylint: enable=too-many-nested-blocks
+    return (result, _unmatched, _ambiguous)
+
+
+def show_packs(catalogs):
+    """Prints the option packs of each catalog in 'catalogs' (see 'catalog.Catalog'), with
+    their download and installed sizes."""
+    for _catalog in catalogs:
+        print('{}:'.format(_catalog.release))
+
+        for _pack in _catalog.option_packs or list():
+            print('  {:<40} {:>10} download, {:>10} installed ({} packages)'.format(
+                _pack.Name, misc.bytes2hr(byte=_pack.DownloadSize), misc.bytes2hr(byte=_pack.InstalledSize),
+                len(_pack.Packages)))
 
 
 class Pack(object):
@@ -112,7 +142,9 @@ class Pack(object):
     def __init__(self, **kwargs):
         _valid_kwargs = {'Name': None,
                          'Description': None,
-                         'Packages': None}
+                         'Packages': None,
+                         'DownloadSize': 0,
+                         'InstalledSize': 0}
 
         for kwarg, value in _valid_kwargs.items():
             if kwarg in [_key for _key, _value in kwargs.items()]:
@@ -17,21 +17,62 @@ try:
     import curl_requests
     import misc
     import plist
+    import receipts
 except ImportError:
     from . import config
     from . import curl_requests
     from . import misc
     from . import plist
+    from . import receipts
 # pylint: enable=relative-import
 
 LOG = logging.getLogger(__name__)
 
 
+def feed_size(value):
+    """Returns a package size from a feed as an integer. Sizes Apple got wrong in a feed (such
+    as '8.151.010') count as 0."""
+    result = 0
+
+    try:
+        result = int(value) if value else 0
+    except (TypeError, ValueError):
+        LOG.debug('Invalid package size {}'.format(value))
+
+    return result
+
+
+class LazyAttribute(object):
+    """Descriptor for package attributes that are derived from other attributes. The value is
+    computed the first time it is accessed (unless one has been set), then kept in the slot
+    named '_<attribute>'."""
+    def __init__(self, func):
+        self._func = func
+        self._slot = '_{}'.format(func.__name__)
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        result = getattr(obj, self._slot)
+
+        if result is None:
+            result = self._func(obj)
+            setattr(obj, self._slot, result)
+
+        return result
+
+    def __set__(self, obj, value):
+        setattr(obj, self._slot, value)
+
+
 # pylint: disable=invalid-name
 # pylint: disable=too-many-instance-attributes
 # pylint: disable=no-member
 class LoopPackage(object):
-    """Attributes for Packages to be installed."""
+    """Attributes for Packages to be installed. Attributes derived from the feed values, such
+    as URLs, paths, and human readable sizes, are computed on first access."""
     VALID_KWARGS = {'ContainsAlchemyFiles': False,
                     'ContainsAppleLoops': False,
                     'ContainsGarageBandLegacyInstruments': False,
@@ -59,74 +100,46 @@ class LoopPackage(object):
                     'DownloadPath': None,
                     'BadWolfIgnore': None}
 
-    # pylint: disable=too-many-branches
-    # pylint: disable=too-many-statements
+    LAZY_ATTRIBUTES = ['CacheDownloadURL',
+                       'DownloadPath',
+                       'DownloadURL',
+                       'HumanDownloadSize',
+                       'HumanInstalledSize',
+                       'HumanRealDownloadSize',
+                       'LocalDownloadURL',
+                       'PackageVersion']
+
+    # No per instance '__dict__', there can be thousands of packages per run.
+    __slots__ = (sorted(set(VALID_KWARGS).difference(LAZY_ATTRIBUTES)) +
+                 ['_{}'.format(_attr) for _attr in LAZY_ATTRIBUTES] +
+                 ['_lp10_str'])
+
     def __init__(self, **kwargs):
         # Set attributes based on 'VALID_KWARGS'
         for kwarg, value in self.VALID_KWARGS.items():
-            if kwarg in [_key for _key, _value in kwargs.items()]:
-                setattr(self, kwarg, kwargs.get(kwarg, None))
-            else:
-                setattr(self, kwarg, value)
+            setattr(self, kwarg, kwargs.get(kwarg, value))
 
         # pylint: disable=access-member-before-definition
         # Fix any instances where the 'PackageID' contains spaces.
-        if hasattr(self, 'PackageID'):
+        if self.PackageID:
             self.PackageID = self.PackageID.replace('. ', '.')
 
-        # Fix the Apple 'PackageVersion' attribute to a 'LooseVersion' type.
-        if hasattr(self, 'PackageVersion'):
-            if isinstance(self.PackageVersion, (float, int)):
-                self.PackageVersion = u'{}'.format(self.PackageVersion)
-
-            self.PackageVersion = LooseVersion(self.PackageVersion)
-
         # Convert 'DownloadSize' and 'InstalledSize' to int
-        if hasattr(self, 'DownloadSize'):
-            # if self.DownloadSize:
-            self.DownloadSize = int(self.DownloadSize)
-            self.HumanDownloadSize = misc.bytes2hr(byte=self.DownloadSize)
+        if self.DownloadSize is not None:
+            self.DownloadSize = feed_size(self.DownloadSize)
 
-        if hasattr(self, 'InstalledSize'):
-            # if self.InstalledSize:
-            self.InstalledSize = int(self.InstalledSize)
-            self.HumanInstalledSize = misc.bytes2hr(byte=self.InstalledSize)
+        if self.InstalledSize is not None:
+            self.InstalledSize = feed_size(self.InstalledSize)
 
         # Now handle some of the appleloops specific attributes.
-        if hasattr(self, 'DownloadName'):
-            basename = path.basename(self.DownloadName)
-            self.DownloadURL = '{}/{}/{}'.format(config.AUDIOCONTENT_URL,
-                                                 config.LP10_MS3_CONTENT,
-                                                 basename)
-
-            lp10_str = 'lp10_ms3_content_2016'
-            if '../lp10_ms3_content_2013/' in self.DownloadName:
-                lp10_str = 'lp10_ms3_content_2013'
-                self.DownloadURL = self.DownloadURL.replace('lp10_ms3_content_2016', lp10_str)
+        # 'DownloadName' is used for hashing, so this can't be done lazily.
+        self._lp10_str = 'lp10_ms3_content_2016'
 
-                # Can probably get away with removing the '2013' path from the 'DownloadName' attr.
-                self.DownloadName = self.DownloadName.replace('../{}/'.format(lp10_str), '')
-
-            # Handle if there's a DMG to build/deploy from
-            if config.DMG_FILE or config.HTTP_DMG:
-                _dest_path = config.DMG_VOLUME_MOUNTPATH
-            else:
-                _dest_path = config.DESTINATION_PATH if config.DESTINATION_PATH else config.DEFAULT_DEST
+        if self.DownloadName and '../lp10_ms3_content_2013/' in self.DownloadName:
+            self._lp10_str = 'lp10_ms3_content_2013'
 
-            self.DownloadPath = path.join(_dest_path, lp10_str, self.DownloadName)
-
-        if hasattr(self, 'DownloadURL'):
-            if config.LOCAL_HTTP_SERVER:
-                # If this isn't a HTTP DMG being mounted, set the download url
-                if not config.HTTP_DMG:
-                    self.LocalDownloadURL = self.DownloadURL.replace(config.AUDIOCONTENT_URL,
-                                                                     config.LOCAL_HTTP_SERVER)
-
-            if config.CACHING_SERVER:
-                parsed_url = urlparse(self.DownloadURL)
-                self.CacheDownloadURL = '{}{}?source={}'.format(config.CACHING_SERVER,
-                                                                parsed_url.path,
-                                                                parsed_url.netloc)
+            # Can probably get away with removing the '2013' path from the 'DownloadName' attr.
+            self.DownloadName = self.DownloadName.replace('../{}/'.format(self._lp10_str), '')
         # pylint: enable=access-member-before-definition
 
         # CURL requests for actual download sizes but only if specified.
@@ -147,10 +160,85 @@ class LoopPackage(object):
                     except KeyError:
                         pass
 
-            if self.RealDownloadSize:
-                self.HumanRealDownloadSize = misc.bytes2hr(byte=self.RealDownloadSize)
-    # pylint: enable=too-many-statements
-    # pylint: enable=too-many-branches
+    @property
+    def PackageVersion(self):
+        """The Apple 'PackageVersion' attribute as a 'LooseVersion' type."""
+        # pylint: disable=access-member-before-definition
+        if not isinstance(self._PackageVersion, LooseVersion):
+            if isinstance(self._PackageVersion, (float, int)):
+                self._PackageVersion = u'{}'.format(self._PackageVersion)
+
+            self._PackageVersion = LooseVersion(self._PackageVersion)
+        # pylint: enable=access-member-before-definition
+
+        return self._PackageVersion
+
+    @PackageVersion.setter
+    def PackageVersion(self, value):
+        self._PackageVersion = value
+
+    @LazyAttribute
+    def HumanDownloadSize(self):
+        """The 'DownloadSize' attribute as a human readable size."""
+        return misc.bytes2hr(byte=self.DownloadSize) if self.DownloadSize is not None else None
+
+    @LazyAttribute
+    def HumanInstalledSize(self):
+        """The 'InstalledSize' attribute as a human readable size."""
+        return misc.bytes2hr(byte=self.InstalledSize) if self.InstalledSize is not None else None
+
+    @LazyAttribute
+    def HumanRealDownloadSize(self):
+        """The 'RealDownloadSize' attribute as a human readable size."""
+        return misc.bytes2hr(byte=self.RealDownloadSize) if self.RealDownloadSize else None
+
+    @LazyAttribute
+    def DownloadURL(self):
+        """The Apple URL of the package."""
+        result = None
+
+        if self.DownloadName:
+            result = '{}/{}/{}'.format(config.AUDIOCONTENT_URL, self._lp10_str, path.basename(self.DownloadName))
+
+        return result
+
+    @LazyAttribute
+    def LocalDownloadURL(self):
+        """The URL of the package on the local HTTP server, if there is one (and this isn't a
+        HTTP DMG being mounted)."""
+        result = None
+
+        if self.DownloadURL and config.LOCAL_HTTP_SERVER and not config.HTTP_DMG:
+            result = self.DownloadURL.replace(config.AUDIOCONTENT_URL, config.LOCAL_HTTP_SERVER)
+
+        return result
+
+    @LazyAttribute
+    def CacheDownloadURL(self):
+        """The URL of the package on the caching server, if there is one."""
+        result = None
+
+        if self.DownloadURL and config.CACHING_SERVER:
+            parsed_url = urlparse(self.DownloadURL)
+            result = '{}{}?source={}'.format(config.CACHING_SERVER, parsed_url.path, parsed_url.netloc)
+
+        return result
+
+    @LazyAttribute
+    def DownloadPath(self):
+        """The path the package is downloaded to."""
+        result = None
+
+        if self.DownloadName:
+            # Handle if there's a DMG to build/deploy from
+            if config.DMG_FILE or config.HTTP_DMG:
+                _dest_path = config.DMG_VOLUME_MOUNTPATH
+            else:
+                _dest_path = config.DESTINATION_PATH if config.DESTINATION_PATH else config.DEFAULT_DEST
+
+            result = path.join(_dest_path, self._lp10_str, self.DownloadName)
+
+        return result
 
     # pylint: disable=no-else-return
     def __hash__(self):
@@ -190,7 +278,8 @@ class LoopPackage(object):
             # missing_content_only = None
 
             if hasattr(self, 'PackageID'):
-                pkginfo = InstalledPackageInfo(obj=self.PackageID)
+                # Receipts are read from the index rather than a 'pkgutil' process per package.
+                pkginfo = InstalledPackageInfo(obj=self.PackageID, receipt=receipts.INDEX.get(self.PackageID))
 
                 if pkginfo:
                     # Tests if the package being processed has been installed by comparing
@@ -256,13 +345,17 @@ class InstalledPackageInfo(object):
                            'receipt_plist_version': None,
                            'volume': None}
 
-    def __init__(self, obj):
+    def __init__(self, obj, receipt=False):
         # Set up all attributes, they get updated later with relevant values.
         for key, value in self.VALID_PKG_INFO_KEYS.items():
             setattr(self, key, value)
 
-        # Now query with the macOS 'pkgutil' binary.
-        pkginfo = self._pkginfo(package_id=obj)
+        # Use the receipt if it has already been read (or is known to be missing, 'None'),
+        # otherwise query with the macOS 'pkgutil' binary.
+        if receipt is False:
+            pkginfo = self._pkginfo(package_id=obj)
+        else:
+            pkginfo = receipt
 
         if pkginfo:
             for key, value in pkginfo.items():
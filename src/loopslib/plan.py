@@ -0,0 +1,164 @@
+"""Contains the deployment plan, the resolved list of packages to download (and install) written
+to a JSON file with '--plan-out', so other Macs can use it with '--plan-in' instead of reading,
+patching and resolving the feeds themselves. Each package is recorded with its URL, sizes,
+path (relative to the destination), whether it is mandatory, its 'PackageID' and 'FileCheck'.
+
+A plan also records the SHA-256 of each feed it was made from, and the 'Bad Wolf' patches
+applied to it. A plan is only used if the feeds are unchanged. The digest of an indexed feed
+is read from the catalog index, and other feeds are revalidated through the feed cache, so
+checking a plan doesn't parse any feeds."""
+import json
+import logging
+import os
+import time
+
+# pylint: disable=relative-import
+try:
+    import catalog
+    import config
+    import feed_cache
+    import misc
+    import package
+    import version
+except ImportError:
+    from . import catalog
+    from . import config
+    from . import feed_cache
+    from . import misc
+    from . import package
+    from . import version
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+PLAN_FORMAT = 1
+
+# Packages in this folder are named relative to 'lp10_ms3_content_2016' in the feeds.
+LP10_2013 = 'lp10_ms3_content_2013'
+
+
+class PlanError(Exception):
+    """Raised when a deployment plan can't be read, or the feeds have changed since it was made."""
+
+
+def feed_digests(release):
+    """Returns the SHA-256 of the feed 'release' (for example 'logicpro1100.plist') and the
+    digest of the 'Bad Wolf' patches for it, or 'None' for the SHA-256 if the feed can't be read."""
+    result = None
+    _entry = catalog.INDEX.get(release)
+
+    if _entry and _entry.get('sha256', None):
+        result = _entry['sha256']
+    else:
+        _urls = [misc.plist_url_path(release),
+                 os.path.join(config.AUDIOCONTENT_FAILOVER_URL, config.LP10_MS3_CONTENT, release)]
+        _feed = feed_cache.CACHE.get(release, _urls)
+
+        if _feed:
+            result = catalog.feed_digest(_feed)
+
+    return (result, catalog.bad_wolf_digest(release))
+
+
+def export(path, source):
+    """Writes the packages in 'source' (a 'process_source.ProcessedSource') to the plan 'path'.
+    Returns the number of packages written."""
+    _mandatory = set(source.mandatory)
+    _pkgs = list()
+
+    for _pkg in source.all:
+        # The folder the package is downloaded to, which also tells where its URL points.
+        _folder = os.path.basename(os.path.dirname(_pkg.DownloadPath))
+
+        _pkgs.append({'PackageName': _pkg.PackageName,
+                      'DownloadName': _pkg.DownloadName,
+                      'DownloadURL': _pkg.DownloadURL,
+                      'DownloadPath': '{}/{}'.format(_folder, _pkg.DownloadName),
+                      'DownloadSize': _pkg.DownloadSize,
+                      'InstalledSize': _pkg.InstalledSize,
+                      'IsMandatory': _pkg in _mandatory,
+                      'PackageID': _pkg.PackageID,
+                      'PackageVersion': str(_pkg.PackageVersion),
+                      'FileCheck': _pkg.FileCheck})
+
+    _feeds = dict((_release, {'sha256': _catalog.digest, 'bad_wolf': catalog.bad_wolf_digest(_release)})
+                  for _release, _catalog in source.feeds.items())
+    _plan = {'format': PLAN_FORMAT,
+             'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+             'version': version.VERSION,
+             'feeds': _feeds,
+             'packages': _pkgs}
+
+    # Written under a temporary name and renamed, so clients never read half a plan.
+    _tmp = '{}.tmp'.format(path)
+
+    with open(_tmp, 'w') as _f:
+        json.dump(_plan, _f, indent=2, sort_keys=True)
+
+    os.rename(_tmp, path)
+    LOG.debug('Wrote plan {} with {} packages from {} feeds'.format(path, len(_pkgs), len(_feeds)))
+
+    return len(_pkgs)
+
+
+class DeploymentPlan(object):
+    """The packages in the plan 'path'. Raises 'PlanError' if the plan can't be read or any
+    feed it was made from has changed, unless 'validate' is 'False'."""
+    def __init__(self, path, validate=True):
+        self.path = path
+        self.feeds = dict()
+        self.packages = set()
+        self.mandatory_pkgs = set()
+        self.optional_pkgs = set()
+
+        self._load()
+
+        if validate:
+            self.validate()
+
+    def _load(self):
+        """Reads the plan and builds the package objects."""
+        try:
+            with open(self.path, 'r') as _f:
+                _plan = json.load(_f)
+        except (IOError, OSError, ValueError) as _e:
+            raise PlanError('unable to read {}: {}'.format(self.path, _e))
+
+        if not isinstance(_plan, dict) or _plan.get('format', None) != PLAN_FORMAT:
+            raise PlanError('unsupported plan format in {}'.format(self.path))
+
+        self.feeds = _plan.get('feeds', dict())
+
+        for _entry in _plan.get('packages', list()):
+            _kwargs = dict((_key, _value) for _key, _value in _entry.items()
+                           if _key in package.LoopPackage.VALID_KWARGS and _key not in ['DownloadURL', 'DownloadPath'])
+
+            # Packages in 'lp10_ms3_content_2013' are named the way the feeds name them, so
+            # their URL and path are resolved the same way.
+            if _entry.get('DownloadPath', '').startswith('{}/'.format(LP10_2013)):
+                _kwargs['DownloadName'] = '../{}/{}'.format(LP10_2013, _entry['DownloadName'])
+
+            self.packages.add(package.LoopPackage(**_kwargs))
+
+        self.mandatory_pkgs = set([_pkg for _pkg in self.packages if _pkg.IsMandatory])
+        self.optional_pkgs = self.packages.difference(self.mandatory_pkgs)
+
+        LOG.debug('Read plan {} with {} packages from {} feeds'.format(self.path, len(self.packages), len(self.feeds)))
+
+    def validate(self):
+        """Raises 'PlanError' if a feed the plan was made from has changed since."""
+        for _release, _expected in sorted(self.feeds.items()):
+            _digest, _bad_wolf = feed_digests(_release)
+
+            if not _digest:
+                raise PlanError('unable to check {} against {}'.format(self.path, _release))
+
+            if _digest != _expected.get('sha256', None) or _bad_wolf != _expected.get('bad_wolf', None):
+                raise PlanError('{} has changed since {} was made'.format(_release, self.path))
+
+        LOG.debug('Plan {} matches {} feeds'.format(self.path, len(self.feeds)))
+
+    @property
+    def message(self):
+        """Returns a summary of the plan."""
+        return 'Deployment plan {}: {} packages from {} feeds'.format(self.path, len(self.packages), len(self.feeds))
@@ -1,4 +1,5 @@
 """Contains the class for processing sources."""
+import heapq
 import logging
 import sys
 
@@ -9,11 +10,13 @@ try:
     import applications
     import config
     import misc
+    import option_packs
     import remote_plist
 except ImportError:
     from . import applications
     from . import config
     from . import misc
+    from . import option_packs
     from . import remote_plist
 # pylint: enable=relative-import
 
@@ -25,10 +28,12 @@ LOG = logging.getLogger(__name__)
 # pylint: disable=too-many-statements
 class ProcessedSource(object):
     """Class for processing a source and setting attributes about all packages.
-    Takes object instances as arguments."""
-    def __init__(self, apps=None, plists=None):
+    Takes object instances as arguments. A deployment plan (see 'plan.DeploymentPlan') is a
+    source of its own, so the feeds it was made from aren't read."""
+    def __init__(self, apps=None, plists=None, plans=None):
         self._apps = None
         self._plists = None
+        self._plans = plans if isinstance(plans, list) else None
 
         if apps:
             if isinstance(apps, list):
@@ -59,7 +64,6 @@ class ProcessedSource(object):
                 self._plists = None
 
         self._valid_pkg_types = ['mandatory', 'optional']
-        self._valid_sze_types = ['DownloadSize', 'InstalledSize']
 
         # NOTE: Some of the loops in these sets do actually
         # overlap each other, so there might be 700 when
@@ -69,38 +73,19 @@ class ProcessedSource(object):
         # such numbers depending on how packages are configured by
         # Apple.
         # So, leave these two sets as they are.
-        if config.MANDATORY:
-            self.mandatory = self._get_pkgs(pkg_type='mandatory')
+        # Each package is classified once, optional packages that are also mandatory
+        # are left out of the optional packages.
+        self.packs = self._select_packs() if config.PACKS else None
 
-            if self.mandatory:
-                self.mandatory = sorted(self.mandatory, key=lambda pkg: pkg.DownloadName)
-            else:
-                self.mandatory = set()
-        else:
-            self.mandatory = set()
+        _mandatory = self._get_pkgs(pkg_type='mandatory') if config.MANDATORY else set()
+        _optional = self._get_pkgs(pkg_type='optional', exclude=_mandatory) if config.OPTIONAL else set()
 
-        if config.OPTIONAL:
-            self.optional = self._get_pkgs(pkg_type='optional')
-
-            if self.optional:
-                self.optional = sorted(self.optional, key=lambda pkg: pkg.DownloadName)
-            else:
-                self.optional = set()
-        else:
-            self.optional = set()
-
-        # Clean up any optional packages that are also in 'self.mandatory'
-        self._clean_optionals_in_mandatory()
+        self.mandatory = sorted(_mandatory, key=lambda pkg: pkg.DownloadName) if _mandatory else set()
+        self.optional = sorted(_optional, key=lambda pkg: pkg.DownloadName) if _optional else set()
 
         # De duplicate _everything_ and create a set of all packages to wrangle..
-        if self.mandatory and self.optional:
-            self.all = set(self.mandatory).union(self.optional)
-        elif self.mandatory and not self.optional:
-            self.all = set(self.mandatory)
-        elif not self.mandatory and self.optional:
-            self.all = set(self.optional)
-        else:
-            self.all = None
+        # Both are already sorted and don't overlap, so merge them.
+        self.all = list(heapq.merge(self.mandatory, self.optional, key=lambda pkg: pkg.DownloadName))
 
         if not self.all:
             if not config.SILENT:
@@ -111,33 +96,39 @@ class ProcessedSource(object):
             _log = logging.getLogger()
             _log.info('------------------ Log closed on {} ------------------'.format(now))
             sys.exit(0)
-        else:
-            self.all = sorted(self.all, key=lambda pkg: pkg.DownloadName)
 
-            for _pkg in self.all:
-                _mand_or_opt = 'Mandatory' if _pkg.IsMandatory else 'Optional'
+        # Quantities and sizes of each, totalled in one pass.
+        _totals = {'mandatory': {'qty': 0, 'DownloadSize': 0, 'InstalledSize': 0},
+                   'optional': {'qty': 0, 'DownloadSize': 0, 'InstalledSize': 0}}
+
+        for _pkg in self.all:
+            _mand_or_opt = 'Mandatory' if _pkg.IsMandatory else 'Optional'
+            _total = _totals['mandatory' if _pkg in _mandatory else 'optional']
+
+            _total['qty'] += 1
+            _total['DownloadSize'] += _pkg.DownloadSize
+            _total['InstalledSize'] += _pkg.InstalledSize
 
-                LOG.debug('Package to process: {} ({})'.format(_pkg.PackageName, _mand_or_opt))
+            LOG.debug('Package to process: {} ({})'.format(_pkg.PackageName, _mand_or_opt))
 
-        # Quantities of each
         self.all_qty = len(self.all)
-        self.mandatory_qty = len(self.mandatory)
-        self.optional_qty = len(self.optional)
+        self.mandatory_qty = _totals['mandatory']['qty']
+        self.optional_qty = _totals['optional']['qty']
 
-        self.mandatory_download_size = self._mandatory_download_size()
-        self.optional_download_size = self._optional_download_size()
+        self.mandatory_download_size = _totals['mandatory']['DownloadSize']
+        self.optional_download_size = _totals['optional']['DownloadSize']
 
-        self.mandatory_download_size_hr = self._mandatory_download_size_hr()
-        self.optional_download_size_hr = self._optional_download_size_hr()
+        self.mandatory_download_size_hr = misc.bytes2hr(byte=self.mandatory_download_size)
+        self.optional_download_size_hr = misc.bytes2hr(byte=self.optional_download_size)
 
-        self.mandatory_install_size = self._mandatory_install_size()
-        self.optional_install_size = self._optional_install_size()
+        self.mandatory_install_size = _totals['mandatory']['InstalledSize']
+        self.optional_install_size = _totals['optional']['InstalledSize']
 
-        self.mandatory_install_size_hr = self._mandatory_install_size_hr()
-        self.optional_install_size_hr = self._optional_install_size_hr()
+        self.mandatory_install_size_hr = misc.bytes2hr(byte=self.mandatory_install_size)
+        self.optional_install_size_hr = misc.bytes2hr(byte=self.optional_install_size)
 
-        self.all_download_size = self._all_download_size()
-        self.all_install_size = self._all_install_size()
+        self.all_download_size = self.mandatory_download_size + self.optional_download_size
+        self.all_install_size = self.mandatory_install_size + self.optional_install_size
 
         if config.DMG_DEPLOY_FILE:
             self.total_size_req = self.all_install_size
@@ -146,8 +137,8 @@ class ProcessedSource(object):
 
         self.total_size_req_hr = misc.bytes2hr(byte=self.total_size_req)
 
-        self.all_download_size_hr = self._all_download_size_hr()
-        self.all_install_size_hr = self._all_install_size_hr()
+        self.all_download_size_hr = misc.bytes2hr(byte=self.all_download_size)
+        self.all_install_size_hr = misc.bytes2hr(byte=self.all_install_size)
 
         # Messages
         self.mandatory_download_msg = 'Mandatory packages download size: {} ({} packages)'.format(
@@ -209,142 +200,102 @@ class ProcessedSource(object):
             self.stats_message = '{}\n{}'.format(self.mandatory_dld_ins_msg,
                                                  self.stats_message)
 
-    def _get_pkgs(self, pkg_type):
-        """Returns a set of all mandatory or optional packages not installed.
-        When 'config.DEPLOY_PKGS' is 'False', packages are considered not installed
-        by default."""
-        result = None
-
-        _source = None
-        _result = set()
-
-        if pkg_type in self._valid_pkg_types:
-            if self._apps:
-                _source = self._apps
-
-            if self._plists:
-                _source = self._plists
-
-            if _source:
-                for _src in _source:
-                    _packages = getattr(_src, '{}_pkgs'.format(pkg_type))
-
-                    for _pkg in _packages:
-                        if not _pkg.IsInstalled:
-                            _result.add(_pkg)
-
-        if _result:
-            result = _result
-
-        return result
-
-    def _clean_optionals_in_mandatory(self):
-        """Removes any optional packages that exist in the 'self.mandatory' set."""
-        if self.mandatory and self.optional:
-            _opt = list(self.optional)
-
-            for _pkg in _opt:  # Iterate over a copy to avoid size change
-                if _pkg in self.mandatory:
-                    self.optional.remove(_pkg)
+    @property
+    def feeds(self):
+        """Returns the 'Catalog' of each feed the packages were read from, keyed by its release
+        (for example 'logicpro1100.plist'). A deployment plan has no feeds of its own."""
+        result = dict()
 
-    def _all_download_size(self):
-        """Returns the download size in bytes for all packages not installed."""
-        result = 0
-        _mandatory = 0
-        _optional = 0
+        for _src in (self._apps or list()) + (self._plists or list()):
+            _catalog = _src.catalog
 
-        _mandatory = sum([_pkg.DownloadSize for _pkg in self.mandatory])
-        _optional = sum([_pkg.DownloadSize for _pkg in self.optional])
-
-        result = _mandatory + _optional
-
-        return result
-
-    def _all_download_size_hr(self):
-        """Returns the download size in human readable format for all packages not installed."""
-        result = None
-
-        result = misc.bytes2hr(byte=self._all_download_size())
-
-        return result
-
-    def _all_install_size(self):
-        """Returns the install size in bytes for all packages not installed."""
-        result = None
-
-        result = sum([_pkg.InstalledSize for _pkg in self.all if not _pkg.IsInstalled])
+            if _catalog:
+                result[_catalog.release] = _catalog
 
         return result
 
-    def _all_install_size_hr(self):
-        """Returns the install size in human readable format for all packages not installed."""
-        result = None
+    def _select_packs(self):
+        """Returns the names of the packages in the option packs 'config.PACKS' asks for, keyed
+        by the feed they are in. Exits if a name doesn't match a pack in any feed, or matches
+        more than one pack in a feed."""
+        result = dict()
+        _matched = set()
+        _ambiguous = dict()
+        _names = set()
 
-        result = misc.bytes2hr(byte=self.all_install_size)
+        for _release, _catalog in self.feeds.items():
+            _packs, _unmatched, _feed_ambiguous = option_packs.select(_catalog.option_packs or list(), config.PACKS)
+            _matched.update(set(config.PACKS).difference(_unmatched).difference(_feed_ambiguous))
+            _names.update(_pack.Name for _pack in _packs)
 
-        return result
-
-    def _mandatory_download_size(self):
-        """Returns the downlod size in bytes for all mandatory packages not installed."""
-        result = 0
+            for _name, _pack_names in _feed_ambiguous.items():
+                _ambiguous.setdefault(_name, set()).update(_pack_names)
 
-        result = sum([_pkg.DownloadSize for _pkg in self.mandatory if not _pkg.IsInstalled])
+            result[_release] = set().union(*[_pack.Packages for _pack in _packs])
 
-        return result
+        _unmatched = [_name for _name in config.PACKS if _name not in _matched and _name not in _ambiguous]
 
-    def _optional_download_size(self):
-        """Returns the downlod size in bytes for all optional packages not installed."""
-        result = None
+        if _unmatched:
+            _msg = 'No option packs match {} (see --list-packs). Exiting.'.format(', '.join(_unmatched))
+            LOG.info(_msg)
+            print(_msg)
+            sys.exit(1)
 
-        result = sum([_pkg.DownloadSize for _pkg in self.optional if not _pkg.IsInstalled])
-
-        return result
-
-    def _mandatory_download_size_hr(self):
-        """Returns the downlod size in human readable format for all mandatory packages not installed."""
-        result = None
-
-        result = misc.bytes2hr(byte=self.mandatory_download_size)
-
-        return result
+        if _ambiguous:
+            _msg = 'More than one option pack matches {} (see --list-packs). Exiting.'.format(
+                ', '.join('{} ({})'.format(_name, ', '.join(sorted(_ambiguous[_name])))
+                          for _name in config.PACKS if _name in _ambiguous))
+            LOG.info(_msg)
+            print(_msg)
+            sys.exit(1)
 
-    def _optional_download_size_hr(self):
-        """Returns the downlod size in human readable format for all optionalpackages not installed."""
-        result = None
+        _msg = 'Option packs: {}'.format(', '.join(sorted(_names)))
+        LOG.info(_msg)
 
-        result = misc.bytes2hr(byte=self.optional_download_size)
+        if not config.SILENT:
+            print(_msg)
 
         return result
 
-    def _mandatory_install_size(self):
-        """Returns the downlod size in bytes for all mandatorypackages not installed."""
-        result = None
-
-        result = sum([_pkg.InstalledSize for _pkg in self.mandatory if not _pkg.IsInstalled])
+    def _get_pkgs(self, pkg_type, exclude=None):
+        """Returns a set of all mandatory or optional packages not installed, leaving out
+        any packages in 'exclude'. Each package is only checked once for its install state,
+        even if it is in more than one source.
+        When 'config.DEPLOY_PKGS' is 'False', packages are considered not installed
+        by default."""
+        result = set()
 
-        return result
+        _source = None
+        _exclude = exclude if exclude else set()
 
-    def _optional_install_size(self):
-        """Returns the downlod size in bytes for all optional packages not installed."""
-        result = None
+        if pkg_type in self._valid_pkg_types:
+            if self._apps:
+                _source = self._apps
 
-        result = sum([_pkg.InstalledSize for _pkg in self.optional if not _pkg.IsInstalled])
+            if self._plists:
+                _source = self._plists
 
-        return result
+            if self._plans:
+                _source = self._plans
 
-    def _mandatory_install_size_hr(self):
-        """Returns the downlod size in human readable format for all mandatorypackages not installed."""
-        result = None
+            if _source:
+                for _src in _source:
+                    _packages = getattr(_src, '{}_pkgs'.format(pkg_type))
+                    _selected = None
 
-        result = misc.bytes2hr(byte=self.mandatory_install_size)
+                    # Only the optional packages in the option packs asked for.
+                    if pkg_type == 'optional' and self.packs is not None:
+                        _selected = self.packs.get(_src.catalog.release, set()) if _src.catalog else set()
 
-        return result
+                    for _pkg in _packages:
+                        if _pkg in result or _pkg in _exclude:
+                            continue
 
-    def _optional_install_size_hr(self):
-        """Returns the downlod size in human readable format for all optionalpackages not installed."""
-        result = None
+                        if _selected is not None and _pkg.PackageName not in _selected:
+                            continue
 
-        result = misc.bytes2hr(byte=self.optional_install_size)
+                        if not _pkg.IsInstalled:
+                            result.add(_pkg)
 
         return result
 # pylint: enable=too-many-statements
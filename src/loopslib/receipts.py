@@ -0,0 +1,106 @@
+"""Contains the index of installed package receipts. The receipts folder is listed once per
+run, and each receipt is read at most once, instead of running 'pkgutil' for every
+package every time its install state is checked."""
+import calendar
+import logging
+import os
+import threading
+
+from datetime import datetime
+from distutils.version import LooseVersion
+
+# pylint: disable=relative-import
+try:
+    import config
+    import plist
+except ImportError:
+    from . import config
+    from . import plist
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+
+class ReceiptIndex(object):
+    """Index of the package receipts in 'config.RECEIPTS_PATH' (or 'receipts_path')."""
+    def __init__(self, receipts_path=None):
+        self._receipts_path = receipts_path
+        self._lock = threading.Lock()
+        self._pkgids = None
+        self._receipts = dict()
+
+    @property
+    def receipts_path(self):
+        """Returns the receipts folder in use."""
+        return self._receipts_path if self._receipts_path else config.RECEIPTS_PATH
+
+    def _load(self):
+        """Lists the receipts folder. Receipts are named '<pkgid>.plist'."""
+        result = set()
+        _path = self.receipts_path
+
+        try:
+            for _file in os.listdir(_path):
+                if _file.endswith('.plist'):
+                    result.add(_file[:-len('.plist')])
+        except OSError as _e:
+            LOG.debug('Unable to read receipts from {}: {}'.format(_path, _e))
+
+        LOG.debug('Found {} receipts in {}'.format(len(result), _path))
+
+        return result
+
+    # pylint: disable=no-self-use
+    def _read_receipt(self, receipt_path):
+        """Reads a receipt and returns its values keyed the same as the attributes of
+        'package.InstalledPackageInfo' (the 'pkgutil --pkg-info-plist' keys)."""
+        result = None
+
+        try:
+            _receipt = plist.readPlist(receipt_path)
+        except Exception as _e:
+            LOG.debug('Unable to read receipt {}: {}'.format(receipt_path, _e))
+            return result
+
+        if _receipt:
+            result = dict()
+            _install_date = _receipt.get('InstallDate', None)
+
+            # 'InstallDate' is stored in UTC, 'pkgutil' reports local time.
+            if isinstance(_install_date, datetime):
+                _timestamp = calendar.timegm(_install_date.timetuple())
+                _install_date = datetime.fromtimestamp(_timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+            result['install_location'] = _receipt.get('InstallPrefixPath', None)
+            result['install_time'] = _install_date
+            result['pkg_version'] = LooseVersion(_receipt.get('PackageVersion', '0'))
+            result['pkgid'] = _receipt.get('PackageIdentifier', None)
+            result['receipt_plist_version'] = _receipt.get('ReceiptPlistVersion', None)
+            result['volume'] = config.TARGET
+
+        return result
+    # pylint: enable=no-self-use
+
+    def get(self, pkgid):
+        """Returns the receipt values for 'pkgid' as a dictionary, or 'None' if the
+        package has no receipt."""
+        result = None
+
+        with self._lock:
+            if self._pkgids is None:
+                self._pkgids = self._load()
+
+            if pkgid not in self._pkgids:
+                return result
+
+            if pkgid not in self._receipts:
+                _receipt_path = os.path.join(self.receipts_path, '{}.plist'.format(pkgid))
+                self._receipts[pkgid] = self._read_receipt(_receipt_path)
+
+            result = self._receipts[pkgid]
+
+        return result
+
+
+# Module level index shared by all packages in a run.
+INDEX = ReceiptIndex()
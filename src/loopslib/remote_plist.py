@@ -1,25 +1,18 @@
 """Contains the class for Remote PLIST attributes."""
 import logging
 import os
-import tempfile
 
 # pylint: disable=relative-import
 try:
-    import bad_wolf
+    import catalog
     import config
-    import curl_requests
+    import feed_cache
     import misc
-    import option_packs
-    import package
-    import plist
 except ImportError:
-    from . import bad_wolf
+    from . import catalog
     from . import config
-    from . import curl_requests
+    from . import feed_cache
     from . import misc
-    from . import option_packs
-    from . import package
-    from . import plist
 # pylint: enable=relative-import
 
 LOG = logging.getLogger(__name__)
@@ -29,76 +22,50 @@ class RemotePlist(object):
     """Class for remote plist as a source."""
     def __init__(self, obj):
         self._plist = obj
-        self._tmp_dir = os.path.join(tempfile.gettempdir(), config.BUNDLE_ID)  # Use a temporary file as the destination. This is a tuple.
         self._plist_url_path = misc.plist_url_path(self._plist)
         self._plist_failover_url_path = os.path.join(config.AUDIOCONTENT_FAILOVER_URL, 'lp10_ms3_content_2016', self._plist)
 
-        self._all_packages = self._read_remote_plist()
-
         # Empty attr for option packs.
         self.option_packs = None
 
+        self._catalog = None
+        self._all_packages = self._read_remote_plist()
+
     def _read_remote_plist(self):
         """Gets the property list."""
         result = None
 
         _basename = os.path.basename(self._plist_url_path)
-        _tmp_file = os.path.join(self._tmp_dir, _basename)
-
-        _bad_wolf_fixes = bad_wolf.BAD_WOLF_PKGS.get(_basename, None)
-        _bwd = None
-
-        _req = curl_requests.CURL(url=self._plist_url_path)
-
-        # NOTE 2019-11-04: Seems that using the 'resume' capability in cURL does not
-        # work here now for some reason, so don't resume.
-        if _req.status in config.HTTP_OK_STATUS:
-            _req.get(url=self._plist_url_path, output=_tmp_file, resume=False)
-        else:
-            _req.get(url=self._plist_failover_url_path, output=_tmp_file, resume=False)
 
-        _root = plist.readPlist(_tmp_file)
+        # Feeds in the catalog index don't need to be downloaded.
+        self._catalog = catalog.CACHE.load_indexed(_basename)
 
-        if _root:
-            result = set()
+        if not self._catalog:
+            _feed = feed_cache.CACHE.get(_basename, [self._plist_url_path, self._plist_failover_url_path])
 
-            # Apply 'Bad Wolf' pathches
-            for _pkg in _root['Packages']:
-                _new_pkg = _root['Packages'][_pkg].copy()  # Work on copy
+            if _feed:
+                self._catalog = catalog.CACHE.load(_feed)
 
-                # Create a new key called 'PackageName' that
-                # contains the value '_pkg' for use with content packs.
-                _new_pkg['PackageName'] = _pkg
-
-                if _bad_wolf_fixes:
-                    _bwd = _bad_wolf_fixes.get(_pkg, None)  # A dictionary from '_bad_wolf_fixes'
-
-                # Merge new/existing keys from matching '_bwd'
-                if _bwd:
-                    _new_pkg.update(_bwd)
-
-                _pkg_obj = package.LoopPackage(**_new_pkg)
-
-                # pylint: disable=no-member
-                # Only add/process packages that are _not_ 'BadWolfIgnore = True'
-                if not _pkg_obj.BadWolfIgnore:
-                    result.add(_pkg_obj)
-                # pylint: enable=no-member
+        if self._catalog:
+            result = self._catalog.packages
 
             # Now process option packs
-            _opt_packs = option_packs.OptionPack(source=_root, release=_basename)
-            self.option_packs = _opt_packs.option_packs
-
-        misc.clean_up(file_path=_tmp_file)
+            self.option_packs = self._catalog.option_packs
 
         return result
 
+    @property
+    def catalog(self):
+        """Returns the parsed catalog of the feed, or 'None' if it couldn't be read."""
+        return self._catalog
+
     @property
     def mandatory_pkgs(self):
         """Returns the mandatory packages as objects in a set."""
         result = None
 
-        result = set([_pkg for _pkg in self._all_packages if _pkg.IsMandatory])
+        if self._catalog:
+            result = self._catalog.mandatory_pkgs
 
         return result
 
@@ -107,6 +74,7 @@ class RemotePlist(object):
         """Returns the optional packages as objects in a set."""
         result = None
 
-        result = set([_pkg for _pkg in self._all_packages if not _pkg.IsMandatory])
+        if self._catalog:
+            result = self._catalog.optional_pkgs
 
         return result
@@ -0,0 +1,361 @@
+"""Contains the package server, which serves a destination tree (or a package store) over HTTP
+so it can be used with '--pkg-server' without a separate web server. Packages are served at
+the paths 'package.LoopPackage.LocalDownloadURL' asks for ('/lp10_ms3_content_2016/<name>'
+and '/lp10_ms3_content_2013/<name>'). A package that isn't at that path, as in a store (where
+packages are kept as '<size>/<name>'), is found by its name. Where there is more than one copy
+of a package by that name, the newest is served.
+
+Connections are kept alive and each is handled in its own thread. Files are sent with
+'socket.sendfile', which uses 'os.sendfile' where it is available, so package bytes are copied
+by the kernel straight from the page cache to the socket. Single byte ranges ('Range' and
+'If-Range') and 'HEAD' requests are supported, so downloads can be resumed and segmented.
+Request and byte counters are served as JSON at '/_stats'."""
+import email.utils
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+# pylint: disable=relative-import
+try:
+    import config
+    import misc
+except ImportError:
+    from . import config
+    from . import misc
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+# Path the counters are served at.
+STATS_PATH = '/_stats'
+
+# Minimum seconds between rebuilding the index of packages by name, so requests for packages
+# that don't exist don't each walk the tree.
+INDEX_TTL = 10
+
+# Errors raised when a client goes away mid request, which are routine (a cancelled or hedged
+# download) and not worth a traceback.
+DISCONNECT_ERRORS = (BrokenPipeError, ConnectionAbortedError, ConnectionResetError, socket.timeout)
+
+
+class ServerStats(object):
+    """Counts the requests and bytes served."""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        self.started = time.time()
+        self.connections = 0
+        self.active = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.statuses = dict()
+
+    def connected(self, amt=1):
+        """Records a connection opening ('amt' is 1) or closing ('amt' is -1)."""
+        with self._lock:
+            if amt > 0:
+                self.connections += amt
+
+            self.active += amt
+
+    def add(self, status, sent=0):
+        """Records a request answered with 'status', and the body bytes sent."""
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += sent
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+
+    def as_dict(self):
+        """Returns the counters, with the average rate bytes were sent at."""
+        with self._lock:
+            _elapsed = max(time.time() - self.started, 0.001)
+
+            return {'uptime': round(_elapsed, 1),
+                    'connections': self.connections,
+                    'active_connections': self.active,
+                    'requests': self.requests,
+                    'bytes_sent': self.bytes_sent,
+                    'bytes_per_second': int(self.bytes_sent / _elapsed),
+                    'statuses': dict(self.statuses)}
+
+    @property
+    def message(self):
+        """Returns a summary of the requests served."""
+        with self._lock:
+            return 'Package server: {} requests on {} connections, {} sent'.format(self.requests,
+                                                                                   self.connections,
+                                                                                   misc.bytes2hr(byte=self.bytes_sent))
+
+
+class PackageRequestHandler(BaseHTTPRequestHandler):
+    """Answers 'GET' and 'HEAD' requests for the files in 'server.root'."""
+    protocol_version = 'HTTP/1.1'
+    server_version = 'appleloops'
+
+    def setup(self):
+        super(PackageRequestHandler, self).setup()
+        self.server.stats.connected()
+
+    def finish(self):
+        try:
+            super(PackageRequestHandler, self).finish()
+        finally:
+            self.server.stats.connected(-1)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        LOG.debug('{} - {}'.format(self.address_string(), format % args))
+
+    def _reply(self, status, headers=None, body=b''):
+        """Sends a response with a small in-memory 'body'."""
+        self.send_response(status)
+
+        for _header, _value in (headers or dict()).items():
+            self.send_header(_header, _value)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
+
+        self.server.stats.add(status, sent=len(body) if self.command != 'HEAD' else 0)
+
+    def _range(self, size, etag, last_modified):
+        """Returns the '(first, last)' byte range asked for, 'None' for the whole file, or
+        'False' if the range can't be satisfied. Ranges that can't be parsed, several ranges,
+        and ranges of a file that has changed since 'If-Range' are answered with the whole
+        file, like most servers."""
+        result = None
+        _range = self.headers.get('Range', None)
+        _if_range = self.headers.get('If-Range', None)
+
+        if not _range or not _range.startswith('bytes=') or ',' in _range:
+            return result
+
+        if _if_range and _if_range not in [etag, last_modified]:
+            return result
+
+        _first, _, _last = _range[len('bytes='):].strip().partition('-')
+
+        try:
+            if _first:
+                _first = int(_first)
+                _last = min(int(_last), size - 1) if _last else size - 1
+            else:
+                # A suffix range, the last '_last' bytes.
+                _first = max(size - int(_last), 0)
+                _last = size - 1
+        except ValueError:
+            return result
+
+        if _first >= size or _first > _last:
+            result = False
+        else:
+            result = (_first, _last)
+
+        return result
+
+    def _send_stats(self):
+        """Sends the counters as JSON."""
+        _body = json.dumps(self.server.stats.as_dict(), sort_keys=True).encode('utf-8')
+        self._reply(200, headers={'Content-Type': 'application/json', 'Cache-Control': 'no-store'}, body=_body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Sends a file, or a byte range of it."""
+        _path = unquote(urlparse(self.path).path)
+
+        if _path == STATS_PATH:
+            self._send_stats()
+            return
+
+        _file = self.server.find(_path)
+
+        if not _file:
+            self._reply(404)
+            return
+
+        try:
+            _f = open(_file, 'rb')
+        except (IOError, OSError) as _e:
+            LOG.debug('Unable to open {}: {}'.format(_file, _e))
+            self._reply(404)
+            return
+
+        with _f:
+            _stat = os.fstat(_f.fileno())
+            _size = _stat.st_size
+            _etag = '"{:x}-{:x}"'.format(_size, int(_stat.st_mtime))
+            _last_modified = email.utils.formatdate(_stat.st_mtime, usegmt=True)
+            _headers = {'Accept-Ranges': 'bytes',
+                        'Content-Type': 'application/octet-stream',
+                        'ETag': _etag,
+                        'Last-Modified': _last_modified}
+
+            if self.headers.get('If-None-Match', None) == _etag:
+                self._reply(304, headers={'ETag': _etag})
+                return
+
+            _range = self._range(_size, _etag, _last_modified)
+
+            if _range is False:
+                self._reply(416, headers={'Content-Range': 'bytes */{}'.format(_size)})
+                return
+
+            _first, _last = _range if _range else (0, _size - 1)
+            _length = _last - _first + 1
+
+            self.send_response(206 if _range else 200)
+
+            for _header, _value in _headers.items():
+                self.send_header(_header, _value)
+
+            if _range:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(_first, _last, _size))
+
+            self.send_header('Content-Length', str(_length))
+            self.end_headers()
+
+            _sent = 0
+
+            if self.command != 'HEAD' and _length > 0:
+                try:
+                    _sent = self.connection.sendfile(_f, offset=_first, count=_length)
+                except (socket.error, OSError) as _e:
+                    LOG.debug('{} {}: {}'.format(self.command, _path, _e))
+                    self.close_connection = True
+
+                # The client can't tell where a short body ends on a kept alive connection.
+                if _sent < _length:
+                    self.close_connection = True
+
+            self.server.stats.add(206 if _range else 200, sent=_sent)
+
+    do_HEAD = do_GET  # pylint: disable=invalid-name
+
+
+class PackageServer(ThreadingHTTPServer):
+    """Serves the files in 'root' on 'port' (on every address, unless 'host' is given)."""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, root, port, host=''):
+        self.root = os.path.realpath(root)
+        self.stats = ServerStats()
+        self._lock = threading.Lock()
+        self._index = None
+        self._indexed = 0
+
+        ThreadingHTTPServer.__init__(self, (host, port), PackageRequestHandler)
+
+    def handle_error(self, request, client_address):
+        """Logs a client that disconnected mid request at debug level, other errors are
+        reported with their traceback as usual."""
+        _e = sys.exc_info()[1]
+
+        if isinstance(_e, DISCONNECT_ERRORS):
+            LOG.debug('{} disconnected: {}'.format(client_address[0], _e))
+        else:
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+    def _build_index(self):
+        """Returns the paths of the files under 'root', keyed by their name. A store can hold
+        more than one copy of a package by the same name (of different sizes). Must be called
+        with the lock held."""
+        result = dict()
+
+        for _root, _dirs, _files in os.walk(self.root):
+            _dirs[:] = [_dir for _dir in _dirs if not _dir.startswith('.')]
+
+            for _file in _files:
+                if not _file.startswith('.'):
+                    result.setdefault(_file, list()).append(os.path.join(_root, _file))
+
+        self._indexed = time.time()
+        LOG.debug('Indexed {} files in {}'.format(len(result), self.root))
+
+        return result
+
+    def find(self, path):
+        """Returns the file 'path' (the path of a request) is for, or 'None' if there isn't
+        one. Hidden files (such as the download journal) are never served."""
+        result = None
+        _parts = [_part for _part in path.split('/') if _part]
+
+        if not _parts or any(_part.startswith('.') for _part in _parts):
+            return result
+
+        _file = os.path.realpath(os.path.join(self.root, *_parts))
+
+        # Paths that resolve outside the root aren't served.
+        if os.path.commonpath([self.root, _file]) != self.root:
+            return result
+
+        if os.path.isfile(_file):
+            result = _file
+        elif _parts[-1].endswith('.pkg'):
+            with self._lock:
+                if self._index is None or (_parts[-1] not in self._index and
+                                           time.time() - self._indexed > INDEX_TTL):
+                    self._index = self._build_index()
+
+                _paths = list(self._index.get(_parts[-1], list()))
+
+            result = self._pick(_paths, folder=_parts[-2] if len(_parts) > 1 else None)
+
+        return result
+
+    def _pick(self, paths, folder=None):
+        """Returns the copy of a file in 'paths' to serve, or 'None' if none of them exist any
+        more. A copy in 'folder' (the content folder requested) is preferred, then the newest,
+        then the largest, so a stale copy of a republished package isn't served."""
+        result = None
+        _best = None
+
+        for _path in paths:
+            try:
+                _stat = os.stat(_path)
+            except OSError:
+                continue
+
+            _in_folder = bool(folder) and os.path.basename(os.path.dirname(_path)) == folder
+            _key = (_in_folder, _stat.st_mtime, _stat.st_size)
+
+            if _best is None or _key > _best:
+                result = _path
+                _best = _key
+
+        if len(paths) > 1:
+            LOG.debug('Serving {} of {} copies of {}'.format(result, len(paths), os.path.basename(paths[0])))
+
+        return result
+
+
+def serve(root, port, host=''):
+    """Serves 'root' until interrupted, then returns the counters."""
+    _server = PackageServer(root=root, port=port, host=host)
+    _msg = 'Serving {} on port {} (counters at {})'.format(_server.root, _server.server_address[1], STATS_PATH)
+    LOG.info(_msg)
+
+    if not config.SILENT:
+        print(_msg)
+
+    try:
+        _server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _server.server_close()
+
+    LOG.info(_server.stats.message)
+
+    if not (config.SILENT or config.QUIET):
+        print(_server.stats.message)
+
+    return _server.stats
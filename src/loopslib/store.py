@@ -0,0 +1,295 @@
+"""Contains the package store, a folder of downloaded packages shared by every run (download,
+deployment, or DMG build). Packages are kept by name and size, and copied into a destination
+by hard link when it is on the same volume, otherwise by a copy, instead of downloading them
+again. When the store grows past its size limit, the least recently used packages are
+removed. When each package was last used is kept in '.appleloops_store' in the store, not in
+the packages themselves, as they share their modification time with every destination they
+are linked into (and the download journal of each destination checks it)."""
+import errno
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+# pylint: disable=relative-import
+try:
+    import config
+    import misc
+except ImportError:
+    from . import config
+    from . import misc
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+USAGE_FILE = '.appleloops_store'
+
+
+def _link_or_copy(source, dest):
+    """Hard links 'source' to 'dest', copying it if they are on different volumes. 'dest' is
+    written under a temporary name and renamed, so it never exists partially written."""
+    _tmp = os.path.join(os.path.dirname(dest), '.{}.{}.{}.tmp'.format(os.path.basename(dest), os.getpid(),
+                                                                      threading.current_thread().ident))
+
+    try:
+        os.link(source, _tmp)
+    except OSError as _e:
+        if _e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+            raise
+
+        shutil.copyfile(source, _tmp)
+
+    try:
+        os.rename(_tmp, dest)
+    except OSError:
+        misc.clean_up(file_path=_tmp)
+        raise
+
+
+class PackageStore(object):
+    """Store of packages in 'config.STORE_PATH' (or 'store_path'), limited to
+    'config.STORE_SIZE' bytes (or 'max_size'). Packages are stored as '<size>/<name>'."""
+    def __init__(self, store_path=None, max_size=None):
+        self._store_path = store_path
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._packages = None  # Path of each stored package, with its size and last use.
+        self._dirty = False  # Last uses not yet saved.
+
+        # Statistics, used in debug logging.
+        self.restored = 0
+        self.restored_size = 0
+        self.added = 0
+        self.evicted = 0
+
+    @property
+    def store_path(self):
+        """Returns the store folder in use, or 'None' if there is no store."""
+        return self._store_path if self._store_path else config.STORE_PATH
+
+    @property
+    def max_size(self):
+        """Returns the size limit of the store in bytes, or 'None' for no limit."""
+        return self._max_size if self._max_size else config.STORE_SIZE
+
+    @property
+    def enabled(self):
+        """Returns 'True' if there is a store, and packages are being downloaded."""
+        return bool(self.store_path) and not config.DRY_RUN
+
+    def _path(self, pkg):
+        """Returns the path of a package in the store."""
+        return os.path.join(self.store_path, str(int(pkg.DownloadSize)), os.path.basename(pkg.DownloadName))
+
+    def _usage_path(self):
+        """Returns the path of the file recording when each package was last used."""
+        return os.path.join(self.store_path, USAGE_FILE)
+
+    def _load_usage(self):
+        """Returns when each package was last used, keyed by its path relative to the store."""
+        result = dict()
+        _usage_path = self._usage_path()
+
+        if os.path.exists(_usage_path):
+            try:
+                with open(_usage_path, 'r') as _f:
+                    result = json.load(_f)['packages']
+            except (IOError, OSError, ValueError, KeyError) as _e:
+                LOG.debug('Unable to read {}: {}'.format(_usage_path, _e))
+
+        return result
+
+    def save(self):
+        """Records when each package was last used. Other runs may have used the store since
+        it was read, so the latest use of each package is kept."""
+        with self._lock:
+            if not self.enabled or not self._dirty or self._packages is None:
+                return
+
+            _usage = self._load_usage()
+            _tmp = '{}.{}.tmp'.format(self._usage_path(), os.getpid())
+            _packages = dict()
+
+            for _path, (_, _last_used) in self._packages.items():
+                _key = os.path.relpath(_path, self.store_path)
+                _packages[_key] = max(_last_used, _usage.get(_key, 0))
+
+            try:
+                with open(_tmp, 'w') as _f:
+                    json.dump({'packages': _packages}, _f, sort_keys=True)
+
+                os.rename(_tmp, self._usage_path())
+                self._dirty = False
+            except (IOError, OSError) as _e:
+                misc.clean_up(file_path=_tmp)
+                LOG.debug('Unable to write {}: {}'.format(self._usage_path(), _e))
+
+    def _load(self):
+        """Lists the packages in the store. Packages with no recorded use were last used when
+        they were added."""
+        result = dict()
+        _usage = self._load_usage()
+
+        for _root, _, _files in os.walk(self.store_path):
+            for _file in _files:
+                if _file.startswith('.'):
+                    continue  # Unfinished writes
+
+                _path = os.path.join(_root, _file)
+
+                try:
+                    _stat = os.stat(_path)
+                    result[_path] = (_stat.st_size, _usage.get(os.path.relpath(_path, self.store_path),
+                                                               _stat.st_mtime))
+                except OSError as _e:
+                    LOG.debug('Unable to read {}: {}'.format(_path, _e))
+
+        _size = misc.bytes2hr(byte=sum(_size for _size, _ in result.values()))
+        LOG.debug('Package store {} contains {} packages ({})'.format(self.store_path, len(result), _size))
+
+        return result
+
+    def _evict(self, keep):
+        """Removes the least recently used packages (never 'keep') until the store is within
+        its size limit. Must be called with the lock held."""
+        if not self.max_size:
+            return
+
+        _total = sum(_size for _size, _ in self._packages.values())
+
+        for _path in sorted(self._packages, key=lambda _path: self._packages[_path][1]):
+            if _total <= self.max_size:
+                break
+
+            if _path == keep:
+                continue
+
+            _size, _ = self._packages.pop(_path)
+            self._dirty = True
+            misc.clean_up(file_path=_path)
+            _total -= _size
+            self.evicted += 1
+            LOG.debug('Evicted {} from the package store'.format(_path))
+
+    def restore(self, pkg, counter_msg=None):
+        """Links (or copies) a package from the store to 'pkg.DownloadPath', unless it is
+        already there. A forced download ('config.FORCE_DOWNLOAD') never uses the store.
+        Returns 'True' if the package is in place afterwards."""
+        result = False
+
+        if not self.enabled or not pkg.DownloadName or not pkg.DownloadSize or config.FORCE_DOWNLOAD:
+            return result
+
+        _path = self._path(pkg)
+        _dest = pkg.DownloadPath
+
+        with self._lock:
+            if self._packages is None:
+                self._packages = self._load()
+
+            if _path not in self._packages:
+                return result
+
+            # Already in place from an earlier link.
+            if os.path.exists(_dest) and os.path.samefile(_path, _dest):
+                result = True
+            else:
+                try:
+                    if not os.path.exists(os.path.dirname(_dest)):
+                        os.makedirs(os.path.dirname(_dest), exist_ok=True)
+
+                    _link_or_copy(_path, _dest)
+                    result = True
+                except (IOError, OSError) as _e:
+                    LOG.debug('Unable to restore {} from the package store: {}'.format(_dest, _e))
+
+            if result:
+                self._packages[_path] = (self._packages[_path][0], time.time())
+                self._dirty = True
+                self.restored += 1
+                self.restored_size += self._packages[_path][0]
+
+        if result:
+            if counter_msg:
+                _msg = 'Using stored file {} - {}'.format(counter_msg, os.path.basename(pkg.DownloadName))
+            else:
+                _msg = 'Using stored {}'.format(os.path.basename(pkg.DownloadName))
+
+            LOG.info(_msg)
+
+            if not (config.SILENT or config.QUIET):
+                print(_msg)
+
+        return result
+
+    def add(self, pkg):
+        """Adds the downloaded package at 'pkg.DownloadPath' to the store, if it is the size
+        the feed says it should be. Returns 'True' if the package is in the store."""
+        result = False
+
+        if not self.enabled or not pkg.DownloadName or not pkg.DownloadSize:
+            return result
+
+        _path = self._path(pkg)
+        _source = pkg.DownloadPath
+
+        if not os.path.exists(_source) or os.path.getsize(_source) != int(pkg.DownloadSize):
+            LOG.debug('Not storing {}, it is incomplete'.format(_source))
+            return result
+
+        with self._lock:
+            if self._packages is None:
+                self._packages = self._load()
+
+            # A forced download replaces the stored copy.
+            if _path in self._packages:
+                if not config.FORCE_DOWNLOAD or os.path.samefile(_source, _path):
+                    return True
+
+            try:
+                if not os.path.exists(os.path.dirname(_path)):
+                    os.makedirs(os.path.dirname(_path))
+
+                _link_or_copy(_source, _path)
+            except (IOError, OSError) as _e:
+                LOG.debug('Unable to add {} to the package store: {}'.format(_source, _e))
+                return result
+
+            self._packages[_path] = (os.path.getsize(_path), time.time())
+            self._dirty = True
+            self.added += 1
+            self._evict(keep=_path)
+            result = True
+
+        LOG.debug('Added {} to the package store'.format(_path))
+
+        return result
+
+    def remove(self, pkg):
+        """Removes a package from the store, for a stored copy that turned out to be corrupt."""
+        if not self.enabled or not pkg.DownloadName or not pkg.DownloadSize:
+            return
+
+        _path = self._path(pkg)
+
+        with self._lock:
+            if self._packages is not None:
+                self._packages.pop(_path, None)
+                self._dirty = True
+
+            misc.clean_up(file_path=_path)
+
+        LOG.debug('Removed {} from the package store'.format(_path))
+
+    @property
+    def message(self):
+        """Returns a summary of the use of the store."""
+        return 'Package store: {} restored ({}), {} added, {} evicted'.format(self.restored,
+                                                                         misc.bytes2hr(byte=self.restored_size),
+                                                                         self.added, self.evicted)
+
+
+# Module level store shared by all downloads in a run.
+STORE = PackageStore()
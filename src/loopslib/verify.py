@@ -0,0 +1,173 @@
+"""Contains the check of an existing destination (or package server mirror) against the feeds.
+Each package must be in the destination at the size the feed gives, and have the digest in the
+package manifest (see 'manifest.PackageManifest') if it has one. Packages the manifest doesn't
+have yet are added to it, so the next check can tell if they have changed since.
+
+Packages are hashed by a pool of processes, one per core, each reading the file through a
+memory map. The packages that fail are printed as JSON lines, and are recorded in the
+download journal as corrupt so the next download to the destination fetches them again."""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# pylint: disable=relative-import
+try:
+    import config
+    import journal
+    import manifest
+    import misc
+except ImportError:
+    from . import config
+    from . import journal
+    from . import manifest
+    from . import misc
+# pylint: enable=relative-import
+
+LOG = logging.getLogger(__name__)
+
+MISSING = 'missing'
+SIZE = 'size'
+DIGEST = 'digest'
+UNREADABLE = 'unreadable'
+
+
+def hash_file(path):
+    """Returns the SHA-256 of the file at 'path' as a hex string, reading it through a memory
+    map so the file is hashed straight from the page cache without copying it."""
+    _hash = hashlib.sha256()
+
+    with open(path, 'rb') as _f:
+        if os.fstat(_f.fileno()).st_size:
+            with mmap.mmap(_f.fileno(), 0, access=mmap.ACCESS_READ) as _map:
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    _map.madvise(mmap.MADV_SEQUENTIAL)
+
+                _hash.update(_map)
+
+    return _hash.hexdigest()
+
+
+class TreeVerifier(object):
+    """Checks the packages 'pkgs' in 'dest_path' (by default the destination packages are
+    downloaded to), hashing them with 'jobs' processes (by default one per core)."""
+    def __init__(self, pkgs, dest_path=None, jobs=None):
+        self._pkgs = pkgs
+        self._dest_path = dest_path if dest_path else manifest.MANIFEST.dest_path
+        self._jobs = jobs if jobs else os.cpu_count()
+        self._files = None  # Size of each file in the destination.
+
+        self.bad = list()
+        self.untracked = 0
+        self.hashed = 0
+        self.hashed_size = 0
+        self.recorded = 0
+
+    def _fail(self, pkg, reason, size=None):
+        """Records a package that failed, printing it as a JSON line."""
+        _expected = pkg.RealDownloadSize if config.REAL_DOWNLOAD_SIZE else pkg.DownloadSize
+        _entry = {'path': pkg.DownloadPath,
+                  'url': pkg.DownloadURL,
+                  'reason': reason,
+                  'size': size,
+                  'expected_size': int(_expected) if _expected else None}
+
+        self.bad.append(_entry)
+        LOG.info('Verify failed: {}'.format(_entry))
+        print(json.dumps(_entry, sort_keys=True))
+        sys.stdout.flush()
+
+        # A missing package is fetched by the next run anyway.
+        journal.JOURNAL.record(pkg, corrupt=reason != MISSING)
+
+    def _walk(self):
+        """Returns the size of each package in the destination, keyed by its path."""
+        result = dict()
+
+        for _root, _dirs, _files in os.walk(self._dest_path):
+            _dirs[:] = [_dir for _dir in _dirs if not _dir.startswith('.')]
+
+            for _file in _files:
+                if _file.endswith('.pkg') and not _file.startswith('.'):
+                    _path = os.path.join(_root, _file)
+
+                    try:
+                        result[_path] = os.stat(_path).st_size
+                    except OSError as _e:
+                        LOG.debug('Unable to read {}: {}'.format(_path, _e))
+
+        return result
+
+    def _check_sizes(self):
+        """Returns the packages that are in the destination at the size the feed gives, in
+        the order they are hashed in (largest first, so the pool finishes together)."""
+        result = list()
+
+        for _pkg in self._pkgs:
+            _expected = _pkg.RealDownloadSize if config.REAL_DOWNLOAD_SIZE else _pkg.DownloadSize
+            _size = self._files.get(_pkg.DownloadPath, None)
+
+            if _size is None:
+                self._fail(_pkg, MISSING)
+                continue
+
+            if _expected and _size != int(_expected):
+                self._fail(_pkg, SIZE, size=_size)
+            else:
+                result.append((_size, _pkg))
+
+        result = [_pkg for _, _pkg in sorted(result, key=lambda _item: _item[0], reverse=True)]
+
+        return result
+
+    def run(self):
+        """Checks all the packages. Returns the packages that failed."""
+        self._files = self._walk()
+        self.untracked = len(set(self._files).difference(_pkg.DownloadPath for _pkg in self._pkgs))
+
+        _pkgs = self._check_sizes()
+        _sizes = self._files
+        _total = sum(_sizes[_pkg.DownloadPath] for _pkg in _pkgs)
+
+        LOG.debug('Hashing {} packages ({}) with {} processes'.format(len(_pkgs), misc.bytes2hr(byte=_total),
+                                                                     self._jobs))
+
+        with ProcessPoolExecutor(max_workers=self._jobs) as _pool:
+            _futures = dict((_pool.submit(hash_file, _pkg.DownloadPath), _pkg) for _pkg in _pkgs)
+
+            for _future in as_completed(_futures):
+                _pkg = _futures[_future]
+
+                try:
+                    _digest = _future.result()
+                except (IOError, OSError, ValueError) as _e:
+                    LOG.debug('Unable to hash {}: {}'.format(_pkg.DownloadPath, _e))
+                    self._fail(_pkg, UNREADABLE, size=_sizes[_pkg.DownloadPath])
+                    continue
+
+                self.hashed += 1
+                self.hashed_size += _sizes[_pkg.DownloadPath]
+                _expected = manifest.MANIFEST.expected(_pkg)
+
+                if _expected and _digest != _expected:
+                    self._fail(_pkg, DIGEST, size=_sizes[_pkg.DownloadPath])
+                    continue
+
+                if not _expected:
+                    manifest.MANIFEST.add(_pkg, _digest)
+                    self.recorded += 1
+
+                journal.JOURNAL.record(_pkg)
+
+        return self.bad
+
+    @property
+    def message(self):
+        """Returns a summary of the check."""
+        return ('Verified {} packages: {} failed, {} hashed ({}), {} added to the manifest, '
+                '{} not in the feeds'.format(len(self._pkgs), len(self.bad), self.hashed,
+                                             misc.bytes2hr(byte=self.hashed_size), self.recorded, self.untracked))
@@ -3,7 +3,6 @@ version checking."""
 import logging
 import subprocess
 
-from distutils.version import LooseVersion
 from sys import version_info
 
 LOG = logging.getLogger(__name__)
@@ -20,6 +19,8 @@ PYTHON_VER = '{}.{}.{}'.format(version_info.major, version_info.minor, version_i
 
 def in_version_range(min_version, compare_version, max_version):
     """Checks if a provided version string is in the ranges provided."""
+    from distutils.version import LooseVersion  # pylint: disable=import-outside-toplevel
+
     result = None
 
     if all([isinstance(ver, (str, unicode)) for ver in [min_version, compare_version, max_version]]):
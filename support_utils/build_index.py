@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""Simple utility to compile the catalog index ('src/loopslib/catalog_index.pickle') from the
+mirrored property lists in 'lp10_ms3_content_2016'. The index is built, not kept in the
+repository, so 'build.sh' runs this before building the zipapp:
+    ./support_utils/build_index.py"""
+from __future__ import print_function
+
+import os
+import sys
+
+from glob import glob
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LP10_DIR = os.path.join(BASE_DIR, 'lp10_ms3_content_2016')
+INDEX_FILE = os.path.join(BASE_DIR, 'src', 'loopslib', 'catalog_index.pickle')
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+from loopslib import catalog  # NOQA pylint: disable=wrong-import-position
+
+print('Compiling catalog index {}'.format(INDEX_FILE))
+
+for release in catalog.compile_index(glob('{}/*.plist'.format(LP10_DIR)), INDEX_FILE):
+    print('  Indexed {}'.format(release))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Simple utility to measure the memory used by the package objects of the mirrored
+property lists. Run from the 'support_utils' folder:
+    ./package_memory.py [plist ...]
+
+Uses the catalog index if the feed is in it, so this measures the package objects and not
+the parsing of the property list. The packages are measured twice, as 'LoopPackage' objects
+and as a baseline of the same packages with every attribute (derived ones included) kept in
+an instance '__dict__', which is how 'LoopPackage' stored them before it was slotted."""
+from __future__ import print_function
+
+# pylint: disable=wrong-import-position
+
+import copy
+import gc
+import os
+import sys
+import tracemalloc
+
+from glob import glob
+from sys import argv
+
+
+BASE_DIR = os.getcwd().replace('support_utils', '')
+LP10_DIR = os.path.join(BASE_DIR, 'lp10_ms3_content_2016')
+
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+from loopslib import catalog  # NOQA
+from loopslib import misc  # NOQA
+from loopslib import package  # NOQA
+
+PLISTS = argv[1:] if len(argv) > 1 else sorted(glob('{}/*.plist'.format(LP10_DIR)))
+
+
+class DictPackage(object):
+    """The attributes of a package in an instance '__dict__', all computed when it is made."""
+    def __init__(self, pkg):
+        # A copy, so the derived attributes are computed afresh and not shared with 'pkg'.
+        _pkg = copy.copy(pkg)
+
+        for _attr in package.LoopPackage.VALID_KWARGS:
+            setattr(self, _attr, getattr(_pkg, _attr))
+
+
+def measure(baseline=False):
+    """Returns the number of feeds and packages loaded, and the memory used and peak memory
+    in bytes. The packages are replaced by 'DictPackage' objects if 'baseline' is 'True'."""
+    gc.collect()
+    tracemalloc.start()
+    _before, _ = tracemalloc.get_traced_memory()
+
+    _catalogs = list()
+
+    for _plist in PLISTS:
+        try:
+            _catalogs.append(catalog.Catalog(plist_path=_plist))
+        except ValueError as _e:
+            if not baseline:
+                print('Skipping {}: {}'.format(os.path.basename(_plist), _e))
+
+    if baseline:
+        for _catalog in _catalogs:
+            _catalog.packages = set(DictPackage(_pkg) for _pkg in _catalog.packages)
+            _catalog.mandatory_pkgs = set([_pkg for _pkg in _catalog.packages if _pkg.IsMandatory])
+            _catalog.optional_pkgs = _catalog.packages.difference(_catalog.mandatory_pkgs)
+
+    _packages = sum(len(_catalog.packages) for _catalog in _catalogs)
+
+    gc.collect()
+    _after, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return (len(_catalogs), _packages, _after - _before, _peak - _before)
+
+
+# Make sure the index is already read so it isn't counted against the packages.
+catalog.INDEX.get(os.path.basename(PLISTS[0]))
+
+FEEDS, PACKAGES, USED, PEAK = measure()
+_, _, BASELINE_USED, _ = measure(baseline=True)
+
+SAVED = BASELINE_USED - USED
+
+print('Feeds:         {}'.format(FEEDS))
+print('Packages:      {}'.format(PACKAGES))
+print('Memory used:   {} (peak {})'.format(misc.bytes2hr(USED), misc.bytes2hr(PEAK)))
+print('Per package:   {} bytes'.format(USED // PACKAGES if PACKAGES else 0))
+print('Baseline used: {} (__dict__ packages)'.format(misc.bytes2hr(BASELINE_USED)))
+print('Per package:   {} bytes'.format(BASELINE_USED // PACKAGES if PACKAGES else 0))
+print('Difference:    {} ({:.1f}%)'.format(misc.bytes2hr(SAVED),
+                                           (SAVED * 100.0 / BASELINE_USED) if BASELINE_USED else 0))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Simple utility to track how long appleloops takes to start for commands that exit
+straight away. Run from the 'support_utils' folder:
+    ./startup_time.py [runs]
+
+Each command is run 'runs' times (default 10) from the 'src' folder, and the fastest and
+median wall clock times are printed."""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+from sys import argv
+
+
+BASE_DIR = os.getcwd().replace('support_utils', '')
+SRC_DIR = os.path.join(BASE_DIR, 'src')
+RUNS = int(argv[1]) if len(argv) > 1 else 10
+
+COMMANDS = [['--help'],
+            ['--version'],
+            ['--supported-plists']]
+
+
+def run(cmd):
+    """Runs 'cmd', returning the wall clock time in milliseconds."""
+    _started = time.time()
+    subprocess.call(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    return (time.time() - _started) * 1000
+
+
+def timings(cmd):
+    """Returns the fastest and median times of 'RUNS' runs of 'cmd'."""
+    _times = sorted(run(cmd) for _ in range(RUNS))
+
+    return _times[0], _times[len(_times) // 2]
+
+
+print('{:<24} {:>10} {:>10}'.format('Command', 'Fastest', 'Median'))
+
+# Baseline for the interpreter itself.
+print('{:<24} {:>8.1f}ms {:>8.1f}ms'.format('(python startup)', *timings([sys.executable, '-c', 'pass'])))
+
+for _args in COMMANDS:
+    print('{:<24} {:>8.1f}ms {:>8.1f}ms'.format(' '.join(_args), *timings([sys.executable, SRC_DIR] + _args)))
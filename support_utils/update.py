@@ -6,9 +6,13 @@ from __future__ import print_function
 # pylint: disable=line-too-long
 # pylint: disable=too-many-nested-blocks
 
+import json
 import os
-import subprocess
+import plistlib
+import sys
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
 from sys import argv
@@ -19,137 +23,111 @@ LP10_DIR = os.path.join(BASE_DIR, 'lp10_ms3_content_2016')
 LIB_DIR = os.path.join(BASE_DIR, 'src', 'loopslib')
 SUPPORTED_FILE = os.path.join(LIB_DIR, 'supported.py')
 VERSION_FILE = os.path.join(LIB_DIR, 'version.py')
-CURL_PATH = ['/usr/bin/curl', '--http1.1']
+INDEX_FILE = os.path.join(LIB_DIR, 'catalog_index.pickle')
 APPLE_URL = 'https://audiocontentdownload.apple.com/lp10_ms3_content_2016'
 
+# Versions that didn't exist when last probed, and when they were probed. They aren't probed
+# again until 'MISSING_TTL' seconds have passed ('recheck' probes them all regardless).
+MISSING_FILE = os.path.join(BASE_DIR, 'support_utils', '.missing_feeds.json')
+MISSING_TTL = 60 * 60 * 24 * 7
+
+# HEAD requests sent at the same time, one per kept alive connection.
+HEAD_JOBS = 8
+
 APPS = {'garageband': range(1010, 1099),
         'logicpro': range(1020, 1099),
         'mainstage': range(320, 399)}
 
+sys.path.insert(0, os.path.join(BASE_DIR, 'src'))
+from loopslib import catalog  # NOQA pylint: disable=wrong-import-position
+from loopslib import http_pool  # NOQA pylint: disable=wrong-import-position
 
-def get_headers(url):
-    """Gets the headers of the provided URL, and returns the result as a dictionary.
-    Does not follow redirects."""
-    result = None
-    redirect_statuses = ['301 Moved Permanently',
-                         '302 Found',
-                         '302 Moved Temporarily',
-                         '303 See Other',
-                         '307 Temporary Redirect',
-                         '308 Permanent Redirect']
-
-    cmd = CURL_PATH + ['-I', '-L', url]
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    p_result, p_error = process.communicate()
-
-    if process.returncode is 0:
-        if isinstance(p_result, bytes):
-            result = dict()
-            # There's a trailing `\n` in the output, so tidy it up.
-            p_result = p_result.decode().strip()
-
-            # This handles if there is a redirect
-            if '\r\n\r' in p_result and any([status.lower() in p_result.lower() for status in redirect_statuses]):
-                p_result = p_result.split('\r\n\r')
-                p_result = p_result[-1]  # The redirect should be the last item in the output.
-
-            # Now tidy up
-            p_result = p_result.strip().splitlines()
-
-            for _line in p_result:
-                if (_line.startswith('HTTP/1.1 ') or _line.startswith('HTTP/2 ')) and ':' not in _line:
-                    result['Status'] = _line
-
-                    # Set the status code as a seperate value so we can minimise curl usage.
-                else:
-                    if ':' in _line:
-                        _key = _line.split(': ')[0]
-                        value = ''.join(_line.split(': ')[1:])
-
-                        if 'content-length' in _key.lower():
-                            value = int(value)
-
-                        result[_key] = value
-    else:
-        print('Error:\n{}'.format(p_error))
+
+def load_missing():
+    """Returns the versions that didn't exist when last probed, keyed by filename, with the
+    time they were probed."""
+    result = dict()
+
+    if os.path.exists(MISSING_FILE) and 'recheck' not in argv:
+        try:
+            with open(MISSING_FILE, 'r') as _f:
+                result = json.load(_f)
+        except (IOError, OSError, ValueError) as _e:
+            print('Unable to read {}: {}'.format(MISSING_FILE, _e))
 
     return result
 
 
-def get_status(headers):
-    """Returns the HTTP status code as its own attribute."""
-    result = None
+def save_missing(missing):
+    """Records the versions that didn't exist when probed."""
+    with open(MISSING_FILE, 'w') as _f:
+        json.dump(missing, _f, indent=2, sort_keys=True)
 
-    if headers:
-        status = headers.get('Status', None)
 
-        # HTTP status codes should be the first three numbers of this header.
-        if status:
-            result = status.split(' ')[1]
+def get_status(url):
+    """Returns the HTTP status code of a HEAD request for the provided URL (following
+    redirects), or 'None' if the request failed."""
+    result = None
 
-    if result:
-        try:
-            result = int(result)
-        except Exception:
-            raise
+    try:
+        resp = http_pool.POOL.request('HEAD', url)
+        result = resp.status
+        resp.release()
+    except (http_pool.TransferError, http_pool.http_client.HTTPException, OSError) as _e:
+        print('Error: {}: {}'.format(url, _e))
 
     return result
 
 
 def get(url, output):
-    """Retrieves the specified URL. Saves it to path specified in 'output' if present."""
-    cmd = CURL_PATH + ['-L', '-C', '-', url, '--progress-bar', '--create-dirs', '-o', output]
-    headers = get_headers(url)
-    gzipped = headers.get('Content-Encoding', False) == 'gzip'
-
-    if gzipped:
-        cmd.extend(['--compressed'])
-
-    try:
-        subprocess.check_call(cmd)
-    except subprocess.CalledProcessError:
-        raise
+    """Retrieves the specified URL, saving it to the path specified in 'output'."""
+    http_pool.fetch(url, output, compressed=True, progress=True)
 
 
 def convert_plist(plist_path):
-    """Used to convert a binary property list file to a format readable by Python 2.
-    The plist is converted out to stdout and then returned as a string."""
-    result = None
-    plutil = '/usr/bin/plutil'
+    """Converts a binary property list file to an XML property list, in place, so it is
+    readable by Python 2."""
+    with open(plist_path, 'rb') as _f:
+        _plist = plistlib.load(_f)
 
-    if not os.path.exists(plutil):
-        print('{} is required. Exiting.'.format(plutil))
-        exit(1)
+    with open(plist_path, 'wb') as _f:
+        plistlib.dump(_plist, _f, fmt=plistlib.FMT_XML)
 
-    cmd = [plutil, '-convert', 'xml1', plist_path]
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    p_result, p_error = process.communicate()
 
-    if process.returncode is 0:
-        result = p_result
-    else:
-        print(p_error)
+NEW_FILES = set()
 
-    return result
+# 'index_only' just recompiles the catalog index from the property lists already mirrored.
+if 'index_only' not in argv:
+    MISSING = load_missing()
+    NOW = time.time()
+    PROBE = list()
 
+    for app, version in APPS.items():
+        for ver in version:
+            filename = '{}{}.plist'.format(app, ver)
 
-NEW_FILES = set()
+            if os.path.exists(os.path.join(LP10_DIR, filename)):
+                print('Skipping {}'.format(filename))
+            elif NOW - MISSING.get(filename, 0) > MISSING_TTL:
+                PROBE.append(filename)
 
-for app, version in APPS.items():
-    for ver in version:
-        filename = '{}{}.plist'.format(app, ver)
-        _output = os.path.join(LP10_DIR, filename)
-        _url = '{}/{}'.format(APPLE_URL, filename)
+    print('Probing {} versions ({} known missing)'.format(len(PROBE), len(MISSING)))
 
-        _headers = get_headers(_url)
+    with ThreadPoolExecutor(max_workers=HEAD_JOBS) as _pool:
+        STATUSES = dict(zip(PROBE, _pool.map(get_status, ['{}/{}'.format(APPLE_URL, _f) for _f in PROBE])))
 
-        if get_status(_headers) == 200:
-            if os.path.exists(_output):
-                print('Skipping {}'.format(filename))
-            else:
-                print('Fetching {}'.format(filename))
-                get(_url, _output)
-                NEW_FILES.add(_output)
+    for filename, status in sorted(STATUSES.items()):
+        if status == 200:
+            MISSING.pop(filename, None)
+            print('Fetching {}'.format(filename))
+            _output = os.path.join(LP10_DIR, filename)
+            get('{}/{}'.format(APPLE_URL, filename), _output)
+            NEW_FILES.add(_output)
+        elif status in [403, 404]:
+            MISSING[filename] = NOW
+
+    http_pool.POOL.close_all()
+    save_missing(MISSING)
 
 NEW_FILES = list(NEW_FILES)
 
@@ -191,6 +169,14 @@ with open(SUPPORTED_FILE, 'w') as _f:
     _f.write(SUPPORT_METHOD)
 
 
+# Compile the catalog index that 'Application' and 'RemotePlist' load instead of parsing the
+# mirrored property lists.
+print('Compiling catalog index {}'.format(INDEX_FILE))
+
+for release in catalog.compile_index(PLISTS, INDEX_FILE):
+    print('  Indexed {}'.format(release))
+
+
 if 'update_ver' in argv or NEW_FILES:
     with open(VERSION_FILE, 'r') as _f:
         DOC = _f.readlines()